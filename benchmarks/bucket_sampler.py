@@ -0,0 +1,109 @@
+'''
+Compares the padded-token fraction and steps/sec of training batches from the old reader
+(consecutive chunks of total_data.csv), random batches (EpochShuffleSampler) and
+length-bucketed batches (BucketBatchSampler).
+
+Usage: python -m benchmarks.bucket_sampler [<csv-path>] [<rows>] [<batch-size>]
+If the CSV does not exist, synthetic data that mixes short pairs (like "8 gb" vs "10 gb")
+with long laptop titles is used. Steps/sec is measured with a small Transformer encoder
+over the padded batches, so it only reflects how much padding there is.
+'''
+
+import os
+import sys
+import time
+import random
+import numpy as np
+import torch
+import torch.nn as nn
+
+""" LOCAL IMPORTS """
+from src.training.dataset import TitlePairDataset, EpochShuffleSampler, BucketBatchSampler, pair_lengths, make_loader
+
+BATCH_SIZE = 32
+TIMED_STEPS = 100
+
+# The tags CharacterBERT adds to a pair ([CLS], [SEP], [SEP])
+TAGS = 3
+
+def synthetic_data(rows, seed=0):
+    words = ['intel', 'core', 'i7', '8gb', 'ram', '512gb', 'ssd', 'laptop', 'asus', 'vivobook', '15.6', 'inch', 'gb', 'tb']
+    rng = random.Random(seed)
+    data = []
+    for row in range(rows):
+        # A third of the pairs are tiny, like the ones from gen_neg_gb_data
+        low, high = (1, 2) if rng.random() < 1 / 3 else (10, 40)
+        data.append([' '.join(rng.choices(words, k=rng.randint(low, high))) for _ in range(2)])
+    return TitlePairDataset(np.array(data, dtype=object), np.array([rng.randint(0, 1) for _ in range(rows)], dtype='float32'))
+
+def chunked_batches(dataset, batch_size):
+    '''
+    The old reader: consecutive rows of the CSV
+    '''
+
+    for position in range(0, len(dataset), batch_size):
+        yield dataset.data[position:position + batch_size]
+
+def loader_batches(dataset, sampler, batch_size):
+    for batch_data, batch_labels in make_loader(dataset, sampler, batch_size):
+        yield batch_data
+
+def padding_fraction(batches):
+    tokens = 0
+    padded = 0
+    for batch_data in batches:
+        lengths = pair_lengths(batch_data) + TAGS
+        tokens += lengths.sum()
+        padded += lengths.max() * len(lengths)
+    return 1 - tokens / padded
+
+class Encoder(nn.Module):
+    def __init__(self):
+        super(Encoder, self).__init__()
+        self.embedding = nn.Embedding(1000, 128)
+        layer = nn.TransformerEncoderLayer(d_model=128, nhead=4, dim_feedforward=512, batch_first=True)
+        self.encoder = nn.TransformerEncoder(layer, num_layers=2)
+        self.fc1 = nn.Linear(128, 2)
+
+    def forward(self, x):
+        return self.fc1(self.encoder(self.embedding(x))[:, 0])
+
+def steps_per_sec(batches):
+    torch.manual_seed(0)
+    net = Encoder()
+    opt = torch.optim.Adam(net.parameters())
+    criterion = nn.CrossEntropyLoss()
+    start = time.perf_counter()
+    steps = 0
+    for batch_data in batches:
+        length = (pair_lengths(batch_data) + TAGS).max()
+        x = torch.randint(0, 1000, (len(batch_data), length))
+        loss = criterion(net(x), torch.zeros(len(batch_data), dtype=torch.long))
+        loss.backward()
+        opt.step()
+        opt.zero_grad()
+        steps += 1
+        if steps == TIMED_STEPS:
+            break
+    return steps / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/train/total_data.csv'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else BATCH_SIZE
+
+    if os.path.exists(path):
+        dataset = TitlePairDataset.from_csv(path, nrows=rows)
+    else:
+        print('Using synthetic data')
+        dataset = synthetic_data(rows)
+
+    lengths = pair_lengths(dataset.data)
+    readers = [('chunked read_csv', lambda: chunked_batches(dataset, batch_size)),
+               ('random batches', lambda: loader_batches(dataset, EpochShuffleSampler(len(dataset)), batch_size)),
+               ('bucketed (100 batches)', lambda: loader_batches(dataset, BucketBatchSampler(lengths, batch_size, bucket_batches=100), batch_size)),
+               ('bucketed (1000 batches)', lambda: loader_batches(dataset, BucketBatchSampler(lengths, batch_size, bucket_batches=1000), batch_size))]
+
+    print('{} pairs, batch size {}'.format(len(dataset), batch_size))
+    for name, batches in readers:
+        print('{:<26} {:>6.1%} padding {:>8.2f} steps/sec'.format(name, padding_fraction(batches()), steps_per_sec(batches())))
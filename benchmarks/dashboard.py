@@ -0,0 +1,75 @@
+'''
+Compares training steps/sec with NLP Dashboard off, with the old blocking requests.put calls
+on every batch, and with DashboardReporter. The dashboard is the stand-in server of
+src/training/dashboard_server.py, with a delay on every request like a real one over the network.
+
+Usage: python -m benchmarks.dashboard [<steps>] [<delay-ms>] [<batch-size>]
+'''
+
+import sys
+import time
+import random
+import numpy as np
+import requests
+import torch
+import torch.nn as nn
+
+""" LOCAL IMPORTS """
+from src.training.dashboard import DashboardReporter, batch_records
+from src.training.dashboard_server import DashboardServer
+
+WORDS = ['intel', 'core', 'i7', '8gb', 'ram', '512gb', 'ssd', 'laptop', 'asus', 'vivobook', '15.6', 'inch', 'gb', 'tb']
+
+def blocking_report(url, model_name):
+    '''
+    The old send_batch_data: two blocking requests for every batch
+    '''
+
+    def report(table, batch_info, examples):
+        requests.put(url + '/add_batch_data', json={'model_name': model_name, 'data': [batch_info], 'table': table})
+        requests.put(url + '/add_examples_data', json={'model_name': model_name, 'data': [examples], 'table': table})
+
+    return report
+
+def steps_per_sec(steps, batch_size, report=None):
+    torch.manual_seed(0)
+    rng = random.Random(0)
+    net = nn.Sequential(nn.Linear(256, 512), nn.ReLU(), nn.Linear(512, 2), nn.Softmax(dim=1))
+    opt = torch.optim.Adam(net.parameters())
+    criterion = nn.CrossEntropyLoss()
+    batch_data = np.array([[' '.join(rng.choices(WORDS, k=20)) for _ in range(2)] for _ in range(batch_size)], dtype=object)
+
+    start = time.perf_counter()
+    for step in range(steps):
+        x = torch.randn(batch_size, 256)
+        labels = np.array([rng.randint(0, 1) for _ in range(batch_size)], dtype='float32')
+        forward = net(x)
+        loss = criterion(forward, torch.from_numpy(labels).long())
+        loss.backward()
+        opt.step()
+        opt.zero_grad()
+        if report is not None:
+            report('Training', *batch_records(1, step + 1, batch_data, forward, labels, 0.5, loss.item(), 0.5, loss.item()))
+    return steps / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.01
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    print('{} steps, batch size {}, {:.0f} ms per dashboard request'.format(steps, batch_size, delay * 1000))
+    print('{:<24} {:>8.1f} steps/sec'.format('Dashboard off', steps_per_sec(steps, batch_size)))
+
+    with DashboardServer(delay=delay) as server:
+        print('{:<24} {:>8.1f} steps/sec'.format('Blocking requests', steps_per_sec(steps, batch_size, blocking_report(server.url, 'blocking'))))
+
+        reporter = DashboardReporter('reporter', url=server.url)
+        print('{:<24} {:>8.1f} steps/sec'.format('DashboardReporter', steps_per_sec(steps, batch_size, reporter.report)))
+        reporter.close()
+        print('{} requests made to the stand-in server, {} batches received by DashboardReporter'.format(
+              server.store.requests, len(server.store.tables['reporter']['Training']['batches'])))
+
+    # The dashboard being down does not stop training
+    reporter = DashboardReporter('down', url='http://127.0.0.1:9', timeout=0.5)
+    print('{:<24} {:>8.1f} steps/sec'.format('Dashboard down', steps_per_sec(steps, batch_size, reporter.report)))
+    reporter.close()
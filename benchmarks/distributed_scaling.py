@@ -0,0 +1,130 @@
+'''
+Measures how data-parallel training (src/training/distributed.py) scales with the amount of ranks.
+For 1, 2, 4 and 8 ranks it reports the training examples/sec and the time it takes to reach
+a target validation F1 score.
+
+Usage: python -m benchmarks.distributed_scaling [<max-ranks>] [<target-f1>]
+The task is synthetic (labels from a fixed random teacher network) so it runs without
+the data or the pretrained models, and the global batch size is the same for every amount of ranks.
+'''
+
+import os
+import sys
+import json
+import time
+import tempfile
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torch.distributed as dist
+
+""" LOCAL IMPORTS """
+from src.training import distributed
+from src.training.dataset import TitlePairDataset, EpochShuffleSampler, make_loader, seed_everything
+
+FEATURES = 256
+HIDDEN = 1024
+EXAMPLES = 32768
+VAL_EXAMPLES = 4096
+BATCH_SIZE = 256
+MAX_EPOCHS = 20
+
+def create_task(seed=0):
+    '''
+    Random inputs labeled by a fixed random network, split into training and validation data
+    '''
+
+    generator = torch.Generator().manual_seed(seed)
+    inputs = torch.randn(EXAMPLES + VAL_EXAMPLES, FEATURES, generator=generator)
+    teacher = torch.randn(FEATURES, generator=generator)
+    scores = inputs @ teacher + 0.5 * (inputs[:, 0] * inputs[:, 1])
+    labels = (scores > scores.median()).float()
+    return (TitlePairDataset(inputs[:EXAMPLES].numpy(), labels[:EXAMPLES].numpy()),
+            TitlePairDataset(inputs[EXAMPLES:].numpy(), labels[EXAMPLES:].numpy()))
+
+def create_model():
+    return nn.Sequential(nn.Linear(FEATURES, HIDDEN), nn.ReLU(), nn.Linear(HIDDEN, HIDDEN), nn.ReLU(), nn.Linear(HIDDEN, 2))
+
+def f1_score(net, dataset):
+    with torch.no_grad():
+        y_pred = torch.argmax(net(torch.from_numpy(dataset.data)), dim=1).numpy()
+
+    tp = np.sum((y_pred == 1) & (dataset.labels == 1))
+    fp = np.sum((y_pred == 1) & (dataset.labels == 0))
+    fn = np.sum((y_pred == 0) & (dataset.labels == 1))
+    return 2 * tp / max(2 * tp + fp + fn, 1)
+
+def run(rank, world_size, target_f1, result_path):
+    distributed.init_distributed(rank, world_size)
+    seed_everything(rank)
+    train_dataset, val_dataset = create_task()
+    sampler = EpochShuffleSampler(len(train_dataset), num_replicas=world_size, rank=rank)
+    loader = make_loader(train_dataset, sampler, BATCH_SIZE // world_size, seed=rank)
+
+    model = create_model()
+    net = distributed.wrap(model, world_size, find_unused_parameters=False)
+    criterion = nn.CrossEntropyLoss()
+    opt = optim.Adam(model.parameters(), lr=1e-3)
+
+    examples = 0
+    train_time = 0.0
+    time_to_target = None
+    f1 = 0.0
+    start = time.perf_counter()
+    for epoch in range(MAX_EPOCHS):
+        sampler.set_epoch(epoch)
+        epoch_start = time.perf_counter()
+        for batch_data, batch_labels in loader:
+            loss = criterion(net(torch.from_numpy(batch_data)), torch.from_numpy(batch_labels).long())
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            examples += len(batch_labels) * world_size
+
+        train_time += time.perf_counter() - epoch_start
+
+        # Rank 0 validates and tells the other ranks whether to stop
+        done = torch.tensor(0)
+        if rank == 0:
+            f1 = f1_score(model, val_dataset)
+            if f1 >= target_f1:
+                time_to_target = time.perf_counter() - start
+                done += 1
+
+        if world_size > 1:
+            dist.broadcast(done, 0)
+
+        if done.item():
+            break
+
+    if rank == 0:
+        with open(result_path, 'w') as f:
+            json.dump({'examples_per_sec': examples / train_time, 'time_to_target': time_to_target, 'epochs': epoch + 1, 'f1': f1}, f)
+
+    distributed.cleanup(world_size)
+
+if __name__ == '__main__':
+    max_ranks = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    target_f1 = float(sys.argv[2]) if len(sys.argv) > 2 else 0.9
+    print('{} CPU cores, global batch size {}, target F1 {}'.format(os.cpu_count(), BATCH_SIZE, target_f1))
+
+    port = int(distributed.MASTER_PORT)
+    for world_size in [1, 2, 4, 8]:
+        if world_size > max_ranks:
+            break
+
+        # A new port for every run so the last one does not have to be released first
+        os.environ['MASTER_PORT'] = str(port + world_size)
+        result_path = os.path.join(tempfile.mkdtemp(), 'result.json')
+        if world_size == 1:
+            run(0, 1, target_f1, result_path)
+        else:
+            distributed.spawn(run, world_size, target_f1, result_path)
+
+        with open(result_path) as f:
+            result = json.load(f)
+
+        time_to_target = '{:.2f}s'.format(result['time_to_target']) if result['time_to_target'] is not None else 'not reached'
+        print('{} ranks: {:>10.1f} examples/sec, time to F1 {}: {} ({} epochs, F1 {:.3f})'.format(
+              world_size, result['examples_per_sec'], target_f1, time_to_target, result['epochs'], result['f1']))
@@ -0,0 +1,96 @@
+'''
+Compares the per-epoch evaluation time of the old validation() loop (six suites one after another,
+batches of 2, autograd graphs and the L2 penalty on every batch) against EvaluationEngine.
+
+Usage: python -m benchmarks.evaluation [<pairs-per-suite>] [<eval-batch-size>]
+Uses synthetic suites that share some of their pairs (like the test sets made from the same titles)
+and a small Transformer encoder with a BERT-sized stand-in to regularize, so no data or pretrained
+models are needed.
+'''
+
+import sys
+import time
+import random
+import numpy as np
+import torch
+import torch.nn as nn
+
+""" LOCAL IMPORTS """
+from supervised_product_matching.regularization import L2Regularizer
+from src.training.evaluation import EvaluationEngine
+from benchmarks.regularization import bert_base_shapes
+
+WORDS = ['intel', 'core', 'i7', '8gb', 'ram', '512gb', 'ssd', 'laptop', 'asus', 'vivobook', '15.6', 'inch', 'gb', 'tb']
+
+class Encoder(nn.Module):
+    def __init__(self):
+        super(Encoder, self).__init__()
+        self.embedding = nn.Embedding(len(WORDS) + 2, 128)
+        layer = nn.TransformerEncoderLayer(d_model=128, nhead=4, dim_feedforward=512)
+        self.bert = nn.TransformerEncoder(layer, num_layers=2)
+        self.fc1 = nn.Linear(128, 2)
+        self.softmax = nn.Softmax(dim=1)
+
+        # Parameters as big as the ones CharacterBERT regularizes
+        self.stand_in = nn.ParameterList([nn.Parameter(torch.randn(shape) * 0.02) for shape in bert_base_shapes()])
+        self.regularizer = L2Regularizer({'fc1': [self.fc1], 'bert': [self.stand_in]}, {'fc1': 5e-1, 'bert': 7e-5})
+
+    def forward(self, x):
+        return self.softmax(self.fc1(self.bert(self.embedding(x).transpose(0, 1))[0]))
+
+def tokenize(batch_data):
+    ids = [[1] + [WORDS.index(word) + 2 for word in (title_one + ' ' + title_two).split()] for title_one, title_two in batch_data]
+    x = torch.zeros(len(ids), max(len(pair) for pair in ids), dtype=torch.long)
+    for row, pair in enumerate(ids):
+        x[row, :len(pair)] = torch.tensor(pair)
+    return x
+
+def forward_prop(batch_data, batch_labels, net, criterion, regularize=True, timer=None):
+    forward = net(tokenize(batch_data))
+    loss = criterion(forward, torch.from_numpy(batch_labels).view(-1).long())
+    if regularize:
+        loss += net.regularizer.penalty()
+    return loss, forward
+
+def synthetic_suites(pairs, seed=0):
+    rng = random.Random(seed)
+    shared = [[' '.join(rng.choices(WORDS, k=rng.randint(3, 30))) for _ in range(2)] for _ in range(pairs // 2)]
+    suites = []
+    for suite in range(6):
+        data = shared + [[' '.join(rng.choices(WORDS, k=rng.randint(3, 30))) for _ in range(2)] for _ in range(pairs - len(shared))]
+        labels = np.array([rng.randint(0, 1) for _ in range(pairs)], dtype='float32')
+        suites.append(('Suite {}'.format(suite + 1), np.array(data, dtype=object), labels))
+    return suites
+
+def old_validation(net, criterion, suites, batch_size=2):
+    '''
+    The old validation(): every suite on its own, with gradients and the L2 penalty
+    '''
+
+    for name, data, labels in suites:
+        for position in range(0, len(data), batch_size):
+            loss, forward = forward_prop(data[position:position + batch_size], labels[position:position + batch_size], net, criterion)
+            loss.item()
+
+if __name__ == '__main__':
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    torch.manual_seed(0)
+    net = Encoder()
+    net.eval()
+    criterion = nn.CrossEntropyLoss()
+    suites = synthetic_suites(pairs)
+
+    start = time.perf_counter()
+    old_validation(net, criterion, suites)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = EvaluationEngine(suites, batch_size=batch_size)
+    results = engine.evaluate(net, forward_prop, criterion)
+    engine_time = time.perf_counter() - start
+
+    print('{} suites of {} pairs ({} unique), eval batch size {}'.format(len(suites), pairs, len(engine.pairs), batch_size))
+    print('{:<24} {:>8.2f}s'.format('Old validation()', old_time))
+    print('{:<24} {:>8.2f}s ({:.1%} of the old time)'.format('EvaluationEngine', engine_time, engine_time / old_time))
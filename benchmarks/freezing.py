@@ -0,0 +1,87 @@
+'''
+Reports the step time and memory of training with different freezing policies
+(supervised_product_matching/freezing.py).
+Uses a randomly initialized BERT-base with a classification layer, so no pretrained weights are needed.
+Memory is the gradients and Adam state that were allocated, plus the RSS of the process
+(or the peak allocated memory on a GPU). Every policy runs in its own process so the RSS is not shared.
+
+Usage: python -m benchmarks.freezing [<steps>] [<policy> ...]
+'''
+
+import sys
+import time
+import multiprocessing
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from transformers import BertConfig, BertModel
+
+""" LOCAL IMPORTS """
+from supervised_product_matching.config import ModelConfig
+from supervised_product_matching.freezing import parse_policy, count_parameters
+from src.training.telemetry import process_rss
+
+BATCH_SIZE = 8
+SEQUENCE_LENGTH = 64
+POLICIES = ['none', 'names=bert.embeddings.*', 'depth=6', 'depth=10', 'depth=13']
+
+class StandIn(nn.Module):
+    def __init__(self):
+        super(StandIn, self).__init__()
+        self.bert = BertModel(BertConfig())
+        self.fc1 = nn.Linear(768, 2)
+
+    def forward(self, input_ids):
+        return self.fc1(self.bert(input_ids=input_ids)[1])
+
+def allocated_bytes(net, opt):
+    '''
+    Bytes of the gradients and the optimizer state
+    '''
+
+    grads = sum(param.grad.numel() * param.grad.element_size() for param in net.parameters() if param.grad is not None)
+    state = sum(value.numel() * value.element_size() for param_state in opt.state.values() for value in param_state.values() if torch.is_tensor(value))
+    return grads + state
+
+def benchmark(policy, steps):
+    torch.manual_seed(0)
+    net = StandIn().to(ModelConfig.device)
+    parse_policy(policy).apply(net)
+    opt = optim.Adam(net.parameters(), lr=1e-5)
+    criterion = nn.CrossEntropyLoss()
+    input_ids = torch.randint(0, 30522, (BATCH_SIZE, SEQUENCE_LENGTH), device=ModelConfig.device)
+    labels = torch.randint(0, 2, (BATCH_SIZE,), device=ModelConfig.device)
+
+    def step():
+        loss = criterion(net(input_ids), labels)
+        loss.backward()
+        opt.step()
+        opt.zero_grad(set_to_none=False)
+
+    # Warm up (and allocate the gradients and optimizer state)
+    step()
+    if ModelConfig.device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+
+    start = time.perf_counter()
+    for i in range(steps):
+        step()
+    if ModelConfig.device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / steps
+
+    memory = torch.cuda.max_memory_allocated() if ModelConfig.device.type == 'cuda' else process_rss()
+    trainable, total = count_parameters(net)
+    print('{:<26} {:>6.1f}% trainable {:>9.1f} ms/step {:>9.1f} MB grads+Adam {:>9.1f} MB {}'.format(
+          policy, 100 * trainable / total, elapsed * 1000, allocated_bytes(net, opt) / 2**20, memory / 2**20,
+          'peak' if ModelConfig.device.type == 'cuda' else 'RSS'))
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    policies = sys.argv[2:] or POLICIES
+    print('Batch size {}, sequence length {}, device {}'.format(BATCH_SIZE, SEQUENCE_LENGTH, ModelConfig.device))
+    context = multiprocessing.get_context('spawn')
+    for policy in policies:
+        process = context.Process(target=benchmark, args=(policy, steps))
+        process.start()
+        process.join()
@@ -0,0 +1,85 @@
+'''
+Compares the examples/sec of the old chunked read_csv training loop against the
+DataLoader pipeline in src/training/dataset.py.
+
+Usage: python -m benchmarks.input_pipeline [<csv-path>] [<rows>]
+If the CSV does not exist, a synthetic one with the same columns as total_data.csv is used.
+'''
+
+import os
+import sys
+import time
+import random
+import tempfile
+import pandas as pd
+
+""" LOCAL IMPORTS """
+from src.training.dataset import TitlePairDataset, EpochShuffleSampler, make_loader
+
+BATCH_SIZE = 4
+EPOCHS = 2
+
+def create_synthetic_csv(path, rows):
+    '''
+    Writes a CSV with the columns of total_data.csv and random titles
+    '''
+
+    words = ['intel', 'core', 'i7', '8gb', 'ram', '512gb', 'ssd', 'laptop', 'asus', 'vivobook', '15.6', 'inch']
+    titles = [[' '.join(random.choices(words, k=random.randint(2, 40))) for _ in range(2)] for _ in range(rows)]
+    df = pd.DataFrame(titles, columns=['title_one', 'title_two'])
+    df['label'] = [random.randint(0, 1) for _ in range(rows)]
+    df['index'] = range(rows)
+    df.to_csv(path, index=False)
+
+def chunked_read_csv(path, rows):
+    '''
+    The old loop: read the CSV in BATCH_SIZE chunks and re-open it every epoch
+    '''
+
+    examples = 0
+    for epoch in range(EPOCHS):
+        train_data = pd.read_csv(path, nrows=rows, chunksize=BATCH_SIZE)
+        for position in range(0, rows, BATCH_SIZE):
+            batch_data = next(train_data)
+            del batch_data['index']
+            batch_data = batch_data.to_numpy()
+            batch_labels = batch_data[:, 2].astype('float32')
+            batch_data = batch_data[:, 0:2]
+            examples += len(batch_labels)
+
+    return examples
+
+def data_loader(path, rows, num_workers):
+    '''
+    The new pipeline: load the CSV once and shuffle every epoch
+    '''
+
+    examples = 0
+    dataset = TitlePairDataset.from_csv(path, nrows=rows)
+    sampler = EpochShuffleSampler(len(dataset))
+    loader = make_loader(dataset, sampler, BATCH_SIZE, num_workers=num_workers)
+    for epoch in range(EPOCHS):
+        sampler.set_epoch(epoch)
+        for batch_data, batch_labels in loader:
+            examples += len(batch_labels)
+
+    return examples
+
+def benchmark(name, fn, *args):
+    start = time.perf_counter()
+    examples = fn(*args)
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>10} examples {:>8.2f}s {:>12.1f} examples/sec'.format(name, examples, elapsed, examples / elapsed))
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/train/total_data.csv'
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    if not os.path.exists(path):
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic_total_data.csv')
+        print('Using synthetic data at {}'.format(path))
+        create_synthetic_csv(path, rows)
+
+    benchmark('chunked read_csv', chunked_read_csv, path, rows)
+    benchmark('DataLoader (0 workers)', data_loader, path, rows, 0)
+    benchmark('DataLoader (2 workers)', data_loader, path, rows, 2)
@@ -0,0 +1,34 @@
+'''
+Reports the rows/sec of the pseudo-laptop generator (src/data_creation/laptop_data_creation.py)
+with different batch sizes and amounts of worker processes.
+The spec attributes are read from data/base like when creating the data.
+
+Usage: python -m benchmarks.pseudo_laptop [<combinations>] [<processes> ...]
+'''
+
+import sys
+import time
+
+""" LOCAL IMPORTS """
+from src.data_creation.laptop_data_creation import sample_spec_numbers, spec_combo_count, create_pos_neg_data, PSEUDO_LAPTOP_BATCH
+
+BATCH_SIZES = [1000, PSEUDO_LAPTOP_BATCH]
+PROCESSES = [1, 2, 4]
+
+def benchmark(numbers, batch_size, processes):
+    start = time.perf_counter()
+    df = create_pos_neg_data(numbers, seed=0, batch_size=batch_size, processes=processes)
+    elapsed = time.perf_counter() - start
+    print('{:>10} batch {:>4} processes {:>10} rows {:>8.2f}s {:>12.1f} rows/sec'.format(batch_size, processes, len(df), elapsed, len(df) / elapsed))
+
+if __name__ == '__main__':
+    combinations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    processes = [int(arg) for arg in sys.argv[2:]] or PROCESSES
+
+    start = time.perf_counter()
+    numbers = sample_spec_numbers(combinations, seed=0)
+    print('Sampled {} of {} spec combinations in {:.3f}s'.format(len(numbers), spec_combo_count(), time.perf_counter() - start))
+
+    for batch_size in BATCH_SIZES:
+        for amount in processes:
+            benchmark(numbers, batch_size, amount)
@@ -0,0 +1,79 @@
+'''
+Compares the step time of the old per-parameter L2 loop against L2Regularizer.
+Uses a stand-in module with the parameter shapes of BERT-base (what CharacterBERT
+regularizes), so no pretrained weights are needed.
+
+Usage: python -m benchmarks.regularization [<steps>]
+'''
+
+import sys
+import time
+import torch
+import torch.nn as nn
+
+""" LOCAL IMPORTS """
+from supervised_product_matching.config import ModelConfig
+from supervised_product_matching.regularization import L2Regularizer
+
+def bert_base_shapes(h_size=768, layers=12, inner=3072):
+    '''
+    Parameter shapes of the encoder of BERT-base
+    '''
+
+    shapes = [(512, h_size), (2, h_size), (h_size,), (h_size,)]
+    for layer in range(layers):
+        shapes += [(h_size, h_size), (h_size,)] * 4
+        shapes += [(h_size,), (h_size,), (inner, h_size), (inner,), (h_size, inner), (h_size,), (h_size,), (h_size,)]
+    return shapes + [(h_size, h_size), (h_size,)]
+
+class StandIn(nn.Module):
+    def __init__(self):
+        super(StandIn, self).__init__()
+        self.bert = nn.ParameterList([nn.Parameter(torch.randn(shape) * 0.02) for shape in bert_base_shapes()])
+        self.fc1 = nn.Linear(768, 2)
+
+def loop_penalty(net):
+    '''
+    The old forward_prop regularization
+    '''
+
+    l2_reg_fc = torch.tensor(0.).to(ModelConfig.device)
+    for param in net.fc1.parameters():
+        l2_reg_fc += torch.norm(param)
+
+    l2_reg_bert = torch.tensor(0.).to(ModelConfig.device)
+    for param in net.bert.parameters():
+        l2_reg_bert += torch.norm(param)
+
+    return 5e-1 * l2_reg_fc + 7e-5 * l2_reg_bert
+
+def benchmark(name, net, step_fn, steps):
+    # Warm up
+    step_fn()
+
+    start = time.perf_counter()
+    for step in range(steps):
+        step_fn()
+    if ModelConfig.device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / steps
+    print('{:<32} {:>8.2f} ms/step'.format(name, elapsed * 1000))
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    net = StandIn().to(ModelConfig.device)
+    regularizer = L2Regularizer({'fc1': [net.fc1], 'bert': [net.bert]}, {'fc1': 5e-1, 'bert': 7e-5})
+
+    # Check that every way of regularizing gives the same gradients
+    loop_penalty(net).backward()
+    loop_grads = [param.grad.clone() for param in net.parameters()]
+    net.zero_grad()
+    regularizer.apply_gradients()
+    max_difference = max((param.grad - grad).abs().max().item() for param, grad in zip(net.parameters(), loop_grads))
+    print('Max gradient difference: {:.3e}'.format(max_difference))
+
+    # In training the gradients already exist from the loss when the penalty is added
+    print('{} parameter tensors on {}'.format(len(list(net.parameters())), ModelConfig.device))
+    benchmark('Per-parameter loop', net, lambda: loop_penalty(net).backward(), steps)
+    benchmark('L2Regularizer.penalty', net, lambda: regularizer.penalty().backward(), steps)
+    benchmark('L2Regularizer.apply_gradients', net, regularizer.apply_gradients, steps)
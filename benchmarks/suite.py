@@ -0,0 +1,289 @@
+'''
+Micro-benchmarks of the preprocessing and model hot paths, written to JSON so a change
+can be compared against a stored baseline.
+
+Usage:
+  python -m benchmarks.suite run [-o <results.json>] [-filter <text>] [-quick]
+  python -m benchmarks.suite compare <baseline.json> <results.json> [-threshold <fraction>]
+
+run times every case (cases whose data or models are not available, like the BERT tokenizer
+without a network connection or the pretrained models, are reported as skipped).
+The forward/backward cases also run with the randomly initialized tiny encoder, which needs
+no pretrained-models directory.
+compare prints the change of every case and exits with 1 if any case got slower by more
+than the threshold (default 0.1, so 10%).
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import statistics
+import numpy as np
+import pandas as pd
+
+WORDS = ['intel', 'core', 'i7-8550u', '8gb', 'ram', '512gb', 'ssd', 'laptop', 'asus', 'vivobook', '15.6"', 'inch',
+         'fhd', 'windows', '10', 'home', 'nvidia', 'geforce', 'gtx', '1050', '1tb', 'hdd', 'the', 'and', 'with']
+
+# Batch sizes and title lengths (in words) the batched cases are run with
+BATCH_SIZES = [8, 64]
+TITLE_LENGTHS = [10, 40]
+
+# Batch sizes and title lengths of the forward/backward cases (smaller, the models are slow on a CPU)
+MODEL_BATCH_SIZES = [2, 8]
+MODEL_TITLE_LENGTHS = [10, 40]
+
+# Architectures that are benchmarked (the options of -M)
+ARCHITECTURES = ['characterbert', 'bert', 'scaled-characterbert-concat', 'scaled-characterbert-add']
+
+# Encoders the architectures are benchmarked with (the options of -encoder)
+ENCODERS = ['pretrained', 'tiny']
+
+# Amount of timed repeats of every case and the least time each repeat runs for
+REPEATS = 7
+MIN_REPEAT_TIME = 0.1
+
+def titles(amount, length, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(WORDS, k=length)) for _ in range(amount)]
+
+def pairs(amount, length, seed=0):
+    return np.array(list(zip(titles(amount, length, seed), titles(amount, length, seed + 1))), dtype=object)
+
+class Skip(Exception):
+    '''
+    Raised by a case whose setup is not possible on this machine
+    '''
+
+def needs(import_fn):
+    '''
+    Runs an import, turning a missing module, dataset or model into a Skip
+    '''
+
+    try:
+        return import_fn()
+    except Skip:
+        raise
+    except Exception as e:
+        raise Skip('{}: {}'.format(type(e).__name__, str(e).splitlines()[0] if str(e) else ''))
+
+def model_preprocessing():
+    import supervised_product_matching.model_preprocessing as module
+    return module
+
+def stop_word_cases():
+    remove_stop_words = needs(model_preprocessing).remove_stop_words
+    for length in TITLE_LENGTHS:
+        title = titles(1, length)[0]
+        needs(lambda: remove_stop_words(title))
+        yield 'remove_stop_words/words={}'.format(length), lambda title=title: remove_stop_words(title)
+
+def add_tags_cases():
+    add_tags = needs(model_preprocessing).add_tags
+    for batch_size in BATCH_SIZES:
+        for length in TITLE_LENGTHS:
+            x = pairs(batch_size, length).astype('U')
+            yield 'add_tags/batch={}/words={}'.format(batch_size, length), lambda x=x: add_tags(x)
+
+def preprocess_cases():
+    module = needs(model_preprocessing)
+    for batch_size in BATCH_SIZES:
+        for length in TITLE_LENGTHS:
+            x = pairs(batch_size, length)
+            yield ('character_bert_preprocess_batch/batch={}/words={}'.format(batch_size, length),
+                   lambda x=x: module.character_bert_preprocess_batch(x))
+
+def bert_preprocess_cases():
+    module = needs(model_preprocessing)
+
+    # The tokenizer is downloaded the first time it is used, so it is loaded before anything is timed
+    needs(module.get_bert_tokenizer)
+    for batch_size in BATCH_SIZES:
+        for length in TITLE_LENGTHS:
+            x = pairs(batch_size, length)
+            yield ('bert_preprocess_batch/batch={}/words={}'.format(batch_size, length),
+                   lambda x=x: module.bert_preprocess_batch(x))
+
+def key_attrs_cases():
+    get_key_attrs = needs(lambda: __import__('src.data_creation.retailer_laptop_train_creation', fromlist=['get_key_attrs']).get_key_attrs)
+    title = 'ASUS VivoBook 15.6" FHD Laptop, Intel Core i7-8550U 1.8GHz, 8GB DDR4 RAM, 512GB SSD + 1TB HDD, NVIDIA GeForce GTX 1050, Windows 10 Home'
+    yield 'get_key_attrs', lambda: get_key_attrs(title)
+
+def unit_cases():
+    module = needs(lambda: __import__('src.data_preprocessing', fromlist=['randomize_units']))
+    randomize_units, replace_space_df = module.randomize_units, module.replace_space_df
+    rng = random.Random(0)
+    rows = [['laptop {}gb ram {} gb ssd {}tb hdd'.format(rng.choice([4, 8, 16]), rng.choice([256, 512]), rng.choice([1, 2])),
+             'notebook {} gb ram {}gb ssd'.format(rng.choice([4, 8, 16]), rng.choice([256, 512])), 1] for _ in range(1000)]
+    df = pd.DataFrame(rows, columns=['title_one', 'title_two', 'label'])
+    units = ['gb', 'tb']
+
+    # The functions change the DataFrame in place, so each call gets a copy (copying is a small part of the time)
+    yield 'randomize_units/rows=1000', lambda: randomize_units(df.copy(), units)
+    yield 'replace_space_df/rows=1000', lambda: replace_space_df(df.copy(), units, space=False)
+
+def model_cases(using_model, encoder='pretrained'):
+    nn = needs(lambda: __import__('torch.nn', fromlist=['CrossEntropyLoss']))
+    load_architecture = needs(lambda: __import__('torch_train_model', fromlist=['load_architecture']).load_architecture)
+    parse_encoder = needs(lambda: __import__('supervised_product_matching.config', fromlist=['parse_encoder']).parse_encoder)
+    SiameseNetwork, forward_prop = needs(lambda: load_architecture(using_model))
+
+    # The BERT architecture tokenizes with the downloaded tokenizer (even with a random encoder)
+    if using_model == 'bert':
+        needs(needs(model_preprocessing).get_bert_tokenizer)
+    # Only the pretrained encoders need files that may be missing, so building the others must not fail
+    if encoder == 'pretrained':
+        net = needs(lambda: SiameseNetwork(encoder=parse_encoder(encoder)))
+    else:
+        net = SiameseNetwork(encoder=parse_encoder(encoder))
+    net.train()
+    criterion = nn.CrossEntropyLoss()
+    for batch_size in MODEL_BATCH_SIZES:
+        for length in MODEL_TITLE_LENGTHS:
+            x = pairs(batch_size, length)
+            labels = np.array([i % 2 for i in range(batch_size)], dtype='float32')
+
+            def step(x=x, labels=labels):
+                loss, forward = forward_prop(x, labels, net, criterion)
+                loss.backward()
+                net.zero_grad()
+
+            # The pretrained cases keep their names from before there were other encoders
+            model = using_model if encoder == 'pretrained' else '{}/{}'.format(using_model, encoder)
+            yield 'forward_backward/{}/batch={}/words={}'.format(model, batch_size, length), step
+
+# Groups of cases, each a generator of (name, function) that raises Skip if it cannot run here
+GROUPS = [('remove_stop_words', stop_word_cases),
+          ('add_tags', add_tags_cases),
+          ('preprocess_batch', preprocess_cases),
+          ('bert_preprocess_batch', bert_preprocess_cases),
+          ('get_key_attrs', key_attrs_cases),
+          ('units', unit_cases)] + \
+         [('forward_backward/{}/{}'.format(using_model, encoder), lambda using_model=using_model, encoder=encoder: model_cases(using_model, encoder))
+          for using_model in ARCHITECTURES for encoder in ENCODERS]
+
+def time_case(fn, repeats=REPEATS, min_repeat_time=MIN_REPEAT_TIME):
+    '''
+    Times fn like timeit: calls per repeat are calibrated so a repeat takes at least min_repeat_time.
+    Returns the seconds per call of every repeat.
+    '''
+
+    # Warm up (and find how long a call takes)
+    start = time.perf_counter()
+    fn()
+    once = time.perf_counter() - start
+    number = max(1, int(min_repeat_time / max(once, 1e-9)))
+
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        for call in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+def machine():
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__}
+    try:
+        import torch
+        info['torch'] = torch.__version__
+        info['threads'] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+def run(output, name_filter=None, quick=False):
+    results = {}
+    skipped = {}
+    repeats = 3 if quick else REPEATS
+    for group, cases in GROUPS:
+        try:
+            for name, fn in cases():
+                if name_filter and name_filter not in name:
+                    continue
+                times = time_case(fn, repeats=repeats, min_repeat_time=MIN_REPEAT_TIME / 4 if quick else MIN_REPEAT_TIME)
+                results[name] = {'median_ms': statistics.median(times) * 1000,
+                                 'min_ms': min(times) * 1000,
+                                 'stdev_ms': statistics.stdev(times) * 1000 if len(times) > 1 else 0.0,
+                                 'repeats': len(times)}
+                print('{:<64} {:>12.4f} ms'.format(name, results[name]['median_ms']))
+        except Skip as e:
+            skipped[group] = str(e)
+            print('{:<64} skipped ({})'.format(group, e))
+
+    report = {'timestamp': time.time(), 'machine': machine(), 'results': results, 'skipped': skipped}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print('Wrote {} results to {}'.format(len(results), output))
+
+def compare(baseline_path, results_path, threshold=0.1):
+    '''
+    Prints the change of every case between two result files. Returns the cases that got slower than the threshold.
+    '''
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    with open(results_path) as f:
+        results = json.load(f)['results']
+
+    regressions = []
+    print('{:<64} {:>12} {:>12} {:>8}'.format('Case', 'Baseline ms', 'Now ms', 'Change'))
+    for name in sorted(set(baseline) | set(results)):
+        if name not in baseline or name not in results:
+            print('{:<64} {}'.format(name, 'only in the baseline' if name in baseline else 'new'))
+            continue
+
+        # The minimum is the least noisy estimate of how fast the code can run
+        change = results[name]['min_ms'] / baseline[name]['min_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' SLOWER'
+        elif change < -threshold:
+            flag = ' faster'
+        print('{:<64} {:>12.4f} {:>12.4f} {:>+7.1%}{}'.format(name, baseline[name]['min_ms'], results[name]['min_ms'], change, flag))
+
+    if regressions:
+        print('{} cases are more than {:.0%} slower than the baseline'.format(len(regressions), threshold))
+    return regressions
+
+def main(argv):
+    if not argv or argv[0] == '--help':
+        print(__doc__)
+        return 0
+
+    command, argv = argv[0], argv[1:]
+    if command == 'run':
+        output = 'benchmarks/results.json'
+        name_filter = None
+        quick = False
+        while argv:
+            if argv[0] == '-o':
+                output = argv[1]
+                argv = argv[2:]
+            elif argv[0] == '-filter':
+                name_filter = argv[1]
+                argv = argv[2:]
+            elif argv[0] == '-quick':
+                quick = True
+                argv = argv[1:]
+            else:
+                print('Unknown option {}'.format(argv[0]))
+                return 2
+        run(output, name_filter, quick)
+        return 0
+
+    if command == 'compare':
+        threshold = 0.1
+        if '-threshold' in argv:
+            threshold = float(argv[argv.index('-threshold') + 1])
+        return 1 if compare(argv[0], argv[1], threshold) else 0
+
+    print('Unknown command {}'.format(command))
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,3 +1,4 @@
+import sys
 import pandas as pd
 import numpy as np
 
@@ -14,6 +15,18 @@ from src.data_creation.pcpartpicker_data_creation import create_pcpartpicker_dat
 from src.data_creation.retailer_test_creation import create_laptop_test_data
 from src.data_creation.neg_laptop_test_creation import create_neg_laptop_test_data
 from src.data_creation.retailer_laptop_train_creation import create_retailer_laptop_train_data
+from src.data_creation.gs_data_creation import NORMALIZED_COMPUTER_PATH
+from src.data_creation.pipeline import Stage, Manifest, run_stages
+
+# Where the keys and hashes of the stages that were built are kept
+MANIFEST_PATH = 'data/manifest.json'
+
+# Seed of every stage (changing it rebuilds everything)
+SEED = 0
+
+# Source files that most stages use (a change to them rebuilds the stages)
+COMMON_CODE = ['src/common.py', 'src/data_preprocessing.py', 'supervised_product_matching/model_preprocessing.py']
+LAPTOP_CODE = COMMON_CODE + ['src/data_creation/laptop_data_classes.py']
 
 def gen_gb_pos_data():
     '''
@@ -44,29 +57,34 @@ def gen_neg_gb_data():
 
     return pd.DataFrame(neg, columns = Common.COLUMN_NAMES)
 
-def create_data():
+# The files every stage of the training data reads (if they exist) and writes
+LAPTOP_BASE = ['data/base/cpu_data.csv', 'data/base/video-cards-data.csv', 'data/base/laptops.csv']
+TEST_FILES = ['data/test/final_laptop_test_data.csv',
+              'data/test/final_gb_space_laptop_test.csv',
+              'data/test/final_gb_no_space_laptop_test.csv',
+              'data/test/final_retailer_gb_space_test.csv',
+              'data/test/final_retailer_gb_no_space_test.csv']
+TRAIN_FILES = ['data/train/wdc_computers.csv',
+               'data/train/spec_train_data_new.csv',
+               'data/train/final_pcpartpicker_data.csv',
+               'data/train/more_cpu_data.csv',
+               'data/train/more_drive_data.csv',
+               'data/train/retailer_laptop_data.csv']
+
+def create_pseudo_laptop_stage():
+    # The spec attributes have to be in the process that creates the data
+    populate_spec()
+    create_pseudo_laptop_data()
+
+def create_total_data():
     '''
-    Runs the necessary functions to create the data for training.
+    Concatenates the training data of every stage (and the gigabyte data) into total_data.csv
     '''
-    
-    # Don't show the copy warnings
-    pd.set_option('mode.chained_assignment', None)
 
-    # Run the functions
-    populate_spec()
-    create_pcpartpicker_data()
-    create_general_cpu_data()
-    create_final_drive_data()
-    create_pseudo_laptop_data()
+    print('Generating gigabyte data (as in just examples that use GB)')
     final_gb_data = create_final_data(gen_gb_pos_data(), gen_neg_gb_data())
     final_gb_data.reset_index(inplace=True)
     randomize_units(final_gb_data, units=['gb'])
-    create_laptop_test_data()
-    create_neg_laptop_test_data()
-    create_retailer_laptop_train_data()
-    create_computer_gs_data()
-
-    print('Generating gigabyte data (as in just examples that use GB)')
 
     # Load all the data
     final_computer_df = pd.read_csv('data/train/wdc_computers.csv')
@@ -99,6 +117,69 @@ def create_data():
     # Save the data
     total_data.to_csv('data/train/total_data.csv', index=False)
 
+# The stages of the data creation (the order they are started in when they do not depend on each other)
+STAGES = [Stage('computer_gs', create_computer_gs_data,
+                inputs=['data/base/offers_corpus_english_v2.json.gz', 'data/base/computer_wdc_whole_no_duplicates.csv'],
+                outputs=['data/train/wdc_computers.csv', NORMALIZED_COMPUTER_PATH],
+                code=COMMON_CODE + ['src/pair_sink.py'],
+                seed=SEED),
+          Stage('pseudo_laptop', create_pseudo_laptop_stage,
+                inputs=LAPTOP_BASE,
+                outputs=['data/train/spec_train_data_new.csv'],
+                code=LAPTOP_CODE + ['src/data_creation/laptop_data_creation.py'],
+                seed=SEED),
+          Stage('retailer_laptop_train', create_retailer_laptop_train_data,
+                inputs=LAPTOP_BASE + ['data/base/intel_cpus.csv', 'data/base/amd_cpus.csv', 'data/base/amazon_laptop_titles.csv',
+                                      'data/base/walmart_laptop_titles.csv', 'data/base/newegg_laptop_titles.csv'],
+                outputs=['data/train/retailer_laptop_data.csv'],
+                code=LAPTOP_CODE,
+                seed=SEED),
+          Stage('pcpartpicker', create_pcpartpicker_data,
+                inputs=['data/base/pos_ram_titles.csv', 'data/base/pos_cpu_titles.csv', 'data/base/pos_hard_drive_titles.csv'],
+                outputs=['data/train/final_pcpartpicker_data.csv'],
+                code=COMMON_CODE + ['src/pair_sink.py'],
+                seed=SEED),
+          Stage('general_cpu', create_general_cpu_data,
+                inputs=['data/base/cpu_data.csv'],
+                outputs=['data/train/more_cpu_data.csv'],
+                code=COMMON_CODE,
+                seed=SEED),
+          Stage('general_drive', create_final_drive_data,
+                outputs=['data/train/more_drive_data.csv'],
+                code=COMMON_CODE,
+                seed=SEED),
+          Stage('laptop_test', create_laptop_test_data,
+                inputs=['data/base/retailer_test.csv'],
+                outputs=TEST_FILES[:1],
+                code=COMMON_CODE,
+                seed=SEED),
+          Stage('neg_laptop_test', create_neg_laptop_test_data,
+                inputs=['data/base/retailer_test.csv'],
+                outputs=TEST_FILES[1:],
+                code=COMMON_CODE + ['src/data_creation/retailer_test_creation.py'],
+                seed=SEED),
+          Stage('total_data', create_total_data,
+                inputs=TRAIN_FILES,
+                outputs=['data/train/total_data.csv'],
+                code=COMMON_CODE,
+                seed=SEED)]
+
+def create_data(processes=None, force=False):
+    '''
+    Runs the necessary functions to create the data for training.
+    The stages that do not depend on each other run in parallel (up to processes at a time).
+    Only the stages whose inputs, code or seed changed since they were built (according to
+    data/manifest.json) are run again, unless force is set.
+    '''
+    
+    # Don't show the copy warnings
+    pd.set_option('mode.chained_assignment', None)
+
+    # Run the stages
+    return run_stages(STAGES, processes, manifest=Manifest(MANIFEST_PATH), force=force)
+
 
 if __name__ == "__main__":
-    create_data()
+    # Optionally, the amount of stages that run at the same time and --force to rebuild every stage
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    create_data(int(args[0]) if args else None, force='--force' in sys.argv[1:])
@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import concurrent.futures
+import torch
+import torch.multiprocessing as mp
+
+""" LOCAL IMPORTS """
+from src.training.search import ARCHITECTURES, sample_configs, rung_epochs, promote, scalar_metrics, SearchResults
+from torch_train_model import parse_options, load_architecture, train, EPOCHS
+from create_data import create_data
+
+# Amount of random configurations tried
+TRIALS = 8
+
+# Amount of trials trained at the same time (the CPU threads are split between them)
+PARALLEL = 2
+
+# Epochs every trial is trained for before the first pruning
+MIN_EPOCHS = 1
+
+# Only the best 1/ETA of the trials are trained further at each rung (and for ETA times more epochs)
+ETA = 3
+
+def usage():
+    print('Usage: search_model.py [OPTIONS] [-- <TRAINING-OPTIONS>]')
+    print('  OPTIONS:')
+    print('     -O <folder>                The folder in models the trials and search_results.jsonl are saved to. Default is "search".')
+    print('     -trials <amount>           Amount of random configurations (model, learning rate and L2 lambdas) to try. Default is {}.'.format(TRIALS))
+    print('     -parallel <amount>         Amount of trials trained at the same time. The CPU threads are split between them. Default is {}.'.format(PARALLEL))
+    print('     -models <model,..>         The models to try (options of -M). Default is {}.'.format(','.join(ARCHITECTURES)))
+    print('     -min-epochs <amount>       Epochs every trial is trained for before the worst are stopped. Default is {}.'.format(MIN_EPOCHS))
+    print('     -max-epochs <amount>       Epochs the best trials are trained for. Default is {}.'.format(EPOCHS))
+    print('     -eta <factor>              Keep the best 1/eta of the trials at each rung and train them eta times longer. Default is {}.'.format(ETA))
+    print('     -seed <seed>               Seed for sampling the configurations. Default is 0.')
+    print('  TRAINING-OPTIONS:')
+    print('     Options of torch_train_model.py used by every trial (ex: -- -split 0.1 -B 8).')
+    print('  SUBCOMMAND:')
+    print('     --help                     Prints out this usage information and exit.')
+
+def parse_search_options(argv):
+    '''
+    Parses the command line into the options of the search and the training options of the trials
+    '''
+
+    options = {'folder': 'search',
+               'trials': TRIALS,
+               'parallel': PARALLEL,
+               'models': ARCHITECTURES,
+               'min_epochs': MIN_EPOCHS,
+               'max_epochs': EPOCHS,
+               'eta': ETA,
+               'seed': 0}
+
+    training_argv = []
+    if '--' in argv:
+        training_argv = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    while len(argv) > 0:
+        if argv[0] == '-O':
+            argv = argv[1:]
+            options['folder'] = argv[0]
+            argv = argv[1:]
+
+        elif argv[0] in ('-trials', '-parallel', '-min-epochs', '-max-epochs', '-eta', '-seed'):
+            options[argv[0][1:].replace('-', '_')] = int(argv[1])
+            argv = argv[2:]
+
+        elif argv[0] == '-models':
+            argv = argv[1:]
+            options['models'] = argv[0].split(',')
+            argv = argv[1:]
+
+        elif argv[0] == '--help':
+            usage()
+            exit(0)
+
+        else:
+            print('Unknown option {}'.format(argv[0]))
+            usage()
+            sys.exit(1)
+
+    unknown = [model for model in options['models'] if model not in ARCHITECTURES]
+    if unknown:
+        print('Model {} not found.'.format(unknown[0]))
+        sys.exit(1)
+
+    return options, parse_options(training_argv)
+
+def set_threads(threads):
+    '''
+    Runs in every worker process of the pool so the trials do not oversubscribe the cores
+    '''
+
+    torch.set_num_threads(threads)
+
+def run_trial(config, epochs, resume, training_options):
+    '''
+    Trains a trial (in a worker process) up to epochs and returns its validation metrics
+    '''
+
+    SiameseNetwork, forward_prop = load_architecture(config['model'])
+    default_lambdas = sys.modules[SiameseNetwork.__module__].L2_LAMBDAS
+    options = dict(training_options,
+                   using_model=config['model'],
+                   learning_rate=config['learning_rate'],
+                   l2_lambdas={name: value * config['l2_scale'] for name, value in default_lambdas.items()},
+                   model_name=config['trial'],
+                   epochs=epochs,
+                   resume=resume,
+                   # The trials are compared on the validation data, the test sets stay unseen
+                   test_suites=[],
+                   using_dashboard=False)
+
+    start = time.perf_counter()
+    metrics = {}
+    error = None
+    try:
+        results = train(0, 1, options)
+        metrics = scalar_metrics(results['Validation']) if results else {}
+    except Exception as e:
+        error = repr(e)
+
+    return {**config,
+            'epochs': epochs,
+            'val_f1': metrics.get('f1', 0.0),
+            'metrics': metrics,
+            'seconds': time.perf_counter() - start,
+            'error': error}
+
+def search(options, training_options):
+    '''
+    Successive halving: every trial is trained for min_epochs, then only the best 1/eta
+    (by validation F1 score) are trained eta times longer, until max_epochs
+    '''
+
+    folder = options['folder']
+    os.makedirs('models/{}'.format(folder), exist_ok=True)
+    store = SearchResults('models/{}/search_results.jsonl'.format(folder))
+
+    # Create the data before the trials start, so they do not all create it at once
+    if not os.path.exists('data/train/total_data.csv') or not os.path.exists('data/test/final_laptop_test_data.csv'):
+        create_data()
+
+    configs = {config['trial']: config for config in sample_configs(options['trials'], options['models'], options['seed'])}
+    training_options = dict(training_options, folder=folder)
+    threads = max(1, (os.cpu_count() or 1) // options['parallel'])
+    print('Searching {} trials, {} at a time with {} threads each'.format(len(configs), options['parallel'], threads))
+
+    survivors = list(configs)
+    search_start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options['parallel'],
+                                                mp_context=mp.get_context('spawn'),
+                                                initializer=set_threads,
+                                                initargs=(threads,)) as pool:
+        for rung, epochs in enumerate(rung_epochs(options['min_epochs'], options['max_epochs'], options['eta'])):
+            # Trials after the first rung continue from their last checkpoint. The first rung does not resume,
+            # so train deletes the checkpoints a trial with the same name left in this folder from an earlier search.
+            futures = [pool.submit(run_trial, configs[trial], epochs, rung > 0, training_options) for trial in survivors]
+            results = []
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                result['rung'] = rung
+                store.add(result)
+                results.append(result)
+                print('Rung {} {} ({}, lr {:.2e}, L2 x{:.2f}): {} epochs, validation F1 {:.4f} in {:.0f}s{}'.format(
+                      rung, result['trial'], result['model'], result['learning_rate'], result['l2_scale'], epochs,
+                      result['val_f1'], result['seconds'], ' ({})'.format(result['error']) if result['error'] else ''))
+
+            survivors = promote(results, options['eta'])
+            if len(results) == 1:
+                break
+
+    best = store.best()
+    print('Searched in {:.0f}s'.format(time.perf_counter() - search_start))
+    if best is not None:
+        print('Best: {} ({}, lr {:.2e}, L2 x{:.2f}) with validation F1 {:.4f} after {} epochs'.format(
+              best['trial'], best['model'], best['learning_rate'], best['l2_scale'], best['val_f1'], best['epochs']))
+
+    return best
+
+if __name__ == '__main__':
+    search(*parse_search_options(sys.argv[1:]))
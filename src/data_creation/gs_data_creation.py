@@ -3,11 +3,13 @@ import pandas as pd
 import numpy as np
 import math
 import random
+from multiprocessing import Pool
 from tqdm import tqdm
-from gensim import corpora
-from gensim.similarities import SparseMatrixSimilarity
+from scipy import sparse
+from gensim import corpora, matutils
 from supervised_product_matching.model_preprocessing import remove_stop_words
 from src.common import create_final_data
+from src.pair_sink import PairSink
 
 """
 Much of this algorithm is based on the paper Intermediate Training of BERT for Product Matching
@@ -15,6 +17,12 @@ which is by the people who made the WDC Product Corpus:
 http://data.dws.informatik.uni-mannheim.de/largescaleproductcorpus/data/v2/papers/DI2KG2020_Peeters.pdf
 """
 
+# Where the normalized computer data is cached
+NORMALIZED_COMPUTER_PATH = 'data/base/computer_wdc_normalized.csv'
+
+# How many tokens of the description are added to the title for the bag-of-words
+DESCRIPTION_TOKENS = 6
+
 def combinations(total, choose):
     '''
     Simple function to compute combinations
@@ -38,22 +46,63 @@ def generate_computer_data():
     Gets the computer data from the WDC Product Corpus
     '''
     chunk_size = 100000
-    computer_df = pd.DataFrame()
+    # Keep the filtered chunks and concatenate them once at the end
+    computer_chunks = []
     for chunk in pd.read_json('data/base/offers_corpus_english_v2.json.gz', lines=True, nrows= 100000000000000, chunksize=chunk_size):
-        computer_df = computer_df.append(chunk[chunk['category'].values == 'Computers_and_Accessories'])
-    return computer_df
+        computer_chunks.append(chunk[chunk['category'].values == 'Computers_and_Accessories'])
+    return pd.concat(computer_chunks)
+
+def truncate_description(description, n_tokens=DESCRIPTION_TOKENS):
+    '''
+    Normalizes only as much of the description as is needed to get its first n_tokens tokens.
+    remove_stop_words works token by token, so normalizing a prefix of the words gives
+    a prefix of the fully normalized description.
+    '''
 
-def extract_key_features(cluster):
+    words = description.split(' ')
+    window = n_tokens * 4
+    while True:
+        tokens = remove_stop_words(' '.join(words[:window])).split(' ')
+        if len(tokens) >= n_tokens or window >= len(words):
+            return ' '.join(tokens[:n_tokens])
+        window *= 2
+
+def normalize_chunk(chunk):
     '''
-    Simplies the DataFrames extracted from the WDC Product Corpus
-    Only includes the ID, description, title, and title + description
+    Normalizes a chunk of (titles, descriptions) in a worker process
     '''
 
-    new_cluster = cluster.loc[:, ("id", "description", "title")]
-    new_cluster["title"] = new_cluster["title"].map(lambda x: remove_stop_words(x))
-    new_cluster["description"] = new_cluster["description"].map(lambda x: remove_stop_words(str(x)))
-    new_cluster["titleDesc"] = new_cluster["title"].map(lambda x: x.split(" ")) + new_cluster["description"].map(lambda x: x.split(" ")).map(lambda x: x[0:6])
-    return new_cluster
+    titles, descriptions = chunk
+    return ([remove_stop_words(title) for title in titles],
+            [truncate_description(str(description)) for description in descriptions])
+
+def normalize_computer_data(computer_df, processes=None, chunk_size=10000):
+    '''
+    Normalizes the titles and descriptions of the computer data in one parallel pass
+    and caches the result to NORMALIZED_COMPUTER_PATH so that later steps reuse it
+    '''
+
+    if os.path.exists(NORMALIZED_COMPUTER_PATH):
+        # keep_default_na is off so that titles like "null" or "nan" stay strings
+        return pd.read_csv(NORMALIZED_COMPUTER_PATH, keep_default_na=False, dtype={'title': str, 'description': str})
+
+    print('    Normalizing computer titles and descriptions . . .')
+    computer_df = computer_df.loc[:, ('id', 'cluster_id', 'title', 'description')]
+    titles = computer_df['title'].tolist()
+    descriptions = computer_df['description'].tolist()
+    chunks = [(titles[pos:pos + chunk_size], descriptions[pos:pos + chunk_size]) for pos in range(0, len(titles), chunk_size)]
+
+    normalized_titles = []
+    normalized_descriptions = []
+    with Pool(processes) as pool:
+        for chunk_titles, chunk_descriptions in tqdm(pool.imap(normalize_chunk, chunks), total=len(chunks)):
+            normalized_titles.extend(chunk_titles)
+            normalized_descriptions.extend(chunk_descriptions)
+
+    computer_df['title'] = normalized_titles
+    computer_df['description'] = normalized_descriptions
+    computer_df.to_csv(NORMALIZED_COMPUTER_PATH, index=False)
+    return computer_df
 
 def get_valid_clusters(df):
     '''
@@ -68,27 +117,56 @@ def get_valid_clusters(df):
     all_clusters = df[df['cluster_id'].isin(valid_clusters)]['cluster_id'].values
     return set(all_clusters)
 
-def create_pos_from_cluster(data, cluster_id):
+class ClusterIndex():
     '''
-    Creates positive pairs from a cluster
+    The titles of the given clusters grouped by cluster_id into contiguous arrays, so a cluster is a slice
+    instead of a scan of the whole corpus (the data must come from normalize_computer_data).
+    The bag-of-words vector of every title (over the words of the titles and descriptions) is built once
+    and normalized, so the similarity of two titles is the dot product of their vectors, which is
+    the cosine similarity SparseMatrixSimilarity gave for every cluster.
+    '''
+
+    def __init__(self, data, clusters):
+        data = data.loc[data['cluster_id'].isin(clusters), ('cluster_id', 'title', 'description')]
+
+        # A stable sort keeps the titles of every cluster in the order of the data
+        data = data.sort_values('cluster_id', kind='stable')
+        cluster_ids, self.starts, self.counts = np.unique(data['cluster_id'].values, return_index=True, return_counts=True)
+        self.positions = {cluster_id: position for position, cluster_id in enumerate(cluster_ids)}
+        self.titles = data['title'].values
+
+        title_tokens = [title.split(' ') for title in self.titles]
+        dictionary = corpora.Dictionary(tokens + description.split(' ') for tokens, description in zip(title_tokens, data['description'].values))
+        bows = [dictionary.doc2bow(tokens) for tokens in title_tokens]
+        vectors = matutils.corpus2csc(bows, num_terms=len(dictionary), num_docs=len(bows), dtype=np.float32).T.tocsr()
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        self.vectors = sparse.diags(1 / norms, format='csr') @ vectors
+
+    def span(self, cluster_id):
+        '''
+        The start and end of the rows of a cluster
+        '''
+
+        position = self.positions[cluster_id]
+        return self.starts[position], self.starts[position] + self.counts[position]
+
+def create_pos_from_cluster(index, cluster_id):
+    '''
+    Creates positive pairs from a cluster of a ClusterIndex
     '''
 
     MAX_PAIRS = 16
-    cluster = data.loc[data["cluster_id"].values == cluster_id]
-    cluster = extract_key_features(cluster)
-    max_combos = combinations(len(cluster), 2)
+    start, stop = index.span(cluster_id)
+    titles = index.titles[start:stop]
+    max_combos = combinations(len(titles), 2)
     
-    dictionary = corpora.Dictionary(cluster["titleDesc"])
-    cluster_dict = [dictionary.doc2bow(title) for title in cluster["title"].map(lambda x: x.split(" "))]
-    sim_matrix = np.array(SparseMatrixSimilarity(cluster_dict, num_features=len(dictionary)))
+    vectors = index.vectors[start:stop]
+    sim_matrix = (vectors @ vectors.T).toarray()
     
     # Because the matrix is redundant (the rows and columns represent the same titles)
     # we set the bottom half of the similarities (including the diagonal) to 100
     # so that we don't have to worry about them when doing argmin()
-    for row in range(sim_matrix.shape[0]):
-        for column in range(sim_matrix.shape[1]):
-            if (row >= column):
-                sim_matrix[row][column] = 100
+    sim_matrix[np.tril_indices(len(titles))] = 100
     
     # If the maximum amount of combinations we can make is less than our set max,
     # set the maximum to the max combos
@@ -105,7 +183,7 @@ def create_pos_from_cluster(data, cluster_id):
     for x in range(hard_pos):
         # Keep getting the pairs with the lowest similarity score
         min_sim = np.unravel_index(sim_matrix.argmin(), sim_matrix.shape)
-        pair = [cluster["title"].iloc[min_sim[0]], cluster["title"].iloc[min_sim[1]], 1]
+        pair = [titles[min_sim[0]], titles[min_sim[1]], 1]
         pairs.append(pair)
         sim_matrix[min_sim[0]][min_sim[1]] = 100
     
@@ -116,71 +194,53 @@ def create_pos_from_cluster(data, cluster_id):
     for x in range(random_pos):
         ran_idx = random.sample(list(range(len(avail_indices))), 1)
         choice = avail_indices[ran_idx][0]
-        pair = [cluster["title"].iloc[choice[0]],
-                cluster["title"].iloc[choice[1]], 1]
+        pair = [titles[choice[0]], titles[choice[1]], 1]
         pairs.append(pair)
         avail_indices = np.delete(avail_indices, ran_idx, 0)
     
     return pd.DataFrame(pairs, columns=["title_one", "title_two", "label"])
 
-def create_neg_from_cluster(data, cluster_id, all_clusters):
+def create_neg_from_cluster(index, cluster_id, all_clusters):
     '''
-    Creates negative pairs from a cluster
+    Creates negative pairs from a cluster of a ClusterIndex
     '''
 
-    # Get the cluster
-    cluster = data.loc[data["cluster_id"].values == cluster_id]
-    cluster = extract_key_features(cluster)
+    start, stop = index.span(cluster_id)
     pairs = []
-    hard_neg = len(cluster) // 2
+    hard_neg = (stop - start) // 2
     
     # Hard negatives are those that are from different clusters, but we get the pair with the highest similarity
-    for row in range(hard_neg):
+    for row in range(start, start + hard_neg):
         # Keep choosing random titles until we get one that is not our own
         neg_cluster_id = cluster_id        
         while neg_cluster_id == cluster_id:
             neg_cluster_id = random.choice(all_clusters)
         
-        # Extract data about this cluster
-        neg_cluster = data.loc[data["cluster_id"].values == neg_cluster_id].copy()
-        neg_cluster = extract_key_features(neg_cluster)
-        
-        # Add the current title of the cluster to the beginning of this random cluster so that
-        # the first row in the similarity matrix will refer to this title
-        neg_cluster = pd.concat([pd.DataFrame([cluster.iloc[row].values], columns=["id", "description", "title", "titleDesc"]),
-                                 neg_cluster])
-        
-        # Get the similarity between the title and the random cluster
-        dictionary = corpora.Dictionary(neg_cluster["titleDesc"])
-        neg_cluster_dict = [dictionary.doc2bow(title) for title in neg_cluster["title"].map(lambda x: x.split(" "))]
-        sim_matrix = np.array(SparseMatrixSimilarity(neg_cluster_dict, num_features=len(dictionary)))
-        
-        # First row is the similarity between the current title and the rest of the random cluster
-        # so get the max similarity of this (+1 is because we don't include the similarity with ourself)
-        max_val = sim_matrix[0][1:].argmax() + 1
+        # Get the similarity between the title and every title of the random cluster
+        neg_start, neg_stop = index.span(neg_cluster_id)
+        similarities = (index.vectors[row] @ index.vectors[neg_start:neg_stop].T).toarray()[0]
         
-        # Add the pair
-        pair = [cluster["title"].iloc[row], neg_cluster["title"].iloc[max_val], 0]
+        # Add the pair with the most similar title
+        pair = [index.titles[row], index.titles[neg_start + similarities.argmax()], 0]
         pairs.append(pair)
     
-    for row in range(hard_neg, len(cluster)):
+    for row in range(start + hard_neg, stop):
         # Keep choosing random titles until we get one that is not our own
         neg_cluster_id = cluster_id
         while neg_cluster_id == cluster_id:
             neg_cluster_id = random.choice(all_clusters)
         
         # Randomly get a title from the random cluster
-        neg_cluster = data.loc[data["cluster_id"].values == neg_cluster_id].copy()
-        neg_cluster = extract_key_features(neg_cluster)
-        neg_title = neg_cluster["title"].iloc[random.choice(list(range(len(neg_cluster))))]
+        neg_start, neg_stop = index.span(neg_cluster_id)
+        neg_title = index.titles[neg_start + random.randrange(neg_stop - neg_start)]
         
         # Add the pair
-        pair = [cluster["title"].iloc[row], neg_title, 0]
+        pair = [index.titles[row], neg_title, 0]
         pairs.append(pair)
     
     return pd.DataFrame(pairs, columns=["title_one", "title_two", "label"])
 
-def create_computer_gs_data():
+def create_computer_gs_data(processes=None):
     file_path = 'data/train/wdc_computers.csv'
     if not os.path.exists(file_path):
         print('Generating Gold Standard Computer data (takes a long time) . . .')
@@ -192,24 +252,30 @@ def create_computer_gs_data():
         
         else:
             computer_df = pd.read_csv('data/base/computer_wdc_whole_no_duplicates.csv')
+
+        # Normalize the titles and descriptions once for every cluster
+        computer_df = normalize_computer_data(computer_df, processes)
         
         # Get "good" clusters from the data
         valid_clusters = list(get_valid_clusters(computer_df))
-        computer_train_wdc_pos = pd.DataFrame(columns=["title_one", "title_two", "label"])
-        computer_train_wdc_neg = pd.DataFrame(columns=["title_one", "title_two", "label"])
+
+        # Group the titles of the clusters and build their bag-of-words vectors once
+        cluster_index = ClusterIndex(computer_df, valid_clusters)
+        computer_train_wdc_pos = PairSink()
+        computer_train_wdc_neg = PairSink()
 
         # Positive data creation
         print('    Generating postive example . . .')
         for cluster in tqdm(valid_clusters):
-            computer_train_wdc_pos = computer_train_wdc_pos.append(create_pos_from_cluster(computer_df, cluster))
+            computer_train_wdc_pos.add_frame(create_pos_from_cluster(cluster_index, cluster))
 
         # Negative data creation
         print('    Generating negative examples . . .')
         for cluster in tqdm(valid_clusters):
-            computer_train_wdc_neg = computer_train_wdc_neg.append(create_neg_from_cluster(computer_df, cluster, valid_clusters))
+            computer_train_wdc_neg.add_frame(create_neg_from_cluster(cluster_index, cluster, valid_clusters))
 
         # Concatenate the data
-        computer_train_wdc = create_final_data(computer_train_wdc_pos, computer_train_wdc_neg)
+        computer_train_wdc = create_final_data(computer_train_wdc_pos.frame(), computer_train_wdc_neg.frame())
         computer_train_wdc.to_csv('data/train/wdc_computers.csv')
     
     else:
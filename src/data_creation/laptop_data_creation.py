@@ -2,182 +2,260 @@ import pandas as pd
 import os
 import numpy as np
 import random
+import itertools
+import multiprocessing
 from tqdm import tqdm
 from src.data_creation.laptop_data_classes import LaptopAttributes
 from src.data_preprocessing import randomize_units
 from supervised_product_matching.model_preprocessing import remove_stop_words
 from src.common import Common
 
-def gen_spec_combos():
-    '''
-    Generates combinations of the spec data (WARNING: THIS TAKES A VERY LONG TIME AND YOU MUST HAVE AT LEAST 16GB RAM TO DO THIS)
-    '''
-
-    combos = np.meshgrid(*[list(LaptopAttributes.cpu.keys()), LaptopAttributes.hard_drive, LaptopAttributes.ram])
-    combos = np.array(combos).T.reshape(-1, 3)
-    np.random.shuffle(combos)
-    df = pd.DataFrame(data=combos, columns=['cpu', 'hard_drive', 'ram'])
-    df.to_csv('data/train/spec_data_no_brand.csv')
-
-def cpu_token_alter(cpu_attr: str) -> str:
-    cpu_attr = cpu_attr.split(' ')
-    if random.choice([0, 1]):
-        if 'Intel' in cpu_attr:
-            cpu_attr.remove('Intel')
-    if random.choice([0, 1]):
-        if 'Core' in cpu_attr:
-            cpu_attr.remove('Core')
-    if random.choice([0, 1]):
-        if 'AMD' in cpu_attr:
-            cpu_attr.remove('AMD')
-
-    cpu_attr = ' '.join(cpu_attr)
-    return cpu_attr
-
-def concatenate_row(row):
-    '''
-    Creates a string out of the row of product attributes (so row is a Pandas DataFrame)
-    '''
-    
-    # Split the brand
-    row['company'] = row['brand'].split(' ')[0]
-    row['product'] = ' '.join(row['brand'].split(' ')[1:])
-    
-    # Create dictionary for drive types
-    drive_options = {'ssd': Common.SSD_TYPES, 'hdd': Common.HARD_DRIVE_TYPES}
-
-    # Special tags at the end of the amount of inches of the laptop and the RAM to simulate real data
-    inch_attr = str(row['inches']) + random.choice([' inch', '"'])
-    ram_attr = row['ram'] + random.choice([' ram', ' memory'])
-
-    # This modifies the CPU attribute to sometimes have different types of elements to add some difference
-    # Ex: Intel Core i7 7700k vs Core i7 7700k 4 Core 4.2 GHz CPU (Something like that)
-    cpu_attr = row['cpu']
-    cores = LaptopAttributes.cpu[cpu_attr][0]
-    ghz = LaptopAttributes.cpu[cpu_attr][1]
-    
-    if random.random() > 0.5:
-        cpu_attr = cpu_token_alter(cpu_attr)
-    
-    # Random chance of putting the cores in the CPU attribute
-    if cores != None:
-        if random.random() > 0.7:
-            cpu_attr = '{} {} {}'.format(cpu_attr, cores, 'Core')
-    
-    # Random chance of putting the GHz in the CPU attribute
-    if random.random() > 0.7:
-        cpu_attr = '{} {}'.format(cpu_attr, ghz)
-    
-    if random.random() > 0.55:
-        cpu_attr = '{} {}'.format(cpu_attr, 'CPU')
-    
-    # Have random chance of getting rid of company or product attribute
-    product_removed = False
-    if (random.random() > 0.5):
-        row['product'] = ''
-        product_removed = True
-    
-    if (random.random() > 0.5 and not product_removed):
-        row['company'] = ''
-    
-    body_modifier = ''
-    if (random.random() < 0.6):
-        body_modifier = random.choice(Common.BODY_ADD_INS)
-
-    begin_modifier = ''
-    if (random.random() < 0.6):
-        begin_modifier = random.choice(Common.MODIFIERS)
-
-    screen_modifier = ''
-    if (random.random() < 0.6):
-        screen_modifier = random.choice(Common.SCREEN_MODIFIERS)
-    
-    end_modifiers = []
-    if (random.random() < 0.6):
-        end_modifiers = random.sample(Common.END_ADD_INS, random.randint(3, 6))
-
-    
-    # Create a list for all the product attributes
-    order_attrs = [begin_modifier,
-                   row['company'],
-                   row['product'],
-                   body_modifier,
-                   inch_attr,
-                   screen_modifier
-                  ]
-
-    # Have a chance of adding "laptop" to the title
-    if random.random() > 0.45:
-        order_attrs.append('laptop')
-    
-    # Add the type of drive the hard drive attribute
-    row['hard_drive'] = row['hard_drive'] + ' ' + random.choice(drive_options[row['drive_type']])
-    
-    spec_attrs = [row['hard_drive'],
-                  # row['screen'],
-                   cpu_attr,
-                   ram_attr
-                 ]
-    
-    # Shuffle only the attributte
-    random.shuffle(spec_attrs)
-    order_attrs = order_attrs + spec_attrs + end_modifiers
-    
-    return ' '.join(order_attrs)
-
-def format_laptop_row(row, brand, inches, screen, drive_type):
-    row['brand'] = brand
-    row['inches'] = inches
-    row['screen'] = screen
-    row['drive_type'] = drive_type
-    return row
-
-def create_pos_neg_data(df, neg_attrs):
-    temp = []
-    for idx in tqdm(range(0, int(len(df) * 0.04))):
-        # Must start off with two positive titles
-        first_row = df.iloc[idx]
-        neg_attr = neg_attrs[idx % len(neg_attrs)]
-        
-        # Randomly choose the attributes that are not already in the row
-        brand = random.choice(LaptopAttributes.laptop_brands)
-        inches = random.choice(list(LaptopAttributes.inches))
-        screen = random.choice(list(LaptopAttributes.screen))
-        drive_type = random.choice(['ssd', 'hdd'])
-        
-        pos = format_laptop_row(first_row.copy(), brand, inches, screen, drive_type)
-        
-        new_attr = pos[neg_attr]
-        
-        while new_attr == pos[neg_attr]:
-            new_attr = random.sample(LaptopAttributes.get_all_data()[neg_attr.lower()], 1)[0]
-        
-        neg = pos.copy()
-        neg[neg_attr] = new_attr
-
-        temp.append([remove_stop_words(concatenate_row(pos.copy())), remove_stop_words(concatenate_row(pos.copy())), 1])
-        temp.append([remove_stop_words(concatenate_row(pos.copy())), remove_stop_words(concatenate_row(neg.copy())), 0])
-    
-    return pd.DataFrame(temp, columns=Common.COLUMN_NAMES)
-
-def create_pseudo_laptop_data():
-    '''
-    If spec_data.csv has not been created, we create that first.
-    Afterwards, create the positive and negative spec data (just more laptop data) 
-    and save it to spec_train_data.csv
+# Fraction of all the combinations of the spec attributes that pseudo-laptops are made from
+SPEC_FRACTION = 0.04
+
+# The attributes of a spec combination
+SPEC_ATTRS = ['cpu', 'hard_drive', 'ram']
+
+# The attribute that is changed for the negative pair, in turn for every combination
+NEG_ATTRS = ['cpu', 'ram', 'inches', 'hard_drive']
+
+# Amount of spec combinations the titles are made for at once
+PSEUDO_LAPTOP_BATCH = 10000
+
+# Orders the hard drive, CPU and RAM can be in within a title
+SPEC_ORDERS = np.array(list(itertools.permutations(range(3))))
+
+# The tokens that can be taken out of a CPU (the bits of the index of a CPU variant)
+CPU_OPTIONAL_TOKENS = ['Intel', 'Core', 'AMD']
+
+def spec_attr_values():
+    return [list(LaptopAttributes.cpu.keys()), LaptopAttributes.hard_drive, LaptopAttributes.ram]
+
+def spec_combo_count():
+    return int(np.prod([len(attr_values) for attr_values in spec_attr_values()]))
+
+def sample_spec_numbers(amount, seed=None):
+    '''
+    Draws amount different combinations of a CPU, hard drive and RAM in random order.
+    Instead of building every combination, a combination is drawn as a number below the amount
+    of combinations, that decode_spec_numbers splits into the index of each attribute (like the digits of a number).
+    Without a seed, the combinations follow the seed of random.
+    '''
+
+    total = spec_combo_count()
+    rng = random.Random(seed if seed is not None else random.getrandbits(64))
+
+    # Sampling from a range keeps only the chosen numbers in memory
+    return rng.sample(range(total), min(amount, total))
+
+def decode_spec_numbers(numbers):
+    '''
+    The indices of the CPU, hard drive and RAM of an array of combinations from sample_spec_numbers
+    '''
+
+    indices = []
+    numbers = np.asarray(numbers, dtype=np.int64)
+    for attr_values in reversed(spec_attr_values()):
+        numbers, index = np.divmod(numbers, len(attr_values))
+        indices.append(index)
+
+    return tuple(reversed(indices))
+
+def cpu_token_variants(cpu_attr):
+    '''
+    The CPU attribute with every combination of the CPU_OPTIONAL_TOKENS taken out
+    (bit n of the index of a variant takes out token n)
+    '''
+
+    tokens = cpu_attr.split(' ')
+    variants = []
+    for mask in range(2 ** len(CPU_OPTIONAL_TOKENS)):
+        variant = list(tokens)
+        for bit, token in enumerate(CPU_OPTIONAL_TOKENS):
+            if mask & (1 << bit) and token in variant:
+                variant.remove(token)
+        variants.append(' '.join(variant))
+
+    return variants
+
+def with_blank(values):
+    '''
+    The values as an array whose last element (index -1) is an empty string
+    '''
+
+    return np.array(list(values) + [''], dtype=object)
+
+class PseudoLaptopTables():
+    '''
+    The spec attributes and the other parts of pseudo-laptop titles as arrays,
+    so a batch of laptops is arrays of indices into them
+    '''
+
+    def __init__(self):
+        cpus = list(LaptopAttributes.cpu.keys())
+        self.cpu_variants = np.array([cpu_token_variants(cpu) for cpu in cpus], dtype=object)
+        self.has_cores = np.array([LaptopAttributes.cpu[cpu][0] is not None for cpu in cpus])
+        self.cores = np.array([' {} Core'.format(LaptopAttributes.cpu[cpu][0]) for cpu in cpus], dtype=object)
+        self.ghz = np.array([' {}'.format(LaptopAttributes.cpu[cpu][1]) for cpu in cpus], dtype=object)
+        self.hard_drive = np.array(LaptopAttributes.hard_drive, dtype=object)
+        self.ram = np.array(LaptopAttributes.ram, dtype=object)
+
+        # Sorted, so the same seed gives the same data (the order of a set changes between runs)
+        self.inches = np.array(sorted(LaptopAttributes.inches), dtype=object)
+        self.company = np.array([brand.split(' ')[0] for brand in LaptopAttributes.laptop_brands], dtype=object)
+        self.product = np.array([' '.join(brand.split(' ')[1:]) for brand in LaptopAttributes.laptop_brands], dtype=object)
+
+        # Names of the drive types one after the other (drive type 0 is a SSD and 1 is a hard drive)
+        self.drive_names = np.array(Common.SSD_TYPES + Common.HARD_DRIVE_TYPES, dtype=object)
+        self.drive_name_start = np.array([0, len(Common.SSD_TYPES)])
+        self.drive_name_count = np.array([len(Common.SSD_TYPES), len(Common.HARD_DRIVE_TYPES)])
+        self.modifiers = with_blank(Common.MODIFIERS)
+        self.body_add_ins = with_blank(Common.BODY_ADD_INS)
+        self.screen_modifiers = with_blank(Common.SCREEN_MODIFIERS)
+        self.end_add_ins = np.array(Common.END_ADD_INS, dtype=object)
+
+        # The amount of values of each attribute that can be changed for a negative pair
+        self.sizes = {'cpu': len(cpus), 'hard_drive': len(self.hard_drive), 'ram': len(self.ram), 'inches': len(self.inches)}
+
+# The tables of this process (made on first use, after the spec attributes are populated)
+laptop_tables = None
+
+def get_tables():
+    global laptop_tables
+    if laptop_tables is None:
+        laptop_tables = PseudoLaptopTables()
+    return laptop_tables
+
+def maybe(rng, n, chance, values):
+    '''
+    Indices of a random value for chance of the n titles and -1 (the blank at the end of the values) for the rest
+    '''
+
+    return np.where(rng.random(n) < chance, rng.integers(0, len(values) - 1, n), -1)
+
+def make_titles(tables, rng, laptops):
+    '''
+    Titles of the laptops (a dictionary of arrays of indices into the tables), each with its own
+    random variation of the attributes: the endings of the inches and RAM, the tokens of the CPU,
+    leaving out the company or product, modifiers, the order of the specs and add-ins at the end.
+    The stop words are removed from the titles.
+    '''
+
+    n = len(laptops['cpu'])
+    inches = tables.inches[laptops['inches']] + np.where(rng.random(n) < 0.5, ' inch', '"').astype(object)
+    ram = tables.ram[laptops['ram']] + np.where(rng.random(n) < 0.5, ' ram', ' memory').astype(object)
+
+    # Half of the CPUs have a random set of the optional tokens taken out, then cores, GHz and "CPU" may be added
+    cpu_variant = np.where(rng.random(n) > 0.5, rng.integers(0, tables.cpu_variants.shape[1], n), 0)
+    cpu = tables.cpu_variants[laptops['cpu'], cpu_variant]
+    cpu = cpu + np.where((rng.random(n) > 0.7) & tables.has_cores[laptops['cpu']], tables.cores[laptops['cpu']], '')
+    cpu = cpu + np.where(rng.random(n) > 0.7, tables.ghz[laptops['cpu']], '')
+    cpu = cpu + np.where(rng.random(n) > 0.55, ' CPU', '').astype(object)
+
+    # Leave out the product half of the time, and otherwise the company half of the time
+    remove_product = rng.random(n) > 0.5
+    remove_company = (rng.random(n) > 0.5) & ~remove_product
+    company = np.where(remove_company, '', tables.company[laptops['brand']])
+    product = np.where(remove_product, '', tables.product[laptops['brand']])
+
+    body_modifier = tables.body_add_ins[maybe(rng, n, 0.6, tables.body_add_ins)]
+    begin_modifier = tables.modifiers[maybe(rng, n, 0.6, tables.modifiers)]
+    screen_modifier = tables.screen_modifiers[maybe(rng, n, 0.6, tables.screen_modifiers)]
+    laptop = np.where(rng.random(n) > 0.45, 'laptop', '')
+
+    # The drive type is added to the hard drive (the two types have a different amount of names)
+    drive_type = laptops['drive_type']
+    drive_name = tables.drive_name_start[drive_type] + rng.integers(0, tables.drive_name_count[drive_type])
+    hard_drive = tables.hard_drive[laptops['hard_drive']] + ' ' + tables.drive_names[drive_name]
+    specs = np.stack([hard_drive, cpu, ram], axis=1)[np.arange(n)[:, None], SPEC_ORDERS[rng.integers(0, len(SPEC_ORDERS), n)]]
+
+    # 3 to 6 add-ins at the end (a random order of all of them, cut short) for 60% of the titles
+    end_count = np.where(rng.random(n) < 0.6, rng.integers(3, 7, n), 0)
+    end_order = np.argsort(rng.random((n, len(tables.end_add_ins))), axis=1)
+
+    titles = []
+    for i in range(n):
+        parts = [begin_modifier[i], company[i], product[i], body_modifier[i], inches[i], screen_modifier[i]]
+        if laptop[i]:
+            parts.append('laptop')
+        parts += list(specs[i]) + list(tables.end_add_ins[end_order[i, :end_count[i]]])
+        titles.append(remove_stop_words(' '.join(parts)))
+
+    return np.array(titles, dtype=object)
+
+def pseudo_laptop_batch(task):
+    '''
+    The positive and negative pairs of a batch of spec combinations.
+    task is (the numbers of the combinations, the position of the batch, a seed).
+    '''
+
+    numbers, position, seed = task
+    tables = get_tables()
+    rng = np.random.default_rng(seed)
+    n = len(numbers)
+
+    # Randomly choose the attributes that are not in the combinations
+    cpu, hard_drive, ram = decode_spec_numbers(numbers)
+    pos = {'cpu': cpu, 'hard_drive': hard_drive, 'ram': ram,
+           'inches': rng.integers(0, len(tables.inches), n),
+           'brand': rng.integers(0, len(tables.company), n),
+           'drive_type': rng.integers(0, 2, n)}
+
+    # Change one attribute to a different value for the negative titles (a random other value is
+    # drawn from all but one of the values and moved past the current one)
+    neg = {attr: values.copy() for attr, values in pos.items()}
+    neg_attr = (position + np.arange(n)) % len(NEG_ATTRS)
+    for i, attr in enumerate(NEG_ATTRS):
+        changed = neg_attr == i
+        new_values = rng.integers(0, tables.sizes[attr] - 1, changed.sum())
+        neg[attr][changed] = new_values + (new_values >= pos[attr][changed])
+
+    # Every title has its own variation, like in the two pairs of the same laptop
+    pos_one, pos_two, pos_three = make_titles(tables, rng, pos), make_titles(tables, rng, pos), make_titles(tables, rng, pos)
+    neg_titles = make_titles(tables, rng, neg)
+
+    # A positive pair followed by a negative pair for every combination
+    pairs = np.empty((2 * n, 3), dtype=object)
+    pairs[0::2, 0], pairs[0::2, 1], pairs[0::2, 2] = pos_one, pos_two, 1
+    pairs[1::2, 0], pairs[1::2, 1], pairs[1::2, 2] = pos_three, neg_titles, 0
+    return pd.DataFrame(pairs, columns=Common.COLUMN_NAMES)
+
+def create_pos_neg_data(numbers, seed=None, batch_size=PSEUDO_LAPTOP_BATCH, processes=1):
+    '''
+    Creates a positive and a negative pair from every spec combination (numbers from sample_spec_numbers),
+    in batches of batch_size combinations, spread over processes worker processes.
+    Every batch has its own seed from the seed, so the data only depends on the seed and not on the processes.
+    '''
+
+    seeds = np.random.SeedSequence(seed if seed is not None else random.getrandbits(64)).spawn((len(numbers) + batch_size - 1) // batch_size)
+    tasks = [(numbers[start:start + batch_size], start, batch_seed) for start, batch_seed in zip(range(0, len(numbers), batch_size), seeds)]
+
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            frames = list(tqdm(pool.imap(pseudo_laptop_batch, tasks), total=len(tasks)))
+    else:
+        frames = [pseudo_laptop_batch(task) for task in tqdm(tasks)]
+
+    if not frames:
+        return pd.DataFrame(columns=Common.COLUMN_NAMES)
+
+    return pd.concat(frames, ignore_index=True)
+
+def create_pseudo_laptop_data(seed=None, processes=1):
+    '''
+    Create the positive and negative spec data (just more laptop data) from a random
+    SPEC_FRACTION of the combinations of the spec attributes and save it to spec_train_data.csv
     '''
 
     file_path = 'data/train/spec_train_data_new.csv'
     if not os.path.exists(file_path):
         print('Generating data for pseudo-laptops . . . ')
-        if not os.path.exists('data/base/spec_data_no_brand.csv'):
-            print('Generating spec data combinations. WARNING: THIS WILL CONSUME RESOURCES AND TAKE A LONG TIME.')
-            gen_spec_combos()
-        spec_df = pd.read_csv('data/base/spec_data_no_brand.csv')
-        final_laptop_df = create_pos_neg_data(spec_df, neg_attrs=['cpu', 'ram', 'inches', 'hard_drive'])
+        seed = seed if seed is not None else random.getrandbits(64)
+        numbers = sample_spec_numbers(int(spec_combo_count() * SPEC_FRACTION), seed)
+        final_laptop_df = create_pos_neg_data(numbers, seed, processes=processes)
         final_laptop_df.reset_index(inplace=True)
         randomize_units(final_laptop_df, units=['gb'])
         final_laptop_df.to_csv(file_path)
 
     else:
-        print('Already have pseudo-laptop data. Moving on . . .')
\ No newline at end of file
+        print('Already have pseudo-laptop data. Moving on . . .')
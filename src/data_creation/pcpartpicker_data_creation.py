@@ -4,6 +4,7 @@ import random
 from itertools import combinations
 from tqdm import tqdm
 from src.common import create_final_data
+from src.pair_sink import PairSink
 from src.data_preprocessing import remove_misc, randomize_units
 from supervised_product_matching.model_preprocessing import remove_stop_words
 
@@ -13,7 +14,7 @@ def generate_pos_pcpartpicker_data(df):
     '''
 
     columns = list(df.columns)
-    pos_df = pd.DataFrame(columns=['title_one', 'title_two', 'label'])
+    pos_pairs = PairSink()
     for idx in tqdm(range(len(df))):
         row = df.iloc()[idx]
         titles = []
@@ -22,11 +23,9 @@ def generate_pos_pcpartpicker_data(df):
         if len(titles) > 1:
             combs = combinations(titles, 2)
             for comb in combs:
-                comb = list(comb)
-                comb.append(1)
-                pos_df = pos_df.append(pd.DataFrame([comb], columns=['title_one', 'title_two', 'label']))
+                pos_pairs.add([comb[0], comb[1], 1])
     
-    return pos_df
+    return pos_pairs.frame()
 
 def generate_neg_pcpartpicker_data(df):
     '''
@@ -34,7 +33,7 @@ def generate_neg_pcpartpicker_data(df):
     '''
 
     columns = list(df.columns)
-    neg_df = pd.DataFrame(columns=['title_one', 'title_two', 'label'])
+    neg_pairs = PairSink()
     df_list = df.iloc()
     for idx in tqdm(range(len(df))):
         row = df_list[idx]
@@ -48,9 +47,9 @@ def generate_neg_pcpartpicker_data(df):
                 while neg_title == None or pd.isnull(neg_title):
                     neg_title = df_list[neg_idx][random.choice(columns)]
                 
-                neg_df = neg_df.append(pd.DataFrame([[remove_stop_words(row[col]), remove_stop_words(neg_title), 0]], columns=['title_one', 'title_two', 'label']))
+                neg_pairs.add([remove_stop_words(row[col]), remove_stop_words(neg_title), 0])
     
-    return neg_df
+    return neg_pairs.frame()
 
 def create_pcpartpicker_data():
     '''
@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import hashlib
+import resource
+import traceback
+import multiprocessing
+from src.training.telemetry import process_rss
+
+# Bump to rebuild every stage (like after changing how stages are hashed)
+CACHE_VERSION = 1
+
+class Stage():
+    '''
+    A step of the data creation: fn creates the outputs from the inputs (paths of files).
+    A stage runs after every stage that outputs one of its inputs.
+    params: Settings of the stage that change its outputs
+    seed: Seed of random and NumPy when the stage runs (None leaves them unseeded)
+    code: Source files the stage uses besides the module of fn
+    '''
+
+    def __init__(self, name, fn, inputs=(), outputs=(), params=None, seed=None, code=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.seed = seed
+        self.code = list(code)
+
+    def code_files(self):
+        return [os.path.relpath(sys.modules[self.fn.__module__].__file__)] + self.code
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class Manifest():
+    '''
+    Record of the key every stage was last built with and the hashes of the files it read and wrote,
+    saved as JSON at path. The key of a stage is a hash of its inputs, params, seed and code, so a stage
+    is only rebuilt when one of them changed (or its outputs were deleted or changed).
+    Hashes of files are reused while their size and modification time stay the same.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_VERSION:
+                self.stages = manifest['stages']
+                self.files = manifest['files']
+
+    def hash(self, path):
+        '''
+        The SHA-256 of a file, or None if it does not exist
+        '''
+
+        if not os.path.exists(path):
+            self.files.pop(path, None)
+            return None
+
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached is None or cached['size'] != stat.st_size or cached['mtime_ns'] != stat.st_mtime_ns:
+            cached = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(path)}
+            self.files[path] = cached
+
+        return cached['sha256']
+
+    def key(self, stage):
+        '''
+        The hash of everything that decides the outputs of the stage
+        '''
+
+        description = {'version': CACHE_VERSION,
+                       'name': stage.name,
+                       'inputs': {path: self.hash(path) for path in stage.inputs},
+                       'code': {path: self.hash(path) for path in stage.code_files()},
+                       'params': stage.params,
+                       'seed': stage.seed}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_current(self, stage):
+        '''
+        Checks if the outputs of the stage were built from what it would be built from now
+        '''
+
+        built = self.stages.get(stage.name)
+        if built is None or built['key'] != self.key(stage):
+            return False
+
+        return all(self.hash(path) == built['outputs'].get(path) for path in stage.outputs)
+
+    def record(self, stage):
+        '''
+        Records that the stage was built (the key is taken after, as a stage can create its own inputs)
+        '''
+
+        self.stages[stage.name] = {'key': self.key(stage),
+                                   'outputs': {path: self.hash(path) for path in stage.outputs},
+                                   'built': time.time()}
+        self.save()
+
+    def forget(self, stage):
+        self.stages.pop(stage.name, None)
+        self.save()
+
+    def save(self):
+        # Write to a temporary file first, so an interrupted save does not lose the manifest
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'stages': self.stages, 'files': self.files}, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+def dependencies(stages):
+    '''
+    The names of the stages each stage waits for
+    '''
+
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError('{} is an output of both {} and {}'.format(output, producers[output], stage.name))
+            producers[output] = stage.name
+
+    depends = {stage.name: set(producers[path] for path in stage.inputs if path in producers) - {stage.name} for stage in stages}
+
+    # Check for cycles, which would never finish
+    done = set()
+    remaining = dict(depends)
+    while remaining:
+        ready = [name for name, waits in remaining.items() if waits <= done]
+        if not ready:
+            raise ValueError('The stages {} depend on each other'.format(sorted(remaining)))
+        for name in ready:
+            done.add(name)
+            del remaining[name]
+
+    return depends
+
+def is_cached(manifest, stage):
+    '''
+    Checks if a stage can be skipped. Outputs made before there was a manifest are adopted as they are.
+    '''
+
+    if manifest.is_current(stage):
+        print('Stage {} is up to date'.format(stage.name))
+        return True
+
+    if stage.name not in manifest.stages and stage.outputs and all(os.path.exists(path) for path in stage.outputs):
+        print('Stage {} has outputs from before the manifest. Using them (rebuild with --force).'.format(stage.name))
+        manifest.record(stage)
+        return True
+
+    return False
+
+def run_stage(stage, results):
+    '''
+    Runs a stage in its own process and sends back its time, memory and error (if it failed)
+    '''
+
+    if stage.seed is not None:
+        random.seed(stage.seed)
+        try:
+            import numpy as np
+            np.random.seed(stage.seed)
+        except ImportError:
+            pass
+
+    start_rss = process_rss()
+    start = time.perf_counter()
+    error = None
+    try:
+        stage.fn()
+    except BaseException:
+        error = traceback.format_exc()
+
+    # Peak resident memory of this process (kilobytes on Linux)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results.put({'stage': stage.name, 'seconds': time.perf_counter() - start, 'start_rss': start_rss,
+                 'peak_rss': max(peak_rss, start_rss), 'error': error})
+
+def run_stages(stages, processes=None, manifest=None, force=False):
+    '''
+    Runs the stages in order of their dependencies, up to processes at a time (default: the amount of CPUs).
+    Every stage runs in a new process, so its peak memory is its own. A stage that fails skips the stages
+    that depend on it, and the others still run. Returns the report of every stage that ran, in the order they finished.
+    With a Manifest, the stages that are current are skipped (unless force is set) and the outputs of the others
+    are deleted before they run, as the stages skip the files that already exist.
+    '''
+
+    processes = processes or os.cpu_count() or 1
+    depends = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    context = multiprocessing.get_context()
+    results = context.Queue()
+
+    pending = [stage.name for stage in stages]
+    running = {}
+    reports = []
+    failed = set()
+    done = set()
+    start = time.perf_counter()
+    while pending or running:
+        # Skip the stages that depend on one that failed
+        for name in [name for name in pending if depends[name] & failed]:
+            print('Skipping {} (depends on {})'.format(name, ', '.join(sorted(depends[name] & failed))))
+            pending.remove(name)
+            failed.add(name)
+
+        # Start the stages whose dependencies are done (again after a stage is skipped, as others may depend on it)
+        skipped = True
+        while skipped:
+            skipped = False
+            for name in [name for name in pending if depends[name] <= done]:
+                if len(running) >= processes:
+                    break
+
+                stage = by_name[name]
+                if manifest is not None and not force and is_cached(manifest, stage):
+                    pending.remove(name)
+                    done.add(name)
+                    skipped = True
+                    continue
+
+                if manifest is not None:
+                    manifest.forget(stage)
+                    for path in stage.outputs:
+                        if os.path.exists(path):
+                            os.remove(path)
+
+                process = context.Process(target=run_stage, args=(stage, results), name='stage-' + name)
+                process.start()
+                running[name] = process
+                pending.remove(name)
+
+        if not running:
+            continue
+
+        report = next_report(results, running)
+        running.pop(report['stage']).join()
+        reports.append(report)
+        if report['error']:
+            failed.add(report['stage'])
+            print('Stage {} failed:\n{}'.format(report['stage'], report['error']))
+        else:
+            done.add(report['stage'])
+            if manifest is not None:
+                manifest.record(by_name[report['stage']])
+            print('Stage {} finished in {:.1f} s (peak memory {:.0f} MB)'.format(report['stage'], report['seconds'], report['peak_rss'] / 2**20))
+
+    print_reports(reports, time.perf_counter() - start)
+    if failed:
+        raise RuntimeError('The stages {} did not finish'.format(', '.join(sorted(failed))))
+
+    return reports
+
+def next_report(results, running):
+    '''
+    Waits for a running stage to finish. A stage whose process died without a report
+    (like being killed for running out of memory) is reported as failed.
+    '''
+
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            for name, process in running.items():
+                if process.exitcode not in (None, 0):
+                    return {'stage': name, 'seconds': 0.0, 'start_rss': 0, 'peak_rss': 0,
+                            'error': 'The process exited with code {}'.format(process.exitcode)}
+
+def print_reports(reports, seconds):
+    print('{:<28} {:>10} {:>12} {:>12}'.format('Stage', 'Seconds', 'Peak MB', 'Added MB'))
+    for report in sorted(reports, key=lambda report: report['seconds'], reverse=True):
+        print('{:<28} {:>10.1f} {:>12.0f} {:>12.0f}{}'.format(report['stage'], report['seconds'], report['peak_rss'] / 2**20,
+                                                             (report['peak_rss'] - report['start_rss']) / 2**20,
+                                                             ' FAILED' if report['error'] else ''))
+
+    total = sum(report['seconds'] for report in reports)
+    print('Took {:.1f} s ({:.1f} s of stages, {:.1f}x parallel)'.format(seconds, total, total / max(seconds, 1e-9)))
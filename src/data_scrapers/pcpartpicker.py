@@ -6,9 +6,14 @@ from stem import Signal
 from stem.control import Controller
 from tbselenium.tbdriver import TorBrowserDriver
 import os
+import sys
 import time
 import random
 
+# The repository, so src can be imported when this is run as a script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from src.pair_sink import PairSink
+
 # signal TOR for a new connection (IP)
 def switchIP():
     with Controller.from_port(port = 9051) as controller:
@@ -18,11 +23,8 @@ def switchIP():
 
 def ram_collector():
     column_names = ['name', 'speed']
-    if not os.path.exists('data/train/ram_data.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('data/train/ram_data.csv')
+    # Rows are added after the ones already in the file and written after every page
+    sink = PairSink('data/train/ram_data.csv', columns=column_names, append=True)
     
     for page in range(75):
         driver = webdriver.Chrome()
@@ -34,20 +36,19 @@ def ram_collector():
             try:
                 name = product.find('div', attrs={'class': 'td__nameWrapper'}).find('p').text
                 ram_speed = product.find('td', attrs={'class': 'td__spec td__spec--1'}).text.replace('Speed', '')
-                df = df.append(pd.DataFrame([[name, ram_speed]], columns=column_names))
+                sink.add([name, ram_speed])
 
             except AttributeError as e:
                 print(str(e))
 
-    df.to_csv('data/train/ram_data.csv')
+        sink.flush()
+
+    sink.close()
 
 def cpu_collector():
     column_names = ['name', 'cores', 'core_clock']
-    if not os.path.exists('data/train/cpu_data.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('data/train/cpu_data.csv')
+    # Rows are added after the ones already in the file and written after every page
+    sink = PairSink('data/train/cpu_data.csv', columns=column_names, append=True)
     
     for page in range(13):
         driver = webdriver.Chrome()
@@ -60,22 +61,21 @@ def cpu_collector():
                 name = product.find('div', attrs={'class': 'td__nameWrapper'}).find('p').text
                 core_count = product.find('td', attrs={'class': 'td__spec td__spec--1'}).text.replace('Core Count', '')
                 core_clock = product.find('td', attrs={'class': 'td__spec td__spec--2'}).text.replace('Core Clock', '')
-                df = df.append(pd.DataFrame([[name, core_count, core_clock]], columns=column_names))
+                sink.add([name, core_count, core_clock])
             
             except AttributeError as e:
                 print(str(e))
 
-    df.to_csv('data/train/cpu_data.csv')
+        sink.flush()
+
+    sink.close()
 
 def hard_drive_collector():
     column_names = ['name', 'capacity', 'type', 'form_factor']
     file_path = 'data/train/hard_drive_data.csv'
     pages = 25
-    if not os.path.exists(file_path):
-        df = pd.DataFrame(columns=column_names)
-    
-    else:
-        df = pd.read_csv(file_path)
+    # Rows are added after the ones already in the file and written after every page
+    sink = PairSink(file_path, columns=column_names, append=True)
     
     for page in range(int(pages)):
         soup = None
@@ -92,23 +92,22 @@ def hard_drive_collector():
                 drive_type = product.find('td', attrs={'class': 'td__spec td__spec--3'}).text.replace('Type', '')
                 form_factor = product.find('td', attrs={'class': 'td__spec td__spec--5'}).text.replace('Form Factor', '')
                 print('Name: ', name, '| Capacity: ', capacity, '| Type: ', drive_type, '| Form Factor: ', form_factor)
-                df = df.append(pd.DataFrame([[name, capacity, drive_type, form_factor]], columns=column_names))
+                sink.add([name, capacity, drive_type, form_factor])
 
             except AttributeError as e:
                 print(str(e))
-        
-    df.to_csv('/home/jason/Documents/Supervised-Product-Similarity/' + file_path)
+
+        sink.flush()
+
+    sink.close()
 
 
 def video_card_collector():
     column_names = ['name', 'chipset', 'memory', 'core-clock']
     file_path = 'data/train/video-cards-data.csv'
     pages = 25
-    if not os.path.exists(file_path):
-        df = pd.DataFrame(columns=column_names)
-    
-    else:
-        df = pd.read_csv(file_path)
+    # Rows are added after the ones already in the file and written after every page
+    sink = PairSink(file_path, columns=column_names, append=True)
     
     for page in range(int(pages)):
         soup = None
@@ -125,12 +124,14 @@ def video_card_collector():
                 memory = product.find('td', attrs={'class': 'td__spec td__spec--2'}).text.replace('Memory', '')
                 core_clock = product.find('td', attrs={'class': 'td__spec td__spec--3'}).text.replace('Core Clock', '')
                 print('Name: ', name, '| Chipset: ', chipset, '| Memory: ', memory, '| Core Clock: ', core_clock)
-                df = df.append(pd.DataFrame([[name, chipset, memory, core_clock]], columns=column_names))
+                sink.add([name, chipset, memory, core_clock])
 
             except AttributeError as e:
                 print(str(e))
-        
-    df.to_csv('/home/jason/Documents/Supervised-Product-Similarity/' + file_path)
+
+        sink.flush()
+
+    sink.close()
 
 def get_links():
     part_type = input('What part type do you want (CPU, CPU cooler,  memory, internal hard drive, motherboard, video card, power supply, case)? ')
@@ -163,7 +164,8 @@ def get_pos_data():
     csv_name = input('What would you like the finished CSV to be? ')
     link_file = open('data/pcpartpicker_misc/{}.txt'.format(file_name), 'r')
     retailer_names = ['amazon', 'bestbuy', 'newegg', 'walmart', 'memoryc', 'bhphotovideo']
-    df = pd.DataFrame(columns=retailer_names)
+    # Written after every link, so the titles are kept if the scraping stops
+    sink = PairSink('data/train/{}.csv'.format(csv_name), columns=retailer_names, chunk_size=1)
     links = list(link_file)
 
     try:
@@ -235,13 +237,13 @@ def get_pos_data():
                         except Exception:
                             pass
                 
-            df = df.append(pd.DataFrame([list(title_dict.values())], columns=retailer_names))
+            sink.add(list(title_dict.values()))
 
     except (Exception, KeyboardInterrupt) as e:
         print(str(e))
 
     print('here')
-    df.to_csv('/home/jason/Documents/Supervised-Product-Similarity/data/train/{}.csv'.format(csv_name))
+    sink.close()
     link_file.close()
 
 if __name__ == "__main__":
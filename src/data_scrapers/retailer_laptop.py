@@ -6,10 +6,15 @@ from stem import Signal
 from stem.control import Controller
 from tbselenium.tbdriver import TorBrowserDriver
 import os
+import sys
 import time
 import random
 from pcpartpicker import switchIP
 
+# The repository, so src can be imported when this is run as a script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from src.pair_sink import PairSink
+
 intel_core_links = [
     'https://ark.intel.com/content/www/us/en/ark/products/series/79666/legacy-intel-core-processors.html',
     'https://ark.intel.com/content/www/us/en/ark/products/series/94028/5th-generation-intel-core-m-processors.html',
@@ -79,11 +84,8 @@ def amazon_laptop_title_collector():
     column_names = ['title']
     file_path = '../../data/base/amazon_laptop_titles.csv'
     pages = 20
-    if not os.path.exists(file_path):
-        df = pd.DataFrame(columns=column_names)
-    
-    else:
-        df = pd.read_csv(file_path)
+    # Titles are added after the ones already in the file and written after every page
+    sink = PairSink(file_path, columns=column_names, append=True)
     
     for page in range(int(pages)):
         soup = None
@@ -97,12 +99,14 @@ def amazon_laptop_title_collector():
             try:
                 title = product.find('a', attrs={'class': 'a-link-normal a-text-normal'}).find('span', {'class': 'a-size-medium a-color-base a-text-normal'}).text
                 print('Title: ', title)
-                df = df.append(pd.DataFrame([[title]], columns=column_names))
+                sink.add([title])
 
             except AttributeError as e:
                 print(str(e))
-        
-    df.to_csv(file_path, index=False)
+
+        sink.flush()
+
+    sink.close()
 
 def walmart_laptop_collector():
     """
@@ -111,11 +115,7 @@ def walmart_laptop_collector():
     """
     
     column_names = ['title']
-    if not os.path.exists('../../data/base/walmart_laptop_titles.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('../../data/base/walmart_laptop_titles.csv')
+    sink = PairSink('../../data/base/walmart_laptop_titles.csv', columns=column_names, append=True)
     
     for page in range(25):
         driver = webdriver.Chrome()
@@ -128,21 +128,17 @@ def walmart_laptop_collector():
             try:
                 title = product.find('span').text
                 print("Title: {}".format(title))
-                df = df.append(pd.DataFrame([[title]], columns=column_names))
+                sink.add([title])
             
             except AttributeError as e:
                 print(str(e))
         
-        df.to_csv('../../data/base/walmart_laptop_titles.csv', index=False)
+        sink.flush()
         time.sleep(random.randint(5, 10))
 
 def newegg_laptop_collector():
     column_names = ['title']
-    if not os.path.exists('../../data/base/newegg_laptop_titles.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('../../data/base/newegg_laptop_titles.csv')
+    sink = PairSink('../../data/base/newegg_laptop_titles.csv', columns=column_names, append=True)
     
     for page in range(100):
         driver = webdriver.Chrome()
@@ -155,21 +151,17 @@ def newegg_laptop_collector():
             try:
                 title = product.find('a', {'class': 'item-title'}).text
                 print("Title: {}".format(title))
-                df = df.append(pd.DataFrame([[title]], columns=column_names))
+                sink.add([title])
             
             except AttributeError as e:
                 print(str(e))
         
-        df.to_csv('../../data/base/newegg_laptop_titles.csv', index=False)
+        sink.flush()
         time.sleep(random.randint(5, 10))
 
 def intel_processor_collector(link):
     column_names = ['title']
-    if not os.path.exists('../../data/base/intel_cpus.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('../../data/base/intel_cpus.csv')
+    sink = PairSink('../../data/base/intel_cpus.csv', columns=column_names, append=True)
     
     driver = webdriver.Chrome()
     driver.get(link)
@@ -184,20 +176,16 @@ def intel_processor_collector(link):
             cpu = cpu.replace('™', ' ')
             cpu = cpu.replace('  ', ' ')
             print("Title: {}".format(cpu))
-            df = df.append(pd.DataFrame([[cpu]], columns=column_names))
+            sink.add([cpu])
         
         except AttributeError as e:
             print(str(e))
     
-    df.to_csv('../../data/base/intel_cpus.csv', index=False)
+    sink.close()
 
 def amd_processor_collector():
     column_names = ['title']
-    if not os.path.exists('../../data/base/amd_cpus.csv'):
-        df = pd.DataFrame(columns = column_names)
-    
-    else:
-        df = pd.read_csv('../../data/base/amd_cpus.csv')
+    sink = PairSink('../../data/base/amd_cpus.csv', columns=column_names, append=True)
     
     driver = webdriver.Chrome()
     driver.get('https://en.wikipedia.org/wiki/List_of_AMD_Athlon_microprocessors')
@@ -209,12 +197,12 @@ def amd_processor_collector():
         try:
             cpu = product.text.split('[')[0]
             print("Title: {}".format(cpu))
-            df = df.append(pd.DataFrame([[cpu]], columns=column_names))
+            sink.add([cpu])
         
         except AttributeError as e:
             print(str(e))
     
-    df.to_csv('../../data/base/amd_cpus.csv', index=False)
+    sink.close()
 
 if __name__ == "__main__":
     amd_processor_collector()
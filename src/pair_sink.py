@@ -0,0 +1,98 @@
+import os
+import pandas as pd
+
+# The columns of the pair data (like Common.COLUMN_NAMES, which is not imported as src.common needs torch)
+PAIR_COLUMNS = ['title_one', 'title_two', 'label']
+
+class PairSink():
+    '''
+    Collects rows (by default pairs of titles and a label) in columnar chunks instead of growing a
+    DataFrame one row at a time, which copies everything collected so far on every row.
+    With a path, every full chunk is appended to the CSV (after the rows already in it if append is set),
+    so only one chunk is kept in memory. Without a path, the chunks are kept and frame() joins them once.
+    '''
+
+    def __init__(self, path=None, columns=PAIR_COLUMNS, chunk_size=10000, append=False):
+        self.path = path
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.buffer = {column: [] for column in self.columns}
+        self.buffered = 0
+        self.chunks = []
+        self.rows = 0
+
+        # The columns of the CSV, which are the ones already in it when appending
+        self.file_columns = None
+        if path is not None and append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file_columns = list(pd.read_csv(path, nrows=0).columns)
+        elif path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            pd.DataFrame(columns=self.columns).to_csv(path, index=False)
+            self.file_columns = self.columns
+
+    def add(self, row):
+        '''
+        Adds a row (a list of the values of the columns, in order)
+        '''
+
+        for column, value in zip(self.columns, row):
+            self.buffer[column].append(value)
+
+        self.buffered += 1
+        self.rows += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def add_frame(self, df):
+        '''
+        Adds the rows of a DataFrame that has the columns of the sink
+        '''
+
+        self.flush()
+        self.write(df[self.columns].reset_index(drop=True))
+        self.rows += len(df)
+
+    def flush(self):
+        if self.buffered:
+            chunk = pd.DataFrame(self.buffer, columns=self.columns)
+            self.buffer = {column: [] for column in self.columns}
+            self.buffered = 0
+            self.write(chunk)
+
+    def write(self, chunk):
+        if self.path is None:
+            self.chunks.append(chunk)
+        else:
+            chunk.reindex(columns=self.file_columns).to_csv(self.path, mode='a', header=False, index=False)
+
+    def frame(self):
+        '''
+        Everything that was added, as a DataFrame (read back from the CSV when there is a path)
+        '''
+
+        self.flush()
+        if self.path is not None:
+            return pd.read_csv(self.path)
+
+        if not self.chunks:
+            return pd.DataFrame(columns=self.columns)
+
+        # Joined once and kept, so frame() can be called again without copying
+        self.chunks = [pd.concat(self.chunks, ignore_index=True)]
+        return self.chunks[0]
+
+    def close(self):
+        self.flush()
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
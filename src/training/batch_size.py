@@ -0,0 +1,181 @@
+import gc
+import numpy as np
+import torch
+from src.training.dataset import pair_lengths
+
+def is_oom_error(error):
+    '''
+    Checks if a RuntimeError is PyTorch running out of memory (on the GPU or the CPU)
+    '''
+
+    message = str(error)
+    return 'out of memory' in message or "can't allocate memory" in message
+
+def free_memory():
+    '''
+    Releases the memory left over from a failed batch
+    '''
+
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def longest_examples(data, amount):
+    '''
+    Indices of the examples with the most tokens, which are the worst case for memory
+    '''
+
+    return np.argsort(-pair_lengths(data), kind='stable')[:amount]
+
+def probe_micro_batch_size(net, forward_prop, criterion, data, labels, max_size):
+    '''
+    Finds the largest micro-batch (up to max_size) that can do forward and backward
+    propagation on the longest examples of the data without running out of memory.
+    Sizes are doubled until one fails, then binary searched.
+    '''
+
+    order = np.resize(longest_examples(data, max_size), max_size)
+
+    def fits(size):
+        try:
+            net.zero_grad()
+            loss, forward = forward_prop(data[order[:size]], labels[order[:size]], net, criterion)
+            loss.backward()
+            return True
+
+        except RuntimeError as e:
+            if not is_oom_error(e):
+                raise
+            return False
+
+        finally:
+            net.zero_grad()
+            free_memory()
+
+    if not fits(1):
+        raise RuntimeError('Not enough memory to train with a micro-batch of 1')
+
+    # Double the size until it does not fit (high is the smallest size known not to work)
+    low, high = 1, max_size + 1
+    size = 2
+    while size < high:
+        if not fits(size):
+            high = size
+            break
+        low = size
+        size *= 2
+
+    # Binary search between the largest size that fits and the smallest that does not
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+
+    return low
+
+def save_grads(params):
+    '''
+    Copies of the gradients of the parameters (None for the ones without a gradient)
+    '''
+
+    with torch.no_grad():
+        return [param.grad.clone() if param.grad is not None else None for param in params]
+
+def restore_grads(params, saved_grads):
+    '''
+    Puts back the gradients from save_grads. Returns whether any of them had changed.
+    '''
+
+    changed = False
+    with torch.no_grad():
+        for param, saved in zip(params, saved_grads):
+            if saved is None:
+                changed = changed or param.grad is not None
+                param.grad = None
+            elif param.grad is None:
+                changed = True
+                param.grad = saved
+            else:
+                changed = changed or not torch.equal(param.grad, saved)
+                param.grad.copy_(saved)
+
+    return changed
+
+class AdaptiveBatchRunner():
+    '''
+    Runs batches in chunks that fit in memory. When a chunk runs out of memory, it is retried
+    as two halves (recursively, down to single examples), so no example is skipped.
+    The size that worked is remembered for each bucket of sequence lengths, so later batches
+    of similar length are split up front, and the limit is lifted again after grow_after
+    batches of the bucket went through without running out of memory.
+    '''
+
+    def __init__(self, bucket_width=16, grow_after=100):
+        self.bucket_width = bucket_width
+        self.grow_after = grow_after
+        # Bucket to the largest chunk size known to fit, and the batches since it was lowered
+        self.safe_sizes = {}
+        self.successes = {}
+        self.splits = 0
+        self.retries = 0
+
+    def bucket(self, data):
+        return int(pair_lengths(data).max()) // self.bucket_width
+
+    def run(self, fn, data, labels, timer=None, params=None):
+        '''
+        Calls fn(chunk_data, chunk_labels, last) on consecutive chunks that together are the batch,
+        where last is only set for the chunk that ends the batch. Returns the results of fn in order.
+        fn must not change any state before it can run out of memory (like stepping an optimizer).
+        params: Parameters whose gradients fn accumulates into. Running out of memory during backward can leave
+        the gradients of part of a chunk in them, which its halves would add again, so the gradients are copied
+        before every chunk and restored when it fails (this costs a copy of the gradients per chunk).
+        '''
+
+        if len(data) == 0:
+            return []
+
+        bucket = self.bucket(data)
+        size = min(len(data), self.safe_sizes.get(bucket, len(data)))
+        pending = [(start, min(start + size, len(data))) for start in range(0, len(data), size)]
+        results = []
+        while pending:
+            start, end = pending.pop(0)
+            saved_grads = save_grads(params) if params is not None else None
+            try:
+                results.append(fn(data[start:end], labels[start:end], end == len(data)))
+
+            except RuntimeError as e:
+                if not is_oom_error(e) or end - start == 1:
+                    raise
+
+                if saved_grads is not None and restore_grads(params, saved_grads):
+                    print('WARNING: Ran out of memory during backward. Restored the gradients from before the chunk.')
+                saved_grads = None
+                free_memory()
+                self.splits += 1
+                self.retries += 2
+                if timer is not None:
+                    timer.count('oom_splits', 1)
+                    timer.count('oom_retries', 2)
+
+                # Retry as two halves, and remember that this size does not fit
+                middle = (start + end) // 2
+                pending = [(start, middle), (middle, end)] + pending
+                self.safe_sizes[bucket] = min(self.safe_sizes.get(bucket, end - start), middle - start)
+                self.successes[bucket] = 0
+                print('WARNING: Ran out of memory with {} examples. Retrying as {} and {}.'.format(end - start, middle - start, end - middle))
+
+        # Try bigger chunks again once the bucket has been fine for a while
+        if bucket in self.safe_sizes:
+            self.successes[bucket] = self.successes.get(bucket, 0) + 1
+            if self.successes[bucket] >= self.grow_after:
+                self.safe_sizes[bucket] *= 2
+                self.successes[bucket] = 0
+
+        return results
+
+    def stats(self):
+        return {'oom_splits': self.splits, 'oom_retries': self.retries, 'safe_sizes': dict(self.safe_sizes)}
@@ -0,0 +1,124 @@
+import os
+import re
+import random
+import numpy as np
+import torch
+
+def get_rng_states():
+    '''
+    The states of every random number generator used in training
+    '''
+
+    states = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        states['cuda'] = torch.cuda.get_rng_state_all()
+
+    return states
+
+def set_rng_states(states):
+    '''
+    Restores the states from get_rng_states
+    '''
+
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if 'cuda' in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+def load_file(path):
+    '''
+    Loads a checkpoint file onto the CPU (the state dicts move it to the right device)
+    '''
+
+    try:
+        # Checkpoints hold more than tensors (RNG states and metrics)
+        return torch.load(path, map_location='cpu', weights_only=False)
+    except TypeError:
+        # Older versions of PyTorch do not have weights_only
+        return torch.load(path, map_location='cpu')
+
+class CheckpointManager():
+    '''
+    Saves full training checkpoints (model, optimizer, RNG states and the training state)
+    to a folder and only keeps the newest ones so that disk usage stays bounded
+    '''
+
+    def __init__(self, folder, prefix, keep=3):
+        # Resuming needs the newest checkpoint, so at least that one is kept
+        if keep < 1:
+            raise ValueError('At least 1 checkpoint must be kept (got {})'.format(keep))
+
+        self.folder = folder
+        self.prefix = prefix
+        self.keep = keep
+
+        # Only the checkpoints of this run (not of a run whose name starts with the same prefix, like model_v2)
+        self.pattern = re.compile(r'^{}_(\d+)\.ckpt$'.format(re.escape(prefix)))
+        os.makedirs(folder, exist_ok=True)
+
+    def paths(self):
+        '''
+        The checkpoints in the folder from oldest to newest
+        '''
+
+        names = [name for name in os.listdir(self.folder) if self.pattern.match(name)]
+        names.sort(key=lambda name: int(self.pattern.match(name).group(1)))
+        return [os.path.join(self.folder, name) for name in names]
+
+    def clear(self):
+        '''
+        Deletes the checkpoints of an earlier run with the same prefix, so a new run does not resume
+        (or rotate away its own checkpoints for) the ones of a longer run that had higher steps
+        '''
+
+        for path in self.paths():
+            os.remove(path)
+
+    def latest(self):
+        paths = self.paths()
+        return paths[-1] if paths else None
+
+    def save(self, step, net, opt, state):
+        '''
+        Saves a checkpoint for an optimizer step.
+        state is a dictionary of the rest of the training state (epoch, position in the data, running metrics)
+        '''
+
+        checkpoint = {'model': net.state_dict(),
+                      'optimizer': opt.state_dict(),
+                      'rng': get_rng_states(),
+                      'step': step,
+                      'state': state}
+
+        # Write to a temporary file first so a crash while saving does not leave a broken checkpoint
+        path = os.path.join(self.folder, '{}_{:09d}.ckpt'.format(self.prefix, step))
+        torch.save(checkpoint, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        paths = self.paths()
+        for old_path in paths[:len(paths) - self.keep]:
+            os.remove(old_path)
+
+        return path
+
+    def read(self, path):
+        '''
+        Reads a checkpoint without restoring it, so the training state can be used before the model is ready
+        '''
+
+        return load_file(path)
+
+    def load(self, path, net, opt):
+        return self.restore(self.read(path), net, opt)
+
+    def restore(self, checkpoint, net, opt):
+        '''
+        Restores the model, optimizer and RNG states from a checkpoint.
+        Returns the step and the rest of the training state.
+        '''
+
+        net.load_state_dict(checkpoint['model'])
+        opt.load_state_dict(checkpoint['optimizer'])
+        set_rng_states(checkpoint['rng'])
+        return checkpoint['step'], checkpoint['state']
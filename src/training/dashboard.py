@@ -0,0 +1,156 @@
+import time
+import queue
+import threading
+import numpy as np
+import requests
+
+# Where NLP Dashboard listens
+DASHBOARD_URL = 'http://localhost:3000'
+
+# Keys of the batch statistics and of the examples NLP Dashboard stores
+BATCH_KEYS = ['epoch', 'batch', 'accuracy', 'loss', 'runningAccuracy', 'runningLoss']
+EXAMPLE_KEYS = ['epoch', 'batch', 'title1', 'title2', 'positivePercentage', 'negativePercentage', 'modelPrediction', 'label']
+
+def batch_records(epoch, batch_num, batch_data, forward, labels, accuracy, loss, running_accuracy, running_loss):
+    '''
+    The statistics of a batch and its examples (epoch, batch number, titles, positive softmax,
+    negative softmax, prediction and label) as the dictionaries NLP Dashboard takes
+    '''
+
+    batch_size = len(labels)
+    forward = forward.detach().float().cpu().numpy() if hasattr(forward, 'detach') else np.asarray(forward)
+
+    # To send the examples, we need the epoch and batch number on each example
+    batch_epoch = np.tile(np.array([epoch, batch_num]), (batch_size, 1))
+    examples = np.concatenate((batch_epoch, # epoch/batch
+                               batch_data, # titles
+                               np.round(forward[:, 1].reshape(batch_size, 1), 4).astype(str).astype(float),
+                               np.round(forward[:, 0].reshape(batch_size, 1), 4).astype(str).astype(float),
+                               np.argmax(forward, axis=1).reshape(batch_size, 1),
+                               np.asarray(labels).astype(int).reshape(batch_size, 1)),
+                              axis=1)
+
+    batch_info = [epoch,
+                  batch_num,
+                  float('%.4f'%(accuracy)),
+                  float('%.4f'%(loss)),
+                  float('%.4f'%(running_accuracy)),
+                  float('%.4f'%(running_loss))]
+
+    return dict(zip(BATCH_KEYS, batch_info)), [dict(zip(EXAMPLE_KEYS, example)) for example in examples.tolist()]
+
+class DashboardReporter():
+    '''
+    Sends batches to NLP Dashboard from a background thread so training never waits on HTTP.
+    Batches are put on a bounded queue and coalesced into one bulk request per table every
+    flush_interval seconds, over one pooled HTTP session. When the queue is half full only the
+    statistics of new batches are kept (not their examples), and when it is full they are dropped.
+    If the dashboard is down, the requests fail with a warning and training continues.
+    '''
+
+    def __init__(self, model_name, url=DASHBOARD_URL, flush_interval=1.0, max_queue=1000, timeout=5.0):
+        self.model_name = model_name
+        self.url = url
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.session = requests.Session()
+        self.downsampled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.posted = 0
+        self.failing = False
+        self.thread = threading.Thread(target=self.run, name='dashboard-reporter', daemon=True)
+        self.thread.start()
+
+    def request(self, method, path, payload):
+        '''
+        Makes a request to the dashboard, returning whether it worked
+        '''
+
+        try:
+            response = self.session.request(method, self.url + path, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.failed += 1
+            if not self.failing:
+                print('WARNING: Could not reach NLP Dashboard ({}). Training continues without it.'.format(e))
+            self.failing = True
+            return False
+
+        if self.failing:
+            print('NLP Dashboard is reachable again.')
+        self.failing = False
+        return True
+
+    def create_db(self, tables):
+        self.request('POST', '/create_db', {'model_name': self.model_name, 'tables': tables})
+
+    def delete_db(self):
+        self.request('DELETE', '/delete_db', {'model_name': self.model_name})
+
+    def report(self, table, batch_info, examples):
+        '''
+        Queues the statistics and examples of a batch (from batch_records) for the table, without blocking
+        '''
+
+        if self.queue.qsize() >= self.queue.maxsize // 2:
+            examples = []
+            self.downsampled += 1
+
+        try:
+            self.queue.put_nowait((table, batch_info, examples))
+        except queue.Full:
+            self.dropped += 1
+
+    def post(self, pending):
+        '''
+        Sends the queued batches with one request per table for the statistics and one for the examples
+        '''
+
+        tables = {}
+        for table, batch_info, examples in pending:
+            infos, table_examples = tables.setdefault(table, ([], []))
+            infos.append(batch_info)
+            if examples:
+                table_examples.append(examples)
+
+        for table, (infos, table_examples) in tables.items():
+            if self.request('PUT', '/add_batch_data', {'model_name': self.model_name, 'data': infos, 'table': table}):
+                self.posted += len(infos)
+            if table_examples:
+                self.request('PUT', '/add_examples_data', {'model_name': self.model_name, 'data': table_examples, 'table': table})
+
+    def run(self):
+        pending = []
+        last_post = time.perf_counter()
+        closing = False
+        while not closing:
+            try:
+                item = self.queue.get(timeout=max(0.0, self.flush_interval - (time.perf_counter() - last_post)))
+                if item is None:
+                    closing = True
+                else:
+                    pending.append(item)
+            except queue.Empty:
+                pass
+
+            if pending and (closing or time.perf_counter() - last_post >= self.flush_interval):
+                self.post(pending)
+                pending = []
+                last_post = time.perf_counter()
+            elif not pending:
+                last_post = time.perf_counter()
+
+    def close(self):
+        '''
+        Sends whatever is still queued and stops the thread
+        '''
+
+        # Wait for room in the queue, so the last batches are not lost
+        self.queue.put(None)
+        self.thread.join()
+        self.session.close()
+        if self.downsampled or self.dropped:
+            print('NLP Dashboard: sent {} batches, {} without their examples and {} dropped because the queue was full'.format(
+                  self.posted, self.downsampled, self.dropped))
@@ -0,0 +1,90 @@
+'''
+A stand-in for NLP Dashboard that keeps what it receives in memory, for trying -visualizer
+(and benchmarking it) without the real dashboard.
+
+Usage: python -m src.training.dashboard_server [<port>] [<delay-ms>]
+delay-ms makes every request take that long, like a slow dashboard.
+'''
+
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class DashboardStore():
+    '''
+    The tables of every model and the batches and examples sent to them
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.requests = 0
+
+    def handle(self, path, payload):
+        with self.lock:
+            self.requests += 1
+            model = self.tables.setdefault(payload.get('model_name'), {})
+            if path == '/create_db':
+                for table in payload['tables']:
+                    model.setdefault(table, {'batches': [], 'examples': []})
+            elif path == '/delete_db':
+                self.tables.pop(payload.get('model_name'), None)
+            elif path == '/add_batch_data':
+                model.setdefault(payload['table'], {'batches': [], 'examples': []})['batches'] += payload['data']
+            elif path == '/add_examples_data':
+                table = model.setdefault(payload['table'], {'batches': [], 'examples': []})
+                for examples in payload['data']:
+                    table['examples'] += examples
+            else:
+                return False
+
+        return True
+
+def make_handler(store, delay=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if delay:
+                time.sleep(delay)
+            found = store.handle(self.path, payload)
+            self.send_response(200 if found else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_POST = respond
+        do_PUT = respond
+        do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class DashboardServer():
+    '''
+    Runs the stand-in server on a background thread (port 0 picks a free port)
+    '''
+
+    def __init__(self, port=0, delay=0.0):
+        self.store = DashboardStore()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(self.store, delay))
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(DashboardStore(), delay))
+    print('Stand-in NLP Dashboard listening on http://127.0.0.1:{}'.format(port))
+    server.serve_forever()
@@ -0,0 +1,221 @@
+import random
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset, Sampler, BatchSampler, DataLoader
+
+def pair_lengths(data):
+    '''
+    The amount of words in each pair of titles, which is how many tokens
+    CharacterBERT gets for the pair (besides the [CLS] and [SEP] tags)
+    '''
+
+    return np.array([len(str(title_one).split()) + len(str(title_two).split()) for title_one, title_two in data])
+
+class TitlePairDataset(Dataset):
+    '''
+    Title pairs and their labels, held in memory as NumPy arrays so that
+    CSV parsing happens once instead of on every batch
+    '''
+
+    def __init__(self, data, labels):
+        self.data = data
+        self.labels = labels
+
+    @classmethod
+    def from_csv(cls, path, nrows=None):
+        '''
+        Loads the titles and labels of a training CSV (like total_data.csv)
+        '''
+
+        df = pd.read_csv(path, usecols=['title_one', 'title_two', 'label'], nrows=nrows)
+        data = df[['title_one', 'title_two']].to_numpy()
+        labels = df['label'].to_numpy().astype('float32')
+        return cls(data, labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        # idx can be a list of indices so that a whole batch is fetched at once
+        return self.data[idx], self.labels[idx]
+
+    def split(self, train_size):
+        '''
+        Splits the data into training (the first train_size rows) and validation (the rest).
+        train_size can be a number of rows or a fraction of the data.
+        '''
+
+        if isinstance(train_size, float):
+            train_size = int(len(self) * train_size)
+
+        return (TitlePairDataset(self.data[:train_size], self.labels[:train_size]),
+                TitlePairDataset(self.data[train_size:], self.labels[train_size:]))
+
+class EpochShuffleSampler(Sampler):
+    '''
+    Samples the indices in a different order every epoch.
+    The order only depends on the seed and the epoch, so runs are reproducible
+    and a resumed run can skip the batches it already trained on.
+    With num_replicas > 1 each rank gets every num_replicas-th index of the order,
+    padded so that all the ranks take the same amount of steps.
+    Extra indices (like mined hard examples) are shuffled in with the rest.
+    '''
+
+    def __init__(self, length, seed=0, shuffle=True, num_replicas=1, rank=0):
+        self.length = length
+        self.seed = seed
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start = 0
+        self.extra = np.zeros(0, dtype=np.int64)
+
+    def set_epoch(self, epoch, start_batch=0, batch_size=1):
+        '''
+        Sets the epoch (which decides the order) and how many batches of batch_size examples of it to skip
+        (every batch before the last one of an epoch is full, so they start at start_batch * batch_size)
+        '''
+
+        self.epoch = epoch
+        self.start = start_batch * batch_size
+
+    def set_extra(self, indices):
+        '''
+        Sets indices that are sampled on top of the data every epoch (until they are replaced)
+        '''
+
+        self.extra = np.asarray(indices, dtype=np.int64)
+
+    def total_length(self):
+        return self.length + len(self.extra)
+
+    def indices(self):
+        '''
+        The order of the indices for the current epoch
+        '''
+
+        order = np.arange(self.length)
+        if len(self.extra):
+            order = np.concatenate((order, self.extra))
+
+        if self.shuffle:
+            rng = np.random.default_rng([self.seed, self.epoch])
+            order = order[rng.permutation(len(order))]
+
+        if self.num_replicas == 1:
+            return order
+
+        # Repeat the start of the order so it splits evenly between the ranks
+        padding = self.shard_length() * self.num_replicas - len(order)
+        order = np.concatenate((order, order[:padding]))
+        return order[self.rank::self.num_replicas]
+
+    def shard_length(self):
+        '''
+        The amount of indices each rank gets in an epoch
+        '''
+
+        return -(-self.total_length() // self.num_replicas)
+
+    def __iter__(self):
+        return iter(self.indices()[self.start:].tolist())
+
+    def __len__(self):
+        return self.shard_length() - self.start
+
+class BucketBatchSampler(EpochShuffleSampler):
+    '''
+    Samples batches of pairs with similar lengths so little of each batch is padding ("sortish" sampling).
+    Every epoch the indices are shuffled like EpochShuffleSampler, cut into chunks of bucket_batches batches,
+    and each chunk is sorted by length and cut into batches. The order of the batches is then shuffled,
+    except for the one batch that is not full, which always comes last.
+    A resumed run skips the batches it already trained on by their position in this order.
+    '''
+
+    def __init__(self, lengths, batch_size, bucket_batches=100, seed=0, shuffle=True, num_replicas=1, rank=0):
+        super(BucketBatchSampler, self).__init__(len(lengths), seed=seed, shuffle=shuffle, num_replicas=num_replicas, rank=rank)
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.start_batch = 0
+
+    def set_epoch(self, epoch, start_batch=0, batch_size=None):
+        '''
+        Sets the epoch and how many of its batches to skip (the batches are always of the batch size of the sampler)
+        '''
+
+        self.epoch = epoch
+        self.start_batch = start_batch
+
+    def batches(self):
+        '''
+        All of the batches of the current epoch (of this rank)
+        '''
+
+        order = self.indices()
+        chunk_size = self.batch_size * self.bucket_batches
+        batches = []
+        for position in range(0, len(order), chunk_size):
+            chunk = order[position:position + chunk_size]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+            batches += [chunk[i:i + self.batch_size] for i in range(0, len(chunk), self.batch_size)]
+
+        full = [batch for batch in batches if len(batch) == self.batch_size]
+        partial = [batch for batch in batches if len(batch) < self.batch_size]
+        if self.shuffle:
+            rng = np.random.default_rng([self.seed, self.epoch, 2])
+            full = [full[i] for i in rng.permutation(len(full))]
+
+        return full + partial
+
+    def __iter__(self):
+        for batch in self.batches()[self.start_batch:]:
+            yield batch.tolist()
+
+    def __len__(self):
+        return max(-(-self.shard_length() // self.batch_size) - self.start_batch, 0)
+
+def keep_batch(batch):
+    '''
+    Leaves the (titles, labels) batch as NumPy arrays, which is what forward_prop expects
+    '''
+
+    return batch
+
+def seed_everything(seed):
+    '''
+    Seeds Python, NumPy and PyTorch
+    '''
+
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def seed_worker(worker_id):
+    '''
+    Seeds Python and NumPy in a DataLoader worker from the seed PyTorch gave it
+    '''
+
+    worker_seed = torch.initial_seed() % 2**32
+    random.seed(worker_seed)
+    np.random.seed(worker_seed)
+
+def make_loader(dataset, sampler, batch_size, num_workers=0, seed=0):
+    '''
+    Creates a DataLoader that fetches whole batches from the dataset with worker processes.
+    A BucketBatchSampler already makes its own batches (of its batch size).
+    '''
+
+    if not isinstance(sampler, BucketBatchSampler):
+        sampler = BatchSampler(sampler, batch_size, drop_last=False)
+
+    return DataLoader(dataset,
+                      sampler=sampler,
+                      batch_size=None,
+                      collate_fn=keep_batch,
+                      num_workers=num_workers,
+                      worker_init_fn=seed_worker,
+                      persistent_workers=num_workers > 0,
+                      generator=torch.Generator().manual_seed(seed))
@@ -0,0 +1,111 @@
+import os
+import datetime
+import contextlib
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+# Address and port rank 0 listens on when the ranks are spawned on this machine
+MASTER_ADDR = '127.0.0.1'
+MASTER_PORT = '29500'
+
+# How long ranks wait for each other (the other ranks wait while rank 0 validates)
+TIMEOUT = datetime.timedelta(hours=3)
+
+def launched_ranks():
+    '''
+    The (rank, world size) given by a launcher like torchrun through the environment,
+    or None if the process was started directly
+    '''
+
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        return int(os.environ['RANK']), int(os.environ['WORLD_SIZE'])
+
+    return None
+
+def local_world_size(world_size):
+    '''
+    The amount of ranks running on this machine
+    '''
+
+    return int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+
+def init_distributed(rank, world_size, backend='gloo'):
+    '''
+    Joins the process group and splits the CPU threads of the machine between its ranks.
+    Does nothing for a single rank.
+    '''
+
+    if world_size == 1:
+        return
+
+    # torchrun sets these for multi-machine runs
+    os.environ.setdefault('MASTER_ADDR', MASTER_ADDR)
+    os.environ.setdefault('MASTER_PORT', MASTER_PORT)
+    dist.init_process_group(backend, rank=rank, world_size=world_size, timeout=TIMEOUT)
+
+    # Every rank using all the cores would oversubscribe them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size(world_size)))
+
+def cleanup(world_size):
+    if world_size > 1:
+        dist.destroy_process_group()
+
+def barrier(world_size):
+    if world_size > 1:
+        dist.barrier()
+
+def wrap(net, world_size, find_unused_parameters=True):
+    '''
+    Wraps the model so its gradients are all-reduced between the ranks.
+    Returns the model itself for a single rank.
+    '''
+
+    if world_size == 1:
+        return net
+
+    # Some parameters (like the pooler of BERT) never get a gradient
+    return DistributedDataParallel(net, find_unused_parameters=find_unused_parameters)
+
+def no_sync(net, sync):
+    '''
+    Skips the all-reduce of the gradients unless sync is set,
+    so accumulated micro-batches only communicate once per optimizer step
+    '''
+
+    if sync or not isinstance(net, DistributedDataParallel):
+        return contextlib.nullcontext()
+
+    return net.no_sync()
+
+def min_across_ranks(value, world_size):
+    '''
+    The smallest value any rank has (so every rank agrees on things like the micro-batch size)
+    '''
+
+    if world_size == 1:
+        return value
+
+    tensor = torch.tensor(value)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MIN)
+    return tensor.item()
+
+def broadcast_object(obj, world_size, src=0):
+    '''
+    Sends a picklable object from rank src to every rank (and returns it on every rank)
+    '''
+
+    if world_size == 1:
+        return obj
+
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+def spawn(fn, world_size, *args):
+    '''
+    Runs fn(rank, world_size, *args) in world_size processes on this machine
+    '''
+
+    mp.spawn(fn, args=(world_size,) + args, nprocs=world_size, join=True)
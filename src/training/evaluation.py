@@ -0,0 +1,121 @@
+import numpy as np
+import torch
+
+""" LOCAL IMPORTS """
+from src.training.dataset import pair_lengths
+from src.training.metrics import StreamingMetrics
+from src.training.batch_size import AdaptiveBatchRunner
+
+def format_metrics(name, metrics):
+    return '%s: Loss: %.6f, Accuracy: %.6f, Precision: %.3f, Recall: %.3f, F1 Score: %.3f, ROC AUC: %.3f, Best F1: %.3f (threshold %.3f) (%d examples)' % (
+           name, metrics['loss'], metrics['accuracy'], metrics['precision'], metrics['recall'], metrics['f1'],
+           metrics['roc_auc'], metrics['best_f1'], metrics['best_threshold'], metrics['examples'])
+
+class EvaluationEngine():
+    '''
+    Evaluates a model on several suites (the validation data and the test sets) in one pass.
+    The pairs of all the suites are deduplicated (the same titles only go through the model once,
+    even when they are in several suites) and sorted by length, so the big inference batches have
+    little padding. Scoring runs under torch.inference_mode() without the L2 penalty, and the
+    metrics of every suite are accumulated from the scores afterwards (on the device of the net).
+    '''
+
+    def __init__(self, suites, batch_size=64):
+        '''
+        suites: (name, data, labels) of each suite, in the order they are reported
+        batch_size: The amount of pairs in each inference batch
+        '''
+
+        self.batch_size = batch_size
+
+        # Batches that run out of memory are scored as smaller chunks, so no pair is skipped
+        self.runner = AdaptiveBatchRunner()
+        self.suites = []
+        positions = {}
+        for name, data, labels in suites:
+            # Position of every pair of the suite in the unique pairs
+            indices = np.array([positions.setdefault((title_one, title_two), len(positions)) for title_one, title_two in data], dtype=np.int64)
+            self.suites.append((name, data, labels, indices))
+
+        self.pairs = np.empty((len(positions), 2), dtype=object)
+        for (title_one, title_two), position in positions.items():
+            self.pairs[position] = (title_one, title_two)
+
+        # Batches of pairs with similar lengths
+        self.order = np.argsort(pair_lengths(self.pairs), kind='stable')
+
+    def names(self):
+        return [suite[0] for suite in self.suites]
+
+    def total_pairs(self):
+        return sum(len(suite[3]) for suite in self.suites)
+
+    def score(self, net, forward_prop, criterion, timer=None, telemetry=None, profiler=None):
+        '''
+        The softmax outputs of the net for every unique pair (a (pairs, 2) tensor on the device of the net).
+        Every batch is a step of the profiler (a StepProfiler), if one is given.
+        '''
+
+        was_training = net.training
+        net.eval()
+        forward = None
+
+        # forward_prop needs labels for its loss, which is not used
+        no_labels = np.zeros(self.batch_size, dtype='float32')
+        with torch.inference_mode():
+            for i, position in enumerate(range(0, len(self.order), self.batch_size)):
+                batch = self.order[position:position + self.batch_size]
+                chunks = self.runner.run(lambda chunk_data, chunk_labels, last: forward_prop(chunk_data, chunk_labels, net, criterion, regularize=False, timer=timer)[1],
+                                         self.pairs[batch], no_labels[:len(batch)], timer=timer)
+                batch_forward = torch.cat(chunks)
+                if forward is None:
+                    forward = torch.zeros((len(self.pairs), 2), device=batch_forward.device)
+                forward[torch.from_numpy(batch).to(forward.device)] = batch_forward.float()
+
+                # Every batch is a step of the telemetry
+                if timer is not None:
+                    timer.count('examples', len(batch))
+                    if telemetry is not None:
+                        telemetry.record(timer.end_step(), name='Evaluation', batch=i + 1)
+
+                if profiler is not None:
+                    profiler.step()
+
+        if telemetry is not None:
+            telemetry.flush(name='Evaluation')
+
+        net.train(was_training)
+        return forward if forward is not None else torch.zeros((0, 2))
+
+    def metrics(self, forward, criterion):
+        '''
+        The metrics of each suite (by name) from the scores of the unique pairs
+        '''
+
+        results = {}
+        with torch.inference_mode():
+            for name, data, labels, indices in self.suites:
+                metrics = StreamingMetrics()
+                for position in range(0, len(indices), self.batch_size):
+                    batch_forward = forward[torch.from_numpy(indices[position:position + self.batch_size]).to(forward.device)]
+                    batch_labels = torch.from_numpy(labels[position:position + self.batch_size]).to(forward.device).long()
+                    metrics.update(batch_forward, batch_labels, criterion(batch_forward, batch_labels))
+                results[name] = metrics.compute()
+
+        return results
+
+    def outputs(self, forward):
+        '''
+        (name, data, labels, forward) of each suite, for reporting the individual examples
+        '''
+
+        forward = forward.cpu().numpy()
+        for name, data, labels, indices in self.suites:
+            yield name, data, labels, forward[indices]
+
+    def evaluate(self, net, forward_prop, criterion, timer=None, telemetry=None, profiler=None):
+        '''
+        Scores every suite and returns their metrics
+        '''
+
+        return self.metrics(self.score(net, forward_prop, criterion, timer=timer, telemetry=telemetry, profiler=profiler), criterion)
@@ -0,0 +1,69 @@
+import numpy as np
+import torch
+
+def score_pairs(net, forward_prop, criterion, data, labels, batch_size):
+    '''
+    The positive probability the net gives each pair, using batched inference without gradients
+    '''
+
+    was_training = net.training
+    net.eval()
+    scores = []
+    with torch.no_grad():
+        for position in range(0, len(data), batch_size):
+            loss, forward = forward_prop(data[position:position + batch_size], labels[position:position + batch_size], net, criterion, regularize=False)
+            scores.append(forward[:, 1].float().cpu().numpy())
+
+    net.train(was_training)
+    return np.concatenate(scores) if scores else np.zeros(0, dtype='float32')
+
+def select_hard_examples(scores, labels, keep, threshold=0.5):
+    '''
+    Positions of the hardest negatives (the keep negatives with the highest positive probability)
+    and of the false-negative positives (up to keep positives below the threshold, lowest first)
+    '''
+
+    negatives = np.flatnonzero(labels == 0)
+    hardest = negatives[np.argsort(-scores[negatives], kind='stable')[:keep]]
+
+    positives = np.flatnonzero((labels == 1) & (scores < threshold))
+    missed = positives[np.argsort(scores[positives], kind='stable')[:keep]]
+    return hardest, missed
+
+class HardExampleMiner():
+    '''
+    Scores a random pool of the training data with the current model and keeps the examples it gets
+    most wrong, so they can be trained on again in the next epochs (mixed in with EpochShuffleSampler.set_extra).
+    The pool only depends on the seed and the epoch, so mining is reproducible.
+    '''
+
+    def __init__(self, pool_size, keep, batch_size, seed=0):
+        self.pool_size = pool_size
+        self.keep = keep
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def pool(self, length, epoch):
+        rng = np.random.default_rng([self.seed, epoch, 1])
+        return np.sort(rng.choice(length, size=min(self.pool_size, length), replace=False))
+
+    def mine(self, net, forward_prop, criterion, dataset, epoch):
+        '''
+        Returns the indices (into the dataset) of the mined examples and statistics of the pool
+        '''
+
+        pool = self.pool(len(dataset), epoch)
+        data, labels = dataset[pool]
+        scores = score_pairs(net, forward_prop, criterion, data, labels, self.batch_size)
+        hardest, missed = select_hard_examples(scores, labels, self.keep)
+
+        predictions = scores >= 0.5
+        stats = {'pool': len(pool),
+                 'pool_accuracy': float(np.mean(predictions == labels)) if len(pool) else 0.0,
+                 'false_positives': int(np.sum(predictions & (labels == 0))),
+                 'false_negatives': int(np.sum(~predictions & (labels == 1))),
+                 'hard_negatives': len(hardest),
+                 'missed_positives': len(missed),
+                 'hardest_negative_score': float(scores[hardest].mean()) if len(hardest) else 0.0}
+
+        return pool[np.concatenate((hardest, missed))], stats
@@ -0,0 +1,114 @@
+import numpy as np
+import torch
+
+def safe_divide(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+class StreamingMetrics():
+    '''
+    Accumulates the metrics of a binary classifier batch by batch, keeping everything on the
+    device of the scores: the confusion matrix of the predictions (argmax of the softmax), the
+    summed loss and a histogram of the positive probability of each class.
+    compute() turns the counts into precision, recall and F1 score, the ROC and precision-recall
+    curves over bins thresholds and the threshold with the best F1 score, so nothing is
+    recomputed per batch and no batch is too small to divide by.
+    '''
+
+    def __init__(self, bins=1000):
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        # tn, fp, fn, tp
+        self.confusion = None
+        # Row 0 is the histogram of the negatives, row 1 of the positives
+        self.histogram = None
+        self.loss = None
+        self.examples = 0
+
+    def update(self, forward, labels, loss=None):
+        '''
+        forward: The (batch, 2) softmax outputs of the net
+        labels: The labels of the batch (a tensor or a NumPy array)
+        loss: The mean loss of the batch (optional)
+        '''
+
+        if self.confusion is None:
+            self.confusion = torch.zeros(4, dtype=torch.long, device=forward.device)
+            self.histogram = torch.zeros(2 * self.bins, dtype=torch.long, device=forward.device)
+            self.loss = torch.zeros((), dtype=torch.float64, device=forward.device)
+
+        forward = forward.detach()
+        labels = torch.as_tensor(labels, device=forward.device).view(-1).long()
+        predictions = torch.argmax(forward, dim=1)
+        self.confusion += torch.bincount(labels * 2 + predictions, minlength=4)
+
+        # Scores of 1.0 go in the last bin
+        bins = (forward[:, 1].float() * self.bins).long().clamp(0, self.bins - 1)
+        self.histogram += torch.bincount(labels * self.bins + bins, minlength=2 * self.bins)
+
+        if loss is not None:
+            self.loss += loss.detach().double() * len(labels)
+        self.examples += len(labels)
+
+    def curves(self):
+        '''
+        The counts at each threshold (from the highest to 0), where a pair is positive if
+        its positive probability is at least the threshold
+        '''
+
+        histogram = self.histogram.view(2, self.bins).cpu().numpy()
+        thresholds = np.arange(self.bins - 1, -1, -1) / self.bins
+        fp = np.cumsum(histogram[0, ::-1])
+        tp = np.cumsum(histogram[1, ::-1])
+        return thresholds, tp, fp, histogram[1].sum(), histogram[0].sum()
+
+    def compute(self):
+        '''
+        The final metrics as a dictionary (the curves are NumPy arrays, ordered by decreasing threshold)
+        '''
+
+        if self.examples == 0:
+            return {'examples': 0, 'loss': 0.0, 'accuracy': 0.0, 'precision': 0.0, 'recall': 0.0, 'f1': 0.0,
+                    'tn': 0, 'fp': 0, 'fn': 0, 'tp': 0, 'roc_auc': 0.0, 'average_precision': 0.0,
+                    'best_threshold': 0.5, 'best_f1': 0.0}
+
+        tn, fp, fn, tp = (int(count) for count in self.confusion.cpu())
+        precision = safe_divide(tp, tp + fp)
+        recall = safe_divide(tp, tp + fn)
+
+        thresholds, curve_tp, curve_fp, positives, negatives = self.curves()
+        predicted = curve_tp + curve_fp
+        curve_precision = np.divide(curve_tp, predicted, out=np.ones(self.bins), where=predicted > 0)
+        curve_recall = curve_tp / positives if positives else np.zeros(self.bins)
+        curve_fpr = curve_fp / negatives if negatives else np.zeros(self.bins)
+        f1_denominator = curve_precision + curve_recall
+        curve_f1 = np.divide(2 * curve_precision * curve_recall, f1_denominator, out=np.zeros(self.bins), where=f1_denominator > 0)
+        best = int(np.argmax(curve_f1))
+
+        # The curves start at (0, 0), where nothing is predicted positive.
+        # The area under the ROC curve is a trapezoid sum (np.trapz is gone in NumPy 2.4)
+        roc_tpr = np.concatenate(([0.0], curve_recall))
+        roc_fpr = np.concatenate(([0.0], curve_fpr))
+        roc_auc = float(np.sum(np.diff(roc_fpr) * (roc_tpr[1:] + roc_tpr[:-1]) / 2))
+        average_precision = np.sum(np.diff(np.concatenate(([0.0], curve_recall))) * curve_precision)
+
+        return {'examples': self.examples,
+                'loss': float(self.loss) / self.examples,
+                'accuracy': safe_divide(tp + tn, self.examples),
+                'precision': precision,
+                'recall': recall,
+                'f1': safe_divide(2 * precision * recall, precision + recall),
+                'tn': tn,
+                'fp': fp,
+                'fn': fn,
+                'tp': tp,
+                'roc_auc': float(roc_auc),
+                'average_precision': float(average_precision),
+                'best_threshold': float(thresholds[best]),
+                'best_f1': float(curve_f1[best]),
+                'thresholds': thresholds,
+                'roc_fpr': curve_fpr,
+                'roc_tpr': curve_recall,
+                'pr_precision': curve_precision,
+                'pr_recall': curve_recall}
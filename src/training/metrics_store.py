@@ -0,0 +1,147 @@
+'''
+A local SQLite store for the batches and examples that would be sent to NLP Dashboard.
+
+Usage: python -m src.training.metrics_store <path> [<run>] [<table>]
+Lists the runs of the store, the mean loss of every epoch of a run (for the table,
+Training by default) and the most confident misclassified examples of its last epoch.
+'''
+
+import sys
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (run TEXT, suite TEXT, epoch INTEGER, batch INTEGER,
+                                    accuracy REAL, loss REAL, running_accuracy REAL, running_loss REAL);
+CREATE TABLE IF NOT EXISTS examples (run TEXT, suite TEXT, epoch INTEGER, batch INTEGER, title1 TEXT, title2 TEXT,
+                                     positive REAL, negative REAL, prediction INTEGER, label INTEGER);
+CREATE INDEX IF NOT EXISTS batches_partition ON batches (run, suite, epoch);
+CREATE INDEX IF NOT EXISTS examples_partition ON examples (run, suite, epoch);
+'''
+
+class MetricsStore():
+    '''
+    Append-only store of the statistics of every batch and the predictions on every example,
+    kept by run (the model name), table ('Training', 'Validation', 'Test Laptop (General)', ...) and epoch.
+    It takes the same calls as DashboardReporter, so training can write to it instead of NLP Dashboard.
+    Rows are buffered and written every flush_every batches in one transaction.
+    '''
+
+    def __init__(self, path, run, flush_every=100):
+        self.path = path
+        self.run = run
+        self.flush_every = flush_every
+        self.connection = sqlite3.connect(path)
+
+        # Queries can read the store while training writes to it
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.batch_rows = []
+        self.example_rows = []
+        self.pending = 0
+
+    def create_db(self, tables):
+        '''
+        The tables do not have to be created (they are columns of the store)
+        '''
+
+        pass
+
+    def delete_db(self):
+        '''
+        Deletes everything stored for the run
+        '''
+
+        with self.connection:
+            self.connection.execute('DELETE FROM batches WHERE run = ?', (self.run,))
+            self.connection.execute('DELETE FROM examples WHERE run = ?', (self.run,))
+
+    def report(self, table, batch_info, examples):
+        '''
+        Buffers the statistics and examples of a batch (from batch_records) for the table
+        '''
+
+        self.batch_rows.append((self.run, table, int(batch_info['epoch']), int(batch_info['batch']),
+                                batch_info['accuracy'], batch_info['loss'], batch_info['runningAccuracy'], batch_info['runningLoss']))
+        self.example_rows += [(self.run, table, int(example['epoch']), int(example['batch']), example['title1'], example['title2'],
+                               example['positivePercentage'], example['negativePercentage'], int(example['modelPrediction']), int(example['label']))
+                              for example in examples]
+
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany('INSERT INTO batches VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self.batch_rows)
+            self.connection.executemany('INSERT INTO examples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.example_rows)
+        self.batch_rows = []
+        self.example_rows = []
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+def connect(path):
+    '''
+    Opens a store for reading
+    '''
+
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+def runs(connection):
+    return [row['run'] for row in connection.execute('SELECT DISTINCT run FROM batches ORDER BY run')]
+
+def tables(connection, run):
+    return [row['suite'] for row in connection.execute('SELECT DISTINCT suite FROM batches WHERE run = ? ORDER BY suite', (run,))]
+
+def loss_curve(connection, run, table='Training', epoch=None):
+    '''
+    (epoch, batch, loss, running loss, accuracy) of every batch of the run in the table, in order
+    '''
+
+    query = 'SELECT epoch, batch, loss, running_loss, accuracy FROM batches WHERE run = ? AND suite = ?'
+    args = [run, table]
+    if epoch is not None:
+        query += ' AND epoch = ?'
+        args.append(epoch)
+
+    return [tuple(row) for row in connection.execute(query + ' ORDER BY epoch, batch', args)]
+
+def epoch_losses(connection, run, table='Training'):
+    '''
+    (epoch, mean loss, mean accuracy, batches) of every epoch of the run in the table
+    '''
+
+    return [tuple(row) for row in connection.execute('SELECT epoch, AVG(loss), AVG(accuracy), COUNT(*) FROM batches '
+                                                     'WHERE run = ? AND suite = ? GROUP BY epoch ORDER BY epoch', (run, table))]
+
+def misclassified(connection, run, table='Validation', epoch=None, limit=100):
+    '''
+    The misclassified examples of the run in the table, most confident first
+    (the last epoch if epoch is not given)
+    '''
+
+    if epoch is None:
+        epoch = connection.execute('SELECT MAX(epoch) FROM examples WHERE run = ? AND suite = ?', (run, table)).fetchone()[0]
+
+    return [dict(row) for row in connection.execute('SELECT epoch, batch, title1, title2, positive, prediction, label FROM examples '
+                                                    'WHERE run = ? AND suite = ? AND epoch = ? AND prediction != label '
+                                                    'ORDER BY ABS(positive - 0.5) DESC LIMIT ?', (run, table, epoch, limit))]
+
+if __name__ == '__main__':
+    connection = connect(sys.argv[1])
+    if len(sys.argv) < 3:
+        print('\n'.join(runs(connection)))
+        sys.exit(0)
+
+    run = sys.argv[2]
+    table = sys.argv[3] if len(sys.argv) > 3 else 'Training'
+    print('Tables: {}'.format(', '.join(tables(connection, run))))
+    for epoch, loss, accuracy, batches in epoch_losses(connection, run, table):
+        print('{} Epoch: {}, Loss: {:.6f}, Accuracy: {:.6f} ({} batches)'.format(table, epoch, loss, accuracy, batches))
+
+    for example in misclassified(connection, run, table, limit=10):
+        print('{:.4f} (label {}): {} | {}'.format(example['positive'], example['label'], example['title1'], example['title2']))
@@ -0,0 +1,74 @@
+import json
+import math
+import random
+
+# Architectures that -M accepts
+ARCHITECTURES = ['characterbert', 'bert', 'scaled-characterbert-concat', 'scaled-characterbert-add']
+
+# Ranges the learning rate and the factor the default L2 lambdas of a model are scaled by are sampled from (log-uniformly)
+LEARNING_RATES = (1e-6, 1e-4)
+L2_SCALES = (0.1, 10.0)
+
+def log_uniform(rng, low, high):
+    return math.exp(rng.uniform(math.log(low), math.log(high)))
+
+def sample_configs(trials, models=ARCHITECTURES, seed=0):
+    '''
+    Random configurations (model, learning rate and L2 scale) for the trials of a search.
+    The models are cycled through so each one gets the same amount of trials.
+    '''
+
+    rng = random.Random(seed)
+    return [{'trial': 'trial{:03d}'.format(trial),
+             'model': models[trial % len(models)],
+             'learning_rate': log_uniform(rng, *LEARNING_RATES),
+             'l2_scale': log_uniform(rng, *L2_SCALES)} for trial in range(trials)]
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    '''
+    The amount of epochs trials are trained to at each rung of successive halving
+    '''
+
+    epochs = [min_epochs]
+    while epochs[-1] < max_epochs:
+        epochs.append(min(epochs[-1] * eta, max_epochs))
+    return epochs
+
+def promote(results, eta):
+    '''
+    The trials (best first) that continue to the next rung: the best 1/eta of them by validation F1 score
+    '''
+
+    ranked = sorted(results, key=lambda result: result['val_f1'], reverse=True)
+    return [result['trial'] for result in ranked[:max(1, len(ranked) // eta)]]
+
+def scalar_metrics(metrics):
+    '''
+    The metrics that are single numbers (without the curves of StreamingMetrics)
+    '''
+
+    return {name: value for name, value in metrics.items() if isinstance(value, (int, float))}
+
+class SearchResults():
+    '''
+    The results of every trial at every rung of a search, appended to a JSONL file
+    so they are kept when the search is stopped. The results of earlier searches in the file
+    stay there, but only the ones added by this search are used (they may have other models or seeds).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+
+    def add(self, record):
+        self.records.append(record)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def best(self):
+        '''
+        The record with the best validation F1 score
+        '''
+
+        finished = [record for record in self.records if record['error'] is None]
+        return max(finished, key=lambda record: record['val_f1']) if finished else None
@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import time
+import resource
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Order of the sections in the CSV columns (other sections are added after them)
+SECTIONS = ['data', 'preprocess', 'forward', 'l2', 'backward', 'clip', 'optimizer']
+
+def process_rss():
+    '''
+    The resident memory of this process in bytes
+    '''
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        # The second field of statm is the resident pages
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak instead of current memory (kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class RateLimiter():
+    '''
+    Limits something (like printing to the console) to once every interval seconds
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+
+    def ready(self):
+        now = time.perf_counter()
+        if self.last is not None and now - self.last < self.interval:
+            return False
+
+        self.last = now
+        return True
+
+class TelemetryWriter():
+    '''
+    Aggregates the step records of a StepTimer over a window of steps and writes
+    one line per window to a JSONL or CSV file (chosen by the extension of path).
+    The file is rotated (name.1, name.2, ...) when it gets bigger than max_bytes.
+    '''
+
+    def __init__(self, path, window=50, max_bytes=10 * 1024 * 1024, backups=3):
+        self.path = path
+        self.format = 'csv' if path.endswith('.csv') else 'jsonl'
+        self.window = window
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = []
+        self.columns = None
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def record(self, record, **fields):
+        '''
+        Adds the record of a step. The fields (like epoch and step) are written with the window it ends.
+        Returns the aggregated window when one was written, otherwise None.
+        '''
+
+        self.records.append(record)
+        if len(self.records) < self.window:
+            return None
+
+        return self.flush(**fields)
+
+    def flush(self, **fields):
+        '''
+        Writes the steps recorded so far as one window
+        '''
+
+        if not self.records:
+            return None
+
+        summary = self.aggregate(self.records)
+        summary = {**fields, **summary}
+        self.records = []
+        self.write(summary)
+        return summary
+
+    def aggregate(self, records):
+        total_time = sum(record['time'] for record in records)
+        counters = {}
+        sections = {}
+        for record in records:
+            for name, amount in record['counters'].items():
+                counters[name] = counters.get(name, 0) + amount
+            for name, seconds in record['sections'].items():
+                sections[name] = sections.get(name, 0.0) + seconds
+
+        examples = counters.get('examples', 0)
+        tokens = counters.get('tokens', 0)
+        padded_tokens = counters.get('padded_tokens', 0)
+        summary = {'timestamp': time.time(),
+                   'steps': len(records),
+                   'step_time': total_time / len(records),
+                   'examples_per_sec': examples / total_time if total_time > 0 else 0.0,
+                   'tokens_per_sec': tokens / total_time if total_time > 0 else 0.0,
+                   'padded_ratio': 1 - tokens / padded_tokens if padded_tokens > 0 else 0.0,
+                   'rss_mb': process_rss() / 2**20}
+
+        # Totals of the other counters (like the out of memory splits)
+        for name in sorted(set(counters) - {'examples', 'tokens', 'padded_tokens'}):
+            summary[name] = counters[name]
+
+        # Average time of each section per step
+        for name in SECTIONS + sorted(set(sections) - set(SECTIONS)):
+            summary[name + '_time'] = sections.get(name, 0.0) / len(records)
+
+        return summary
+
+    def write(self, summary):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            self.rotate()
+
+        if self.format == 'jsonl':
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+            return
+
+        # Continue with the columns of a file that is already there (a new or rotated file gets a header)
+        new_file = not os.path.exists(self.path)
+        if self.columns is None:
+            self.columns = [] if new_file else self.read_header()
+
+        # Fields that appear later (like the out of memory splits) add columns, so the file is rewritten with them
+        added = [name for name in summary if name not in self.columns]
+        if added:
+            self.columns = self.columns + added
+            if not new_file:
+                self.rewrite()
+
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(summary)
+
+    def read_header(self):
+        with open(self.path, newline='') as f:
+            return next(csv.reader(f), [])
+
+    def rewrite(self):
+        '''
+        Rewrites the CSV with the current columns (the rows leave the new ones empty)
+        '''
+
+        with open(self.path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(temp_path, self.path)
+
+    def rotate(self):
+        '''
+        Moves path to path.1, path.1 to path.2 and so on, dropping the oldest
+        '''
+
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('{}.{}'.format(self.path, i)):
+                os.replace('{}.{}'.format(self.path, i), '{}.{}'.format(self.path, i + 1))
+
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    @staticmethod
+    def format_summary(summary):
+        sections = ', '.join('{}: {:.1f}ms'.format(name[:-len('_time')], seconds * 1000)
+                             for name, seconds in summary.items() if name.endswith('_time') and name != 'step_time')
+        return 'Step: {:.1f}ms ({}), {:.1f} examples/sec, {:.0f} tokens/sec, Padding: {:.1%}, RSS: {:.0f}MB'.format(
+               summary['step_time'] * 1000, sections, summary['examples_per_sec'], summary['tokens_per_sec'], summary['padded_ratio'], summary['rss_mb'])
@@ -3,4 +3,83 @@ import torch
 class ModelConfig:
     # Device to use
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    max_len = 44
\ No newline at end of file
+    max_len = 44
+
+class EncoderConfig():
+    '''
+    How the BERT or CharacterBERT encoder of a SiameseNetwork is built.
+    pretrained: Load the pretrained weights of the architecture (otherwise the encoder is randomly initialized)
+    hidden_size, layers, heads, intermediate_size: The shape of the encoder.
+    None keeps the size of the pretrained model (or of BERT-base for a random one).
+    A pretrained encoder can only change the amount of layers (it keeps the first ones).
+    '''
+
+    def __init__(self, pretrained=True, hidden_size=None, layers=None, heads=None, intermediate_size=None):
+        if pretrained and (hidden_size is not None or heads is not None or intermediate_size is not None):
+            raise ValueError('A pretrained encoder only allows changing the amount of layers')
+
+        self.pretrained = pretrained
+        self.hidden_size = hidden_size
+        self.layers = layers
+        self.heads = heads
+        self.intermediate_size = intermediate_size
+
+    def sizes(self):
+        '''
+        The BertConfig arguments that are set
+        '''
+
+        sizes = {'hidden_size': self.hidden_size, 'num_hidden_layers': self.layers,
+                 'num_attention_heads': self.heads, 'intermediate_size': self.intermediate_size}
+        return {name: value for name, value in sizes.items() if value is not None}
+
+    def describe(self):
+        parts = ['pretrained={}'.format(str(self.pretrained).lower())]
+        for name in ['hidden_size', 'layers', 'heads', 'intermediate_size']:
+            if getattr(self, name) is not None:
+                parts.append('{}={}'.format(name, getattr(self, name)))
+
+        return ','.join(parts)
+
+    def build(self, model_class, pretrained_path):
+        '''
+        Builds the encoder (BertModel, CharacterBertModel, ...) from the pretrained weights at
+        pretrained_path or randomly initialized
+        '''
+
+        if self.pretrained:
+            return model_class.from_pretrained(pretrained_path, **self.sizes())
+
+        # Auto classes (like AutoModel) can only be built with from_config, and model classes can be called
+        from transformers import BertConfig
+        config = BertConfig(**self.sizes())
+        if hasattr(model_class, 'from_config'):
+            return model_class.from_config(config)
+        return model_class(config)
+
+# Encoders that can be given by name
+ENCODERS = {'pretrained': EncoderConfig(),
+            'random': EncoderConfig(pretrained=False),
+            'small': EncoderConfig(pretrained=False, hidden_size=256, layers=4, heads=4, intermediate_size=1024),
+            'tiny': EncoderConfig(pretrained=False, hidden_size=64, layers=2, heads=2, intermediate_size=128)}
+
+def parse_encoder(text):
+    '''
+    Parses an encoder given by name ("pretrained", "random", "small" or "tiny") or like
+    "hidden_size=128,layers=2,heads=2,intermediate_size=512,pretrained=false"
+    '''
+
+    if text in ENCODERS:
+        return ENCODERS[text]
+
+    options = {}
+    for pair in text.split(','):
+        name, value = pair.split('=')
+        options[name.strip()] = value.strip()
+
+    unknown = set(options) - {'pretrained', 'hidden_size', 'layers', 'heads', 'intermediate_size'}
+    if unknown:
+        raise ValueError('Unknown encoder options {}. Options are pretrained, hidden_size, layers, heads and intermediate_size.'.format(sorted(unknown)))
+
+    return EncoderConfig(pretrained=options.get('pretrained', 'true').lower() in ('true', '1', 'yes'),
+                         **{name: int(value) for name, value in options.items() if name != 'pretrained'})
@@ -0,0 +1,120 @@
+import re
+import fnmatch
+
+# Parameters of the embeddings and of the encoder layers of BERT and CharacterBERT
+EMBEDDINGS = re.compile(r'(^|\.)embeddings\.')
+ENCODER_LAYER = re.compile(r'(^|\.)encoder\.layer\.(\d+)\.')
+
+def layer_depth(name):
+    '''
+    How deep a parameter is in the encoder: 0 for the embeddings, n + 1 for encoder layer n
+    and None for parameters outside of the embeddings and encoder (pooler, classification layers)
+    '''
+
+    match = ENCODER_LAYER.search(name)
+    if match:
+        return int(match.group(2)) + 1
+
+    if EMBEDDINGS.search(name):
+        return 0
+
+    return None
+
+def parse_policy(text):
+    '''
+    Parses a policy given like "depth=8,unfreeze_every=1,min_depth=2" or
+    "names=bert.embeddings.*;bert.encoder.layer.0.*". "none" freezes nothing.
+    '''
+
+    if text == 'none':
+        return FreezingPolicy()
+
+    options = {}
+    for pair in text.split(','):
+        name, value = pair.split('=')
+        options[name.strip()] = value.strip()
+
+    unknown = set(options) - {'depth', 'names', 'unfreeze_every', 'min_depth'}
+    if unknown:
+        raise ValueError('Unknown freezing options {}. Options are depth, names, unfreeze_every and min_depth.'.format(sorted(unknown)))
+
+    return FreezingPolicy(depth=int(options['depth']) if 'depth' in options else None,
+                          patterns=options['names'].split(';') if 'names' in options else (),
+                          unfreeze_every=int(options.get('unfreeze_every', 0)),
+                          min_depth=int(options.get('min_depth', 0)))
+
+class FreezingPolicy():
+    '''
+    Decides which parameters of a model are frozen in each epoch.
+    Frozen parameters have requires_grad turned off, so no gradients are computed or stored for them
+    and the optimizer never creates state for them (Adam only does once a parameter has a gradient).
+    depth: Freeze the embeddings and the first depth - 1 encoder layers (depth 1 is only the embeddings)
+    patterns: Freeze the parameters whose names match any of these patterns (like "bert.encoder.layer.1*.*")
+    unfreeze_every: Unfreeze one more encoder layer (from the top) every this many epochs
+    min_depth: The depth that gradual unfreezing stops at
+    '''
+
+    def __init__(self, depth=None, patterns=(), unfreeze_every=0, min_depth=0):
+        self.depth = depth
+        self.patterns = list(patterns)
+        self.unfreeze_every = unfreeze_every
+        self.min_depth = min_depth
+
+    def depth_at(self, epoch):
+        if self.depth is None:
+            return None
+
+        if not self.unfreeze_every:
+            return self.depth
+
+        return max(self.min_depth, self.depth - epoch // self.unfreeze_every)
+
+    def is_frozen(self, name, epoch):
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns):
+            return True
+
+        depth = self.depth_at(epoch)
+        if depth is None:
+            return False
+
+        param_depth = layer_depth(name)
+        return param_depth is not None and param_depth < depth
+
+    def apply(self, net, epoch=0):
+        '''
+        Freezes and unfreezes the parameters of the net for an epoch.
+        Returns the parameters that were unfrozen.
+        '''
+
+        unfrozen = []
+        for name, param in net.named_parameters():
+            frozen = self.is_frozen(name, epoch)
+            if not frozen and not param.requires_grad:
+                unfrozen.append(param)
+            param.requires_grad = not frozen
+
+        return unfrozen
+
+    def describe(self):
+        if self.depth is None and not self.patterns:
+            return 'none'
+
+        parts = []
+        if self.depth is not None:
+            parts.append('depth={}'.format(self.depth))
+        if self.patterns:
+            parts.append('names={}'.format(';'.join(self.patterns)))
+        if self.unfreeze_every:
+            parts.append('unfreeze_every={},min_depth={}'.format(self.unfreeze_every, self.min_depth))
+
+        return ','.join(parts)
+
+def trainable_parameters(net):
+    return [param for param in net.parameters() if param.requires_grad]
+
+def count_parameters(net):
+    '''
+    The amount of trainable and total parameters of the net
+    '''
+
+    return sum(param.numel() for param in trainable_parameters(net)), sum(param.numel() for param in net.parameters())
@@ -0,0 +1,74 @@
+import time
+import contextlib
+import torch
+
+class StepTimer():
+    '''
+    Collects how long each section of a step takes (preprocessing, forward, backward, ...)
+    and counters like the amount of examples and tokens. Sections and counters add up
+    until end_step() is called, so the micro-batches of a step are summed together.
+    '''
+
+    def __init__(self, synchronize=None):
+        # Work on the GPU runs asynchronously, so it has to finish before a section stops
+        self.synchronize = torch.cuda.is_available() if synchronize is None else synchronize
+        self.sections = {}
+        self.counters = {}
+        self.step_start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0.0) + seconds
+
+    def count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def end_step(self):
+        '''
+        Returns the record of the step (its sections, counters and total time) and starts the next one
+        '''
+
+        now = time.perf_counter()
+        record = {'time': now - self.step_start, 'sections': self.sections, 'counters': self.counters}
+        self.sections = {}
+        self.counters = {}
+        self.step_start = now
+        return record
+
+def timed(timer, name):
+    '''
+    Times a section with the timer, or does nothing if there is no timer
+    '''
+
+    if timer is None:
+        return contextlib.nullcontext()
+
+    return timer.section(name)
+
+def count_tokens(timer, inputs):
+    '''
+    Counts the real and the padded tokens of a batch of model inputs.
+    CharacterBERT inputs are (batch, tokens, characters) tensors where padding tokens are all zeros,
+    BERT inputs have an attention mask.
+    '''
+
+    if timer is None:
+        return
+
+    for x in inputs:
+        if hasattr(x, 'keys') and 'attention_mask' in x.keys():
+            mask = x['attention_mask']
+            timer.count('tokens', int(mask.sum()))
+            timer.count('padded_tokens', mask.numel())
+        elif torch.is_tensor(x):
+            timer.count('tokens', int((x != 0).any(dim=-1).sum()))
+            timer.count('padded_tokens', x.shape[0] * x.shape[1])
@@ -4,26 +4,36 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 from transformers import AutoTokenizer, AutoModel
-from supervised_product_matching.config import ModelConfig
+from supervised_product_matching.config import ModelConfig, EncoderConfig
 from supervised_product_matching.model_preprocessing import bert_preprocess_batch
+from supervised_product_matching.regularization import L2Regularizer
+from supervised_product_matching.freezing import FreezingPolicy
+from supervised_product_matching.instrumentation import timed, count_tokens
+
+# Default L2 lambdas for each group of parameters (no regularization by default)
+L2_LAMBDAS = {}
+
+# Pretrained weights of the encoder
+PRETRAINED = "bert-base-uncased"
+
+# Default parameters to freeze (the embeddings and the first 5 encoder layers, so only the last couple are trained)
+FREEZING = FreezingPolicy(depth=6)
 
 class SiameseNetwork(nn.Module):
-    def __init__(self, h_size=768):
+    def __init__(self, h_size=None, l2_lambdas=None, freezing=None, encoder=None):
         '''
         Model that uses BERT to classify the titles.
-        h_size: The hidden layer size for the classification token (CLS) in BERT (Default: 768)
+        h_size: The hidden layer size for the classification token (CLS) in BERT (Default: the hidden size of the encoder)
+        l2_lambdas: L2 lambdas that override the ones in L2_LAMBDAS
+        freezing: FreezingPolicy that overrides FREEZING
+        encoder: EncoderConfig of the BERT model (Default: the pretrained one at PRETRAINED)
         '''
 
         super(SiameseNetwork, self).__init__()
-        self.h_size = h_size
-        
+
         # BERT model
-        self.bert = AutoModel.from_pretrained("bert-base-uncased")
-        
-        # We want to freeze all parameters except the last couple for training
-        for idx, param in enumerate(self.bert.parameters()):
-            if idx < 85:
-                param.requires_grad = False
+        self.bert = (encoder or EncoderConfig()).build(AutoModel, PRETRAINED)
+        self.h_size = h_size or self.bert.config.hidden_size
         
         # Fully-Connected layers
         self.fc1 = nn.Linear(self.h_size, 384)
@@ -35,6 +45,13 @@ class SiameseNetwork(nn.Module):
         # Softmax for prediction
         self.softmax = nn.Softmax(dim=1)
 
+        # L2 Regularization for the fully-connected layers and bert
+        self.regularizer = L2Regularizer({'fc1': [self.fc1], 'fc2': [self.fc2], 'bert': [self.bert]}, {**L2_LAMBDAS, **(l2_lambdas or {})})
+
+        # Freeze the parameters that are not trained in the first epoch
+        self.freezing = freezing or FREEZING
+        self.freezing.apply(self)
+
     def forward(self, input1, input2):
         '''
         x is going to be a numpy array of [sentenceA, sentenceB].
@@ -72,15 +89,25 @@ class SiameseNetwork(nn.Module):
         
         return addition
 
-def forward_prop(batch_data, batch_labels, net, criterion):
-    # Forward propagation
-    forward = net(*bert_preprocess_batch(batch_data))
+def forward_prop(batch_data, batch_labels, net, criterion, regularize=True, timer=None):
+    # Turn the titles into model inputs
+    with timed(timer, 'preprocess'):
+        inputs = bert_preprocess_batch(batch_data)
+    count_tokens(timer, inputs)
 
-    # Convert batch labels to Tensor
-    batch_labels = torch.from_numpy(batch_labels).view(-1).long().to(ModelConfig.device)
+    with timed(timer, 'forward'):
+        # Forward propagation
+        forward = net(*inputs)
 
-    # Calculate loss
-    loss = criterion(forward, batch_labels)
+        # Convert batch labels to Tensor
+        batch_labels = torch.from_numpy(batch_labels).view(-1).long().to(ModelConfig.device)
 
-    return loss, forward
+        # Calculate loss
+        loss = criterion(forward, batch_labels)
 
+    # Add L2 Regularization
+    if regularize:
+        with timed(timer, 'l2'):
+            loss += net.regularizer.penalty()
+
+    return loss, forward
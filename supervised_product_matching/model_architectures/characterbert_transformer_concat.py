@@ -9,26 +9,40 @@ import torch
 import torch.nn as nn
 from character_bert.modeling.character_bert import CharacterBertModel
 from scale_transformer_encoder.scaling_layer import ScalingLayer
-from supervised_product_matching.config import ModelConfig
+from supervised_product_matching.config import ModelConfig, EncoderConfig
 from supervised_product_matching.model_preprocessing import character_bert_preprocess_batch
+from supervised_product_matching.regularization import L2Regularizer
+from supervised_product_matching.freezing import FreezingPolicy
+from supervised_product_matching.instrumentation import timed, count_tokens
+
+# Default L2 lambdas for each group of parameters
+L2_LAMBDAS = {'scale': 2e-3, 'classification': 2e-3, 'bert': 7e-5}
+
+# Pretrained weights of the encoder
+PRETRAINED = './pretrained-models/general_character_bert/'
+
+# Default parameters to freeze (everything is fine-tuned)
+FREEZING = FreezingPolicy()
 
 class SiameseNetwork(nn.Module):
-    def __init__(self, h_size=768):
+    def __init__(self, h_size=None, l2_lambdas=None, freezing=None, encoder=None):
         '''
         Model that uses BERT to classify the titles.
         max_length: The max length a title could be for padding purposes
-        h_size: The hidden layer size for the classification token (CLS) in BERT (Default: 768)
+        h_size: The hidden layer size for the classification token (CLS) in BERT (Default: the hidden size of the encoder)
+        l2_lambdas: L2 lambdas that override the ones in L2_LAMBDAS
+        freezing: FreezingPolicy that overrides FREEZING
+        encoder: EncoderConfig of the CharacterBERT model (Default: the pretrained one at PRETRAINED)
         '''
 
         super(SiameseNetwork, self).__init__()
         self.sequence_length = ModelConfig.max_len * 2 + 3
-        self.h_size = h_size
-        
         # CharacterBERT model
-        self.bert = CharacterBertModel.from_pretrained('./pretrained-models/general_character_bert/')
+        self.bert = (encoder or EncoderConfig()).build(CharacterBertModel, PRETRAINED)
+        self.h_size = h_size or self.bert.config.hidden_size
 
         # Define the Scaling Layers
-        self.scale1 = ScalingLayer(in_features=h_size, out_features=384, pwff_inner_features=2048, pwff_dropout=0.5)
+        self.scale1 = ScalingLayer(in_features=self.h_size, out_features=384, pwff_inner_features=2048, pwff_dropout=0.5)
         self.scale2 = ScalingLayer(in_features=384, out_features=32, pwff_inner_features=768, pwff_dropout=0.5)
         
         # Dropout for overfitting
@@ -43,6 +57,14 @@ class SiameseNetwork(nn.Module):
         # Softmax for prediction
         self.softmax = nn.Softmax(dim=1)
 
+        # L2 Regularization for the Transformers, final linear layer and bert
+        self.regularizer = L2Regularizer({'scale': [self.scale1, self.scale2], 'classification': [self.classification], 'bert': [self.bert]},
+                                         {**L2_LAMBDAS, **(l2_lambdas or {})})
+
+        # Freeze the parameters that are not trained in the first epoch
+        self.freezing = freezing or FREEZING
+        self.freezing.apply(self)
+
     def forward(self, input1, input2):
         '''
         x is going to be a numpy array of [sentenceA, sentenceB].
@@ -87,32 +109,25 @@ class SiameseNetwork(nn.Module):
 
         return out
 
-def forward_prop(batch_data, batch_labels, net, criterion):
-    # Forward propagation
-    forward = net(*character_bert_preprocess_batch(batch_data, pad=True))
-
-    # Convert batch labels to Tensor
-    batch_labels = torch.from_numpy(batch_labels).view(-1).long().to(ModelConfig.device)
-
-    # Calculate loss
-    loss = criterion(forward, batch_labels)
-
-    # Add L2 Regularization to the Transformers and final linear layer
-    l2_lambda = 2e-3
-    l2_reg = torch.tensor(0.)
-    for param in net.scale1.parameters():
-        l2_reg += torch.norm(param)
-    for param in net.scale2.parameters():
-        l2_reg += torch.norm(param)
-    for param in net.classification.parameters():
-        l2_reg += torch.norm(param)
-
-    # Add L2 Regularization to bert
-    l2_lambda_bert = 7e-5
-    l2_reg_bert = torch.tensor(0.)
-    for param in net.bert.parameters():
-        l2_reg_bert += torch.norm(param)
-
-    loss += l2_lambda * l2_reg + l2_lambda_bert * l2_reg_bert
+def forward_prop(batch_data, batch_labels, net, criterion, regularize=True, timer=None):
+    # Turn the titles into model inputs
+    with timed(timer, 'preprocess'):
+        inputs = character_bert_preprocess_batch(batch_data, pad=True)
+    count_tokens(timer, inputs)
+
+    with timed(timer, 'forward'):
+        # Forward propagation
+        forward = net(*inputs)
+
+        # Convert batch labels to Tensor
+        batch_labels = torch.from_numpy(batch_labels).view(-1).long().to(ModelConfig.device)
+
+        # Calculate loss
+        loss = criterion(forward, batch_labels)
+
+    # Add L2 Regularization to the Transformers, final linear layer and bert
+    if regularize:
+        with timed(timer, 'l2'):
+            loss += net.regularizer.penalty()
 
     return loss, forward
@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 from nltk.corpus import stopwords
 from transformers import AutoTokenizer
@@ -7,12 +8,19 @@ from supervised_product_matching.config import ModelConfig
 # CharacterBERT tokenizer
 character_indexer = CharacterIndexer()
 
-# BERT tokenizer
-bert_tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
+# BERT tokenizer (loaded on first use, so the CharacterBERT models work without downloading it)
+bert_tokenizer = None
 
-def remove_stop_words(phrase, omit_punctuation=[]):
+def get_bert_tokenizer():
+    global bert_tokenizer
+    if bert_tokenizer is None:
+        bert_tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
+    return bert_tokenizer
+
+@functools.lru_cache(maxsize=None)
+def stop_words(omit_punctuation=()):
     '''
-    Removes the stop words from a string
+    The words and punctuation remove_stop_words removes, and a table that turns the punctuation into spaces
     '''
 
     # Creates the stopwords
@@ -24,9 +32,16 @@ def remove_stop_words(phrase, omit_punctuation=[]):
     for c in punctuation:
         to_stop.append(c)
     to_stop.append('null')
-    
-    for punc in punctuation:
-        phrase = phrase.replace(punc, ' ')
+
+    return frozenset(to_stop), str.maketrans({punc: ' ' for punc in punctuation})
+
+def remove_stop_words(phrase, omit_punctuation=[]):
+    '''
+    Removes the stop words from a string
+    '''
+
+    to_stop, punctuation_table = stop_words(tuple(omit_punctuation))
+    phrase = phrase.translate(punctuation_table)
     
     return ' '.join((' '.join([x for x in phrase.split(' ') if x not in to_stop])).split()).lower()
 
@@ -90,17 +105,18 @@ def bert_preprocess_batch(x):
     # BERT for title similarity works having the two sentences (sentence1, sentence2)
     # and ordering them in both combinations that they could be (sentence1 + sentence2)
     # and (sentence2 + sentence1). That is why we do np.flip() on x (the input sentences)
-    input1 = bert_tokenizer(x.tolist(),
-                            return_tensors='pt',
-                            padding='max_length',
-                            truncation=True,
-                            max_length=ModelConfig.max_len)
-
-    input2 = bert_tokenizer(np.flip(x, 1).tolist(),
-                            return_tensors='pt',
-                            padding='max_length',
-                            truncation=True,
-                            max_length=ModelConfig.max_len)
+    tokenizer = get_bert_tokenizer()
+    input1 = tokenizer(x.tolist(),
+                       return_tensors='pt',
+                       padding='max_length',
+                       truncation=True,
+                       max_length=ModelConfig.max_len)
+
+    input2 = tokenizer(np.flip(x, 1).tolist(),
+                       return_tensors='pt',
+                       padding='max_length',
+                       truncation=True,
+                       max_length=ModelConfig.max_len)
 
     # Send the data to the GPU
     input1 = input1.to(ModelConfig.device)
@@ -0,0 +1,116 @@
+import os
+import torch
+from torch.autograd.profiler import record_function
+
+# Modules that get their own range in the profile (besides the direct children of the net)
+PROFILED_MODULES = ('CharacterCNN', 'BertEmbeddings', 'BertLayer', 'BertPooler', 'ScalingLayer')
+
+# Prefix of the ranges of the modules in the profile
+MODULE_PREFIX = 'module::'
+
+def label_modules(net, classes=PROFILED_MODULES):
+    '''
+    Wraps the forward of the direct children of the net and of every module whose class is in classes
+    in a record_function range (like "module::bert.encoder.layer.3 (BertLayer)"), so the time and
+    memory of the operators are split by module. Returns the modules that were wrapped.
+    '''
+
+    net = getattr(net, 'module', net)
+    children = set(name for name, child in net.named_children())
+    labeled = []
+    for name, module in net.named_modules():
+        if name and (name in children or type(module).__name__ in classes):
+            module.forward = labeled_forward(module.forward, '{}{} ({})'.format(MODULE_PREFIX, name, type(module).__name__))
+            labeled.append(module)
+
+    return labeled
+
+def labeled_forward(forward, label):
+    def forward_in_range(*args, **kwargs):
+        with record_function(label):
+            return forward(*args, **kwargs)
+
+    return forward_in_range
+
+def unlabel_modules(modules):
+    for module in modules:
+        # Removing the instance attribute brings back the forward of the class
+        del module.forward
+
+class StepProfiler():
+    '''
+    Records a window of steps with torch.profiler: after skipping wait steps and warming up for
+    warmup steps, active steps are recorded with the CPU time (and CUDA time on a GPU), memory
+    allocation, shapes and stacks of every operator. Call step() at the end of every step.
+    The window is written to output_dir as a Chrome trace (that TensorBoard also reads) and as
+    summary.txt, with the top operators by time and by memory, by stack and by module of the net.
+    '''
+
+    def __init__(self, output_dir, net=None, wait=5, warmup=2, active=5, row_limit=25):
+        self.output_dir = output_dir
+        self.net = net
+        self.row_limit = row_limit
+        self.labeled = []
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        self.profiler = torch.profiler.profile(activities=activities,
+                                               schedule=torch.profiler.schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+                                               on_trace_ready=self.trace_ready,
+                                               record_shapes=True,
+                                               profile_memory=True,
+                                               with_stack=True)
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.net is not None:
+            self.labeled = label_modules(self.net)
+        self.profiler.start()
+        return self
+
+    def step(self):
+        self.profiler.step()
+
+    def stop(self):
+        '''
+        Stops profiling (writing the window if it was still being recorded)
+        '''
+
+        self.profiler.stop()
+        unlabel_modules(self.labeled)
+        self.labeled = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def trace_ready(self, profiler):
+        torch.profiler.tensorboard_trace_handler(self.output_dir)(profiler)
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as f:
+            f.write(self.summary(profiler))
+
+        # The window is over, so the modules do not need their ranges anymore
+        unlabel_modules(self.labeled)
+        self.labeled = []
+        print('Wrote the profile to {}'.format(self.output_dir))
+
+    def summary(self, profiler):
+        '''
+        The text summary of the recorded window
+        '''
+
+        sort_by_time = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        events = profiler.key_averages()
+        modules = [event for event in events if event.key.startswith(MODULE_PREFIX) or event.key.startswith('L2Regularizer')]
+        modules.sort(key=lambda event: event.cpu_time_total, reverse=True)
+
+        sections = [('Top operators by time', events.table(sort_by=sort_by_time, row_limit=self.row_limit)),
+                    ('Top operators by allocated memory', events.table(sort_by='self_cpu_memory_usage', row_limit=self.row_limit)),
+                    ('Top operators by stack', profiler.key_averages(group_by_stack_n=5).table(sort_by=sort_by_time, row_limit=self.row_limit)),
+                    ('Modules (including the operators they call)',
+                     '\n'.join('{:<72} {:>12.3f} ms {:>8d} calls'.format(event.key, event.cpu_time_total / 1000, event.count) for event in modules))]
+
+        return '\n\n'.join('{}\n{}'.format(title, table) for title, table in sections) + '\n'
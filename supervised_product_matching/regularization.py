@@ -0,0 +1,135 @@
+import functools
+import torch
+from torch.autograd.profiler import record_function
+
+# torch._foreach_norm computes the norms of a list of tensors with one fused kernel
+FOREACH_NORM = hasattr(torch, '_foreach_norm')
+
+# torch._foreach_mul and torch._foreach_add_ update a list of tensors with fused kernels
+FOREACH_ADD = hasattr(torch, '_foreach_mul') and hasattr(torch, '_foreach_add_')
+
+@functools.lru_cache(maxsize=None)
+def foreach_norm_differentiable():
+    '''
+    Checks if autograd can go through torch._foreach_norm (older versions of PyTorch have no backward for it)
+    '''
+
+    if not FOREACH_NORM:
+        return False
+
+    try:
+        with torch.enable_grad():
+            param = torch.ones(1, requires_grad=True)
+            torch._foreach_norm([param])[0].backward()
+        return True
+    except RuntimeError:
+        return False
+
+def norms(params, differentiable=False):
+    '''
+    The L2 norm of each tensor in a list, stacked into one tensor.
+    differentiable: The norms are used with autograd (like in the penalty added to the loss)
+    '''
+
+    if FOREACH_NORM and (not differentiable or foreach_norm_differentiable()):
+        return torch.stack(torch._foreach_norm(params))
+
+    return torch.stack([torch.norm(param) for param in params])
+
+def parse_lambdas(text):
+    '''
+    Parses lambdas given like "bert=7e-5,fc1=0.5" into a dictionary
+    '''
+
+    lambdas = {}
+    for pair in text.split(','):
+        name, value = pair.split('=')
+        lambdas[name.strip()] = float(value)
+
+    return lambdas
+
+class L2Regularizer():
+    '''
+    L2 regularization shared by all of the architectures.
+    Parameters are put into named groups, each with its own lambda, and the penalty is
+    the sum of lambda * (sum of the norms of the parameters in the group).
+    '''
+
+    def __init__(self, groups, lambdas):
+        '''
+        groups: Dictionary of group name to the list of modules in the group
+        lambdas: Dictionary of group name to the lambda of the group
+        '''
+
+        unknown = set(lambdas) - set(groups)
+        if unknown:
+            raise ValueError('Unknown L2 groups {}. Options are {}.'.format(sorted(unknown), sorted(groups)))
+
+        self.params = {name: [param for module in modules for param in module.parameters()] for name, modules in groups.items()}
+        self.lambdas = {name: lambdas.get(name, 0.0) for name in groups}
+
+    def penalty(self):
+        '''
+        The L2 penalty to add to the loss (differentiable, the norms of a group are computed together)
+        '''
+
+        penalty = 0.0
+        with record_function('L2Regularizer.penalty'):
+            for name, params in self.params.items():
+                # Frozen parameters only add a constant
+                params = [param for param in params if param.requires_grad]
+                if self.lambdas[name] and params:
+                    penalty = penalty + self.lambdas[name] * norms(params, differentiable=True).sum()
+
+        return penalty
+
+    def apply_gradients(self):
+        '''
+        Adds the gradient of the penalty (lambda * param / norm(param)) straight to the
+        gradients after backward, so no autograd graph is built for the penalty.
+        Returns the value of the penalty (for logging the loss).
+        '''
+
+        penalty = 0.0
+        with torch.no_grad(), record_function('L2Regularizer.apply_gradients'):
+            for name, params in self.params.items():
+                params = [param for param in params if param.requires_grad]
+                if not self.lambdas[name] or not params:
+                    continue
+
+                group_norms = norms(params)
+                penalty += self.lambdas[name] * group_norms.sum().item()
+                scales = (self.lambdas[name] / group_norms.clamp_min(1e-12)).tolist()
+
+                # Parameters that got no gradient in backward (like an unused pooler) only get the one of the penalty
+                for param in params:
+                    if param.grad is None:
+                        param.grad = torch.zeros_like(param)
+
+                if FOREACH_ADD:
+                    torch._foreach_add_([param.grad for param in params], torch._foreach_mul(params, scales))
+                else:
+                    for param, scale in zip(params, scales):
+                        param.grad.add_(param, alpha=scale)
+
+        return penalty
+
+    def param_groups(self, net):
+        '''
+        Optimizer parameter groups that apply the lambda of each group as weight decay,
+        so the penalty does not have to be computed at all.
+        Weight decay is the gradient of the squared norm, so this approximates the penalty
+        (the lambdas usually need to be retuned).
+        '''
+
+        grouped = set()
+        param_groups = []
+        for name, params in self.params.items():
+            param_groups.append({'params': params, 'weight_decay': self.lambdas[name]})
+            grouped.update(id(param) for param in params)
+
+        rest = [param for param in net.parameters() if id(param) not in grouped]
+        if rest:
+            param_groups.append({'params': rest, 'weight_decay': 0.0})
+
+        return param_groups
@@ -3,13 +3,19 @@ import numpy as np
 import sys
 import torch
 import torch.nn as nn
-from sklearn.metrics import confusion_matrix
+import os
+import json
 import time
 
 """ LOCAL IMPORTS """
 from src.data_preprocessing import remove_misc
 from supervised_product_matching.model_preprocessing import remove_stop_words, character_bert_preprocess_batch, bert_preprocess_batch
 from src.common import Common
+from src.training.telemetry import TelemetryWriter
+from src.training.evaluation import EvaluationEngine, format_metrics
+from supervised_product_matching.instrumentation import StepTimer
+from supervised_product_matching.profiling import StepProfiler
+from supervised_product_matching.config import parse_encoder
 
 using_model = "characterbert"
 
@@ -19,6 +25,25 @@ FOLDER = sys.argv[1]
 # Get the model name from the terminal
 MODEL_NAME = sys.argv[2]
 
+# --profile records validation batches (or manual tests) with torch.profiler
+PROFILE = '--profile' in sys.argv[3:]
+PROFILE_DIR = 'models/{}/{}_profile'.format(FOLDER, MODEL_NAME)
+
+def run_encoder(folder, model_name):
+    '''
+    The encoder the model was trained with (saved in its run metadata by torch_train_model.py)
+    '''
+
+    path = 'models/{}/{}_run.json'.format(folder, model_name)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        encoder = json.load(f).get('encoder')
+    return parse_encoder(encoder) if encoder else None
+
+ENCODER = run_encoder(FOLDER, MODEL_NAME)
+
 def split_test_data(df):
     '''
     Split test data into the data and the labels
@@ -40,19 +65,19 @@ print('Loaded all test files')
 net = None
 if using_model == "characterbert":
     from supervised_product_matching.model_architectures.characterbert_classifier import SiameseNetwork, forward_prop
-    net = SiameseNetwork().to(Common.device)
+    net = SiameseNetwork(encoder=ENCODER).to(Common.device)
 
 elif using_model == "bert":
     from supervised_product_matching.model_architectures.bert_classifier import SiameseNetwork, forward_prop
-    net = SiameseNetwork().to(Common.device)
+    net = SiameseNetwork(encoder=ENCODER).to(Common.device)
 
 elif using_model == "scaled characterbert concat":
     from supervised_product_matching.model_architectures.characterbert_transformer_concat import SiameseNetwork, forward_prop
-    net = SiameseNetwork()
+    net = SiameseNetwork(encoder=ENCODER)
 
 elif using_model == "scaled characterbert add":
     from supervised_product_matching.model_architectures.characterbert_transformer_add import SiameseNetwork, forward_prop
-    net = SiameseNetwork().to(Common.device)
+    net = SiameseNetwork(encoder=ENCODER).to(Common.device)
 
 if (torch.cuda.is_available()):
     net.load_state_dict(torch.load('./models/{}/{}.pt'.format(FOLDER, MODEL_NAME)))
@@ -68,72 +93,36 @@ print("************* Validating *************")
 # The size of each mini-batch
 BATCH_SIZE = 32
 
-# The size of the validation mini-batch
-VAL_BATCH_SIZE = 16
+# The size of the validation mini-batch (no gradients are kept, so it can be large)
+VAL_BATCH_SIZE = 64
 
 # How long we should accumulate for running loss and accuracy
 PERIOD = 50
 
-def validation(data, labels, name):
+# Timings, throughput and memory of the validation batches, written every PERIOD batches
+telemetry = TelemetryWriter('models/{}/{}_test_telemetry.jsonl'.format(FOLDER, MODEL_NAME), window=PERIOD)
+
+# All of the test sets are evaluated together (pairs that are in several of them are only scored once)
+evaluator = EvaluationEngine([('Test Laptop (General)', test_laptop_data, test_laptop_labels),
+                              ('Test Laptop (Same Title) (Space)', test_gb_space_data, test_gb_space_labels),
+                              ('Test Laptop (Same Title) (No Space)', test_gb_no_space_data, test_gb_no_space_labels),
+                              ('Test Laptop (Different Title) (Space)', test_retailer_gb_space_data, test_retailer_gb_space_labels),
+                              ('Test Laptop (Different Title) (No Space)', test_retailer_gb_no_space_data, test_retailer_gb_no_space_labels)],
+                             batch_size=VAL_BATCH_SIZE)
+
+def validation():
     '''
-    Validate the model
+    Validate the model on every test set in one pass
     '''
 
-    running_loss = 0.0
-    running_accuracy = 0.0
-    current_batch = 0
-    running_tn = 0
-    running_fp = 0
-    running_fn = 0
-    running_tp = 0
-    for i, position in enumerate(range(0, len(data), VAL_BATCH_SIZE)):
-        current_batch += 1
-        if (position + VAL_BATCH_SIZE > len(data)):
-            batch_data = data[position:]
-            batch_labels = labels[position:]
-        else:
-            batch_data = data[position:position + VAL_BATCH_SIZE]
-            batch_labels = labels[position:position + VAL_BATCH_SIZE]
-
-        # Forward propagation
-        loss, forward = forward_prop(batch_data, batch_labels, net, criterion)
-        
-        # Get the predictions from the net
-        y_pred = torch.argmax(forward, dim=1).cpu()
-
-        # Calculate accuracy
-        accuracy = np.sum(y_pred.detach().numpy() == batch_labels) / float(batch_labels.shape[0])
-
-        # Get the confusion matrix and calculate precision, recall and F1 score
-        confusion = confusion_matrix(batch_labels, y_pred.detach().numpy(), labels=[0, 1])
-        tn, fp, fn, tp = confusion.ravel()
-        running_tn += tn
-        running_fp += fp
-        running_fn += fn
-        running_tp += tp
-        precision = tp / (tp + fp)
-        recall = tp / (tp + fn)
-        f1_score = 2 * ((precision * recall) / (precision + recall))
-
-        # Add to running loss and accuracy (every 10 batches)
-        running_loss += loss.item()
-        running_accuracy += accuracy
-        
-        # Print statistics every batch
-        print('%s Batch: %5d, Loss: %.6f, Accuracy: %.6f, Running Loss: %.6f, Running Accuracy: %.6f, Precision: %.3f, Recall: %.3f, F1 Score: %.3f' %
-                (name, i + 1, loss, accuracy, running_loss / current_batch, running_accuracy / current_batch, precision, recall, f1_score))
-
-        # Clear our running variables every 10 batches
-        if (current_batch == PERIOD):
-            current_batch = 0
-            running_loss = 0
-            running_accuracy = 0
-    
-    # Get the statistics for the whole data
-    final_precision = running_tp / (running_tp + running_fp)
-    final_recall = running_tp / (running_tp + running_fn)
-    final_f1_score = 2 * ((final_precision * final_recall) / (final_precision + final_recall))
-    print('%s: Precision: %.3f, Recall: %.3f, F1 Score: %.3f' % (name, final_precision, final_recall, final_f1_score))
+    profiler = StepProfiler(PROFILE_DIR + '/test', net=net).start() if PROFILE else None
+    start = time.time()
+    results = evaluator.evaluate(net, forward_prop, criterion, timer=StepTimer(), telemetry=telemetry, profiler=profiler)
+    if profiler is not None:
+        profiler.stop()
+    print('Evaluated {} pairs ({} unique) in {:.1f}s'.format(evaluator.total_pairs(), len(evaluator.pairs), time.time() - start))
+    for name, metrics in results.items():
+        print(format_metrics(name, metrics))
 
 def inference():
     '''
@@ -147,7 +136,8 @@ def inference():
     title2 = remove_stop_words(title2)
     
     data = np.array([title1, title2]).reshape(1, 2)
-    forward = net(*character_bert_preprocess_batch(data))
+    with torch.inference_mode():
+        forward = net(*character_bert_preprocess_batch(data))
     np_forward = forward.detach().numpy()[0]
     
     print('Output: {}'.format(torch.argmax(forward)))
@@ -157,12 +147,18 @@ user_input = input('Would you like to validate, or manually test the model? (val
 
 net.eval()
 if user_input.lower() == 'validate':
-    validation(test_laptop_data, test_laptop_labels, 'Test Laptop (General)')
-    validation(test_gb_space_data, test_gb_space_labels, 'Test Laptop (Same Title) (Space)')
-    validation(test_gb_no_space_data, test_gb_no_space_labels, 'Test Laptop (Same Title) (No Space')
-    validation(test_retailer_gb_space_data, test_retailer_gb_space_labels, 'Test Laptop (Different Title) (Space)')
-    validation(test_retailer_gb_no_space_data, test_retailer_gb_no_space_labels, 'Test Laptop (Different Title) (No Space)')
+    validation()
 
 else:
-    while True:
-        inference()
+    # Every title pair is a step (the first one warms up)
+    profiler = StepProfiler(PROFILE_DIR + '/inference', net=net, wait=0, warmup=1, active=3).start() if PROFILE else None
+
+    # The loop only ends with Ctrl-C or the end of the input, so the trace is written when it does
+    try:
+        while True:
+            inference()
+            if profiler is not None:
+                profiler.step()
+    finally:
+        if profiler is not None:
+            profiler.stop()
@@ -0,0 +1,25 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+""" LOCAL IMPORTS """
+from supervised_product_matching.config import ENCODERS, EncoderConfig, parse_encoder
+
+def test_bert_classifier_builds_a_tiny_encoder():
+    # A random encoder is built from its config, so this needs no pretrained weights
+    from supervised_product_matching.model_architectures.bert_classifier import SiameseNetwork
+
+    net = SiameseNetwork(encoder=ENCODERS['tiny'])
+    assert net.bert.config.hidden_size == 64
+    assert net.bert.config.num_hidden_layers == 2
+    assert net.h_size == 64
+    assert net.fc1.in_features == 64
+
+def test_parse_encoder():
+    encoder = parse_encoder('pretrained=false,hidden_size=128,layers=2,heads=2,intermediate_size=512')
+    assert not encoder.pretrained
+    assert encoder.sizes() == {'hidden_size': 128, 'num_hidden_layers': 2, 'num_attention_heads': 2, 'intermediate_size': 512}
+
+    with pytest.raises(ValueError):
+        EncoderConfig(hidden_size=128)
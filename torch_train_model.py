@@ -1,38 +1,130 @@
 import pandas as pd
 import numpy as np
-import requests
 import os
 import sys
-import gc
+import json
+import math
+import time
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from sklearn.metrics import confusion_matrix
 
 """ LOCAL IMPORTS """
 from src.data_preprocessing import remove_misc
 from src.common import Common
+from supervised_product_matching.regularization import parse_lambdas
+from src.training.dataset import TitlePairDataset, EpochShuffleSampler, BucketBatchSampler, pair_lengths, make_loader, seed_everything
+from src.training.batch_size import probe_micro_batch_size, AdaptiveBatchRunner
+from src.training.checkpoints import CheckpointManager
+from src.training import distributed
+from src.training.telemetry import TelemetryWriter, RateLimiter
+from src.training.hard_negatives import HardExampleMiner
+from src.training.evaluation import EvaluationEngine, format_metrics
+from src.training.dashboard import DashboardReporter, batch_records
+from src.training.metrics_store import MetricsStore
+from supervised_product_matching.instrumentation import StepTimer, timed
+from supervised_product_matching.freezing import parse_policy, count_parameters, trainable_parameters
+from supervised_product_matching.config import EncoderConfig, parse_encoder
+from supervised_product_matching.profiling import StepProfiler
 from create_data import create_data
 
-# The size of each mini-batch
+# The size of each mini-batch (the amount of examples in each optimizer step)
 BATCH_SIZE = 4
 
-# The size of the validation mini-batch
-VAL_BATCH_SIZE = 2
+# The size of the micro-batches gradients are accumulated over ('auto' probes for the largest that fits in memory)
+MICRO_BATCH_SIZE = 'auto'
 
-# Data size for training
+# Data size for training (the rest of total_data.csv is used for validation)
 TRAIN_SIZE = 455000
 
+# Amount of worker processes loading the training data
+NUM_WORKERS = 2
+
+# Seed for shuffling the data and initializing the model
+SEED = 0
+
 # How long we should accumulate for running loss and accuracy
 PERIOD = 50
 
+# Amount of epochs to train for
+EPOCHS = 10
+
+# Learning rate of Adam
+LEARNING_RATE = 1e-5
+
+# Save a full checkpoint every this many optimizer steps
+CHECKPOINT_EVERY = 1000
+
+# Amount of checkpoints to keep
+KEEP_CHECKPOINTS = 3
+
+# Ways L2 regularization can be applied (the options of -l2)
+L2_MODES = ['gradient', 'penalty', 'decay']
+
+# Amount of data-parallel processes to train with on this machine
+RANKS = 1
+
+# Least amount of seconds between the batch statistics printed to the console
+PRINT_EVERY = 5.0
+
+# Amount of micro-batches in each chunk of the training data that is sorted by length (0 turns bucketing off)
+BUCKET_BATCHES = 100
+
+# Mine hard examples every this many epochs (0 turns mining off)
+MINE_EVERY = 0
+
+# Amount of pairs in each batch when evaluating on the validation and test data
+EVAL_BATCH_SIZE = 64
+
+# Amount of training examples scored by the model when mining
+MINE_POOL = 50000
+
+# Amount of hard negatives (and at most the same amount of missed positives) kept from the pool
+MINE_KEEP = 5000
+
+# The test sets evaluated after each epoch (their names are the tables in NLP Dashboard)
+TEST_SUITES = [('Test Laptop (General)', 'data/test/final_laptop_test_data.csv'), # General laptop test data
+               ('Test Laptop (Same Title) (Space)', 'data/test/final_gb_space_laptop_test.csv'), # Same titles; Substituted storage attributes
+               ('Test Laptop (Same Title) (No Space)', 'data/test/final_gb_no_space_laptop_test.csv'), # Same titles; Substituted storage attributes
+               ('Test Laptop (Different Title) (Space)', 'data/test/final_retailer_gb_space_test.csv'), # Different titles; Substituted storage attributes
+               ('Test Laptop (Different Title) (No Space)', 'data/test/final_retailer_gb_no_space_test.csv')] # Different titles; Substituted storage attributes
+
 def usage():
     print('Usage: torch_train_model.py [OPTIONS] <SUBCOMMAND> [ARGS]')
     print('  OPTIONS:')
     print('     -O <folder> <model-name>   The folder to output the models generated and the name they will use. Folder default is "default", model name default is "model"')
     print('     -M <model-to-use>          Give the name of the model to use for training. Options are bert, characterbert, scaled-characterbert-concat, scaled-charactertbert-add. Default is characterbert.')
     print('     -visualizer                Send data to NLP Dashboard to see training results in real-time.')
-    print('     -dtable                    Delete the database for NLP Dashboard before creating new one (must come after -O option).')
+    print('     -dtable                    Delete the database for NLP Dashboard (or what -store has of the model) before creating new one.')
+    print('     -store <path>              Write the batches and examples to a local SQLite file instead of NLP Dashboard (query it with python -m src.training.metrics_store <path>).')
+    print('     -split <train-size>        Amount of rows (or fraction if it has a decimal point) of total_data.csv used for training. The rest is used for validation. Default is {}.'.format(TRAIN_SIZE))
+    print('     -workers <amount>          Amount of worker processes loading the training data. Default is {}.'.format(NUM_WORKERS))
+    print('     -seed <seed>               Seed for shuffling the data and initializing the model. Default is {}.'.format(SEED))
+    print('     -l2 <mode>                 How L2 regularization is applied. Options are gradient (added straight to the gradients), penalty (added to the loss) and decay (optimizer weight decay). Default is gradient.')
+    print('     -lambdas <group=lambda,..> Override the L2 lambda of parameter groups (ex: bert=7e-5,fc1=0.5). Defaults are L2_LAMBDAS of the model.')
+    print('     -epochs <amount>           Amount of epochs to train for. Default is {}.'.format(EPOCHS))
+    print('     -lr <rate>                 Learning rate of the optimizer. Default is {}.'.format(LEARNING_RATE))
+    print('     -B <batch-size>            Amount of examples in each optimizer step. Default is {}.'.format(BATCH_SIZE))
+    print('     -micro <size>              Size of the micro-batches that gradients are accumulated over, or auto to use the largest that fits in memory. Default is {}.'.format(MICRO_BATCH_SIZE))
+    print('     -checkpoint <steps>        Save a full checkpoint (model, optimizer, position in the data, RNG states) every this many optimizer steps. Default is {}.'.format(CHECKPOINT_EVERY))
+    print('     -keep <amount>             Amount of checkpoints to keep. Default is {}.'.format(KEEP_CHECKPOINTS))
+    print('     --resume                   Continue from the latest checkpoint of the model (must use the same -O option).')
+    print('     -ranks <amount>            Train with this many data-parallel processes (DistributedDataParallel over gloo). The batch size is split between them. Default is {}.'.format(RANKS))
+    print('                                To train across machines, launch the script with torchrun instead (it sets RANK and WORLD_SIZE).')
+    print('     -telemetry <path>          File (.jsonl or .csv) the step timings, throughput and memory are written to every {} steps. Default is models/<folder>/<model-name>_telemetry.jsonl.'.format(PERIOD))
+    print('     -freeze <policy>           Parameters to freeze, like depth=6 (the embeddings and first 5 encoder layers), names=bert.embeddings.* or none.')
+    print('                                Add unfreeze_every=<epochs> (and min_depth=<depth>) to unfreeze one more encoder layer every few epochs. Default is FREEZING of the model.')
+    print('     -encoder <config>          The BERT or CharacterBERT encoder: pretrained, random, small or tiny (randomly initialized, no pretrained-models needed),')
+    print('                                or like hidden_size=128,layers=2,heads=2,intermediate_size=512,pretrained=false. Default is pretrained.')
+    print('     -bucket <batches>          Batch pairs of similar length together, sorting chunks of this many micro-batches of the shuffled data. 0 samples plain random batches. Default is {}.'.format(BUCKET_BATCHES))
+    print('     -mine <epochs>             Every this many epochs, score a pool of the training data with the model and train on the hardest negatives and missed positives again. Default is {} (off).'.format(MINE_EVERY))
+    print('     -mine-pool <amount>        Amount of training examples scored when mining. Default is {}.'.format(MINE_POOL))
+    print('     -mine-keep <amount>        Amount of hard negatives (and at most as many missed positives) mixed into the next epochs. Default is {}.'.format(MINE_KEEP))
+    print('     -eval-batch <size>         Amount of pairs in each batch when evaluating on the validation and test data (without gradients). Default is {}.'.format(EVAL_BATCH_SIZE))
+    print('     -validate-only             Only evaluate on the validation data after each epoch (skip the test sets).')
+    print('     --profile                  Record a window of training steps and of validation batches with torch.profiler to models/<folder>/<model-name>_profile')
+    print('                                (Chrome/TensorBoard traces and summary.txt with the top operators and modules).')
+    print('     -print-every <seconds>     Least amount of seconds between the batch statistics printed to the console (0 prints every batch). Default is {}.'.format(PRINT_EVERY))
     print('  SUBCOMMAND:')
     print('     --help                     Prints out this usage information and exit.')
 
@@ -46,154 +138,275 @@ def split_test_data(df):
     df_data = df[:, 0:2]
     return df_data, df_labels
 
-def send_batch_data(epoch, batch_num, batch_data, batch_size, forward, labels, accuracy, loss, running_accuracy, running_loss, table):
-    # To send the training examples, we need the epoch and batch number on each example
-    batch_epoch = np.tile(np.array([epoch, batch_num]), (batch_size, 1))
-
-    # Includes, the epoch, batch number, positive softmax, negative softmax, prediction, and labels
-    train_examples = np.concatenate((batch_epoch, # epoch/batch
-                                    batch_data, # titles
-                                    np.round(forward[:, 1].cpu().detach().numpy().reshape(batch_size, 1), 4).astype(str).astype(float),
-                                    np.round(forward[:, 0].cpu().detach().numpy().reshape(batch_size, 1), 4).astype(str).astype(float),
-                                    torch.argmax(forward, dim=1).cpu().detach().numpy().reshape(batch_size, 1),
-                                    labels.astype(int).reshape(batch_size, 1)),
-                                    axis=1)
-
-    # Need to put the data into a dictionary to send it, so these are the keys for sending the batch data and training examples
-    put_batch_labels = ['epoch', 'batch', 'accuracy', 'loss', 'runningAccuracy', 'runningLoss']
-    train_examples_labels = ['epoch', 'batch', 'title1', 'title2', 'positivePercentage', 'negativePercentage', 'modelPrediction', 'label']
-    train_examples = train_examples.tolist()
-
-    # Going to use zip() to create the dictionary, so have a list of the elements in order
-    batch_info = [epoch, 
-                  batch_num,
-                  float('%.4f'%(accuracy)),
-                  float('%.4f'%(loss.item())),
-                  float('%.4f'%(running_accuracy)),
-                  float('%.4f'%(running_loss))]
-    
-    # Put the data that needs to be send into dictionaries
-    batch_info = [dict(zip(put_batch_labels, batch_info))]
-    train_examples_data = []
-    for example in train_examples:
-        train_examples_data.append(dict(zip(train_examples_labels, example)))
-    train_examples_data = [train_examples_data]
-    
-    # Make the put request
-    requests.put('http://localhost:3000/add_batch_data', json={'model_name': model_name, 'data': batch_info, 'table': table})
-    requests.put('http://localhost:3000/add_examples_data', json={'model_name': model_name, 'data': train_examples_data, 'table': table})
-
-def validation(net, epoch, data, labels, using_dashboard, name):
+def save_run_metadata(folder, model_name, metadata):
+    '''
+    Saves the settings of the training run next to the models
+    '''
+
+    with open('models/{}/{}_run.json'.format(folder, model_name), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+def load_architecture(using_model):
+    '''
+    Imports the SiameseNetwork and forward_prop of a model given to -M
+    '''
+
+    if using_model == "characterbert":
+        from supervised_product_matching.model_architectures.characterbert_classifier import SiameseNetwork, forward_prop
+
+    elif using_model == "bert":
+        from supervised_product_matching.model_architectures.bert_classifier import SiameseNetwork, forward_prop
+
+    elif using_model == "scaled-characterbert-concat":
+        from supervised_product_matching.model_architectures.characterbert_transformer_concat import SiameseNetwork, forward_prop
+
+    elif using_model == "scaled-characterbert-add":
+        from supervised_product_matching.model_architectures.characterbert_transformer_add import SiameseNetwork, forward_prop
+
+    else:
+        return None
+
+    return SiameseNetwork, forward_prop
+
+def report_suite(reporter, epoch, name, data, labels, forward, criterion, batch_size):
+    '''
+    Reports the examples of an evaluated suite (to NLP Dashboard or the local store) in batches of batch_size
+    '''
+
     running_loss = 0.0
     running_accuracy = 0.0
     current_batch = 0
-    running_tn = 0
-    running_fp = 0
-    running_fn = 0
-    running_tp = 0
-    for i, position in enumerate(range(0, len(data), VAL_BATCH_SIZE)):
+    for i, position in enumerate(range(0, len(data), batch_size)):
         current_batch += 1
-        if (position + VAL_BATCH_SIZE > len(data)):
-            batch_data = data[position:]
-            batch_labels = labels[position:]
-        else:
-            batch_data = data[position:position + VAL_BATCH_SIZE]
-            batch_labels = labels[position:position + VAL_BATCH_SIZE]
-
-        try:
-            # Forward propagation
-            loss, forward = forward_prop(batch_data, batch_labels, net, criterion)
-            
-            # Get the predictions from the net
-            y_pred = torch.argmax(forward, dim=1).cpu()
+        batch_data = data[position:position + batch_size]
+        batch_labels = labels[position:position + batch_size]
+        batch_forward = torch.from_numpy(forward[position:position + batch_size])
+        with torch.no_grad():
+            loss = criterion(batch_forward, torch.from_numpy(batch_labels).long()).item()
+        accuracy = np.sum(np.argmax(forward[position:position + batch_size], axis=1) == batch_labels) / float(batch_labels.shape[0])
+        running_loss += loss
+        running_accuracy += accuracy
+        reporter.report(name, *batch_records(epoch,
+                                             i + 1,
+                                             batch_data,
+                                             batch_forward,
+                                             batch_labels,
+                                             accuracy,
+                                             loss,
+                                             running_accuracy / current_batch,
+                                             running_loss / current_batch))
+
+        # Clear our running variables every PERIOD batches
+        if (current_batch == PERIOD):
+            current_batch = 0
+            running_loss = 0
+            running_accuracy = 0
+
+def evaluate(net, forward_prop, criterion, evaluator, epoch, reporter, report_batch_size, telemetry=None, profiler=None):
+    '''
+    Evaluates the net on every suite of the evaluator in one pass, prints their metrics
+    and returns them (by suite name)
+    '''
 
-            # Calculate accuracy
-            accuracy = np.sum(y_pred.detach().numpy() == batch_labels) / float(batch_labels.shape[0])
-
-            # Get the confusion matrix and calculate precision, recall and F1 score
-            confusion = confusion_matrix(batch_labels, y_pred.detach().numpy(), labels=[0, 1])
-            tn, fp, fn, tp = confusion.ravel()
-            running_tn += tn
-            running_fp += fp
-            running_fn += fn
-            running_tp += tp
-            precision = tp / (tp + fp)
-            recall = tp / (tp + fn)
-            f1_score = 2 * ((precision * recall) / (precision + recall))
-
-            # Add to running loss and accuracy (every 10 batches)
-            running_loss += loss.item()
-            running_accuracy += accuracy
+    start = time.perf_counter()
+    forward = evaluator.score(net, forward_prop, criterion, timer=StepTimer(), telemetry=telemetry, profiler=profiler)
+    results = evaluator.metrics(forward, criterion)
+    print('Evaluated {} pairs ({} unique) in {:.1f}s'.format(evaluator.total_pairs(), len(evaluator.pairs), time.perf_counter() - start))
+    for name, metrics in results.items():
+        print(format_metrics(name, metrics))
 
-            # Send the data to the NLPDashboardServer
-            if using_dashboard:   
-                send_batch_data(epoch,
-                                i + 1,
-                                batch_data,
-                                VAL_BATCH_SIZE,
-                                forward,
-                                batch_labels,
-                                accuracy,
-                                loss,
-                                running_accuracy / current_batch,
-                                running_loss / current_batch,
-                                name)
-
-            # Print statistics every batch
-            #print("Torch memory allocator: {} bytes".format(torch.cuda.memory_reserved()))
-            print('%s Batch: %5d, Loss: %.6f, Accuracy: %.6f, Running Loss: %.6f, Running Accuracy: %.6f, Precision: %.3f, Recall: %.3f, F1 Score: %.3f' %
-                    (name, i + 1, loss, accuracy, running_loss / current_batch, running_accuracy / current_batch, precision, recall, f1_score))
+    # Send the examples to the NLPDashboardServer (or the local store)
+    if reporter is not None:
+        for name, data, labels, suite_forward in evaluator.outputs(forward):
+            report_suite(reporter, epoch, name, data, labels, suite_forward, criterion, report_batch_size)
 
-            # Clear our running variables every 10 batches
-            if (current_batch == PERIOD):
-                current_batch = 0
-                running_loss = 0
-                running_accuracy = 0
-            
-        
-        except RuntimeError as e:
-            if "out of memory" in str(e):
-                print("WARNING: Ran out of memory. Skipping Batch.")
-                gc.collect()
-                torch.cuda.empty_cache()
-    
-    # Get the statistics for the whole data
-    final_precision = running_tp / (running_tp + running_fp)
-    final_recall = running_tp / (running_tp + running_fn)
-    final_f1_score = 2 * ((final_precision * final_recall) / (final_precision + final_recall))
-    print('%s: Precision: %.3f, Recall: %.3f, F1 Score: %.3f' % (name, final_precision, final_recall, final_f1_score))
+    return results
 
-if __name__ == '__main__':
-    argv = sys.argv[1:]
-    using_model = "characterbert"
-
-    # Get the folder name in models
-    folder = 'default'
+def parse_options(argv):
+    '''
+    Parses the command line into the options of the training run
+    '''
 
-    # Get the model name from the terminal
-    model_name = 'model'
+    options = {'using_model': 'characterbert',
+               'using_dashboard': False,
+               'delete_table': False,
+               'store': None,
+               'train_size': TRAIN_SIZE,
+               'num_workers': NUM_WORKERS,
+               'seed': SEED,
+               'l2_mode': 'gradient',
+               'l2_lambdas': None,
+               'epochs': EPOCHS,
+               'learning_rate': LEARNING_RATE,
+               'batch_size': BATCH_SIZE,
+               'micro_batch_size': MICRO_BATCH_SIZE,
+               'checkpoint_every': CHECKPOINT_EVERY,
+               'keep_checkpoints': KEEP_CHECKPOINTS,
+               'resume': False,
+               'ranks': RANKS,
+               'telemetry': None,
+               'freezing': None,
+               'encoder': None,
+               'bucket_batches': BUCKET_BATCHES,
+               'mine_every': MINE_EVERY,
+               'mine_pool': MINE_POOL,
+               'mine_keep': MINE_KEEP,
+               'eval_batch_size': EVAL_BATCH_SIZE,
+               'test_suites': TEST_SUITES,
+               'profile': False,
+               'print_every': PRINT_EVERY,
+               # Get the folder name in models
+               'folder': 'default',
+               # Get the model name from the terminal
+               'model_name': 'model'}
 
     # Parse the options
     while len(argv) > 0:
         if argv[0] == '-visualizer':
             argv = argv[1:]
-            using_dashboard = True
+            options['using_dashboard'] = True
 
         elif argv[0] == '-O':
             argv = argv[1:]
-            folder = argv[0]
+            options['folder'] = argv[0]
             argv = argv[1:]
-            model_name = argv[0]
+            options['model_name'] = argv[0]
             argv = argv[1:]
         
         elif argv[0] == '-M':
             argv = argv[1:]
-            using_model = argv[0]
+            options['using_model'] = argv[0]
             argv = argv[1:]
         
         elif argv[0] == '-dtable':
             argv = argv[1:]
-            requests.delete('http://localhost:3000/delete_db', json={'model_name': model_name})
+            options['delete_table'] = True
+
+        elif argv[0] == '-store':
+            argv = argv[1:]
+            options['store'] = argv[0]
+            argv = argv[1:]
+
+        elif argv[0] == '-split':
+            argv = argv[1:]
+            options['train_size'] = float(argv[0]) if '.' in argv[0] else int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-workers':
+            argv = argv[1:]
+            options['num_workers'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-seed':
+            argv = argv[1:]
+            options['seed'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-l2':
+            argv = argv[1:]
+            if argv[0] not in L2_MODES:
+                print('Unknown L2 mode {}. Options are {}.'.format(argv[0], ', '.join(L2_MODES)))
+                usage()
+                exit(1)
+            options['l2_mode'] = argv[0]
+            argv = argv[1:]
+
+        elif argv[0] == '-lambdas':
+            argv = argv[1:]
+            options['l2_lambdas'] = parse_lambdas(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-epochs':
+            argv = argv[1:]
+            options['epochs'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-lr':
+            argv = argv[1:]
+            options['learning_rate'] = float(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-B':
+            argv = argv[1:]
+            options['batch_size'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-micro':
+            argv = argv[1:]
+            options['micro_batch_size'] = argv[0] if argv[0] == 'auto' else int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-checkpoint':
+            argv = argv[1:]
+            options['checkpoint_every'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-keep':
+            argv = argv[1:]
+            options['keep_checkpoints'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '--resume':
+            argv = argv[1:]
+            options['resume'] = True
+
+        elif argv[0] == '-ranks':
+            argv = argv[1:]
+            options['ranks'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-telemetry':
+            argv = argv[1:]
+            options['telemetry'] = argv[0]
+            argv = argv[1:]
+
+        elif argv[0] == '-freeze':
+            argv = argv[1:]
+            options['freezing'] = parse_policy(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-encoder':
+            argv = argv[1:]
+            options['encoder'] = parse_encoder(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-bucket':
+            argv = argv[1:]
+            options['bucket_batches'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-mine':
+            argv = argv[1:]
+            options['mine_every'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-mine-pool':
+            argv = argv[1:]
+            options['mine_pool'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-mine-keep':
+            argv = argv[1:]
+            options['mine_keep'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-eval-batch':
+            argv = argv[1:]
+            options['eval_batch_size'] = int(argv[0])
+            argv = argv[1:]
+
+        elif argv[0] == '-validate-only':
+            argv = argv[1:]
+            options['test_suites'] = []
+
+        elif argv[0] == '--profile':
+            argv = argv[1:]
+            options['profile'] = True
+
+        elif argv[0] == '-print-every':
+            argv = argv[1:]
+            options['print_every'] = float(argv[0])
+            argv = argv[1:]
 
         else:
             break
@@ -208,149 +421,411 @@ if __name__ == '__main__':
         else:
             break
 
-    if using_dashboard:
-        # Make POST request to model server
-        requests.post('http://localhost:3000/create_db', json={'model_name': model_name, 'tables': ['Training',
-                                                                                                    'Validation',
-                                                                                                    'Test Laptop (General)',
-                                                                                                    'Test Laptop (Same Title) (Space)',
-                                                                                                    'Test Laptop (Same Title) (No Space)',
-                                                                                                    'Test Laptop (Different Title) (Space)',
-                                                                                                    'Test Laptop (Different Title) (No Space)']})
-
-    print('\nOutputing models to {} with base name {}\n'.format(folder, model_name))
-
-    # Create the folder for the model if it doesn't already exist
-    if not os.path.exists('models/{}'.format(folder)):
-        os.mkdir('models/{}'.format(folder))
-
-    # Create the data if it doesn't exist
-    if not os.path.exists('data/train/total_data.csv') or not os.path.exists('data/test/final_laptop_test_data.csv'):
-        create_data()
-
-    # Load the data
-    train_data = pd.read_csv('data/train/total_data.csv', nrows=TRAIN_SIZE, chunksize=BATCH_SIZE)
-    val_data = pd.read_csv('data/train/total_data.csv', skiprows=TRAIN_SIZE, names=['title_one', 'title_two', 'label', 'index'])
-    del val_data['index']
-    val_data = val_data.to_numpy()
-    val_labels = val_data[:, 2].astype('float32')
-    val_data = val_data[:, 0:2]
-
-    test_laptop_data, test_laptop_labels = split_test_data(pd.read_csv('data/test/final_laptop_test_data.csv')) # General laptop test data
-    test_gb_space_data, test_gb_space_labels = split_test_data(pd.read_csv('data/test/final_gb_space_laptop_test.csv')) # Same titles; Substituted storage attributes
-    test_gb_no_space_data, test_gb_no_space_labels = split_test_data(pd.read_csv('data/test/final_gb_no_space_laptop_test.csv')) # Same titles; Substituted storage attributes
-    test_retailer_gb_space_data, test_retailer_gb_space_labels = split_test_data(pd.read_csv('data/test/final_retailer_gb_space_test.csv')) # Different titles; Substituted storage attributes
-    test_retailer_gb_no_space_data, test_retailer_gb_no_space_labels = split_test_data(pd.read_csv('data/test/final_retailer_gb_no_space_test.csv')) # Different titles; Substituted storage attributes
-    print('Loaded all test files')
+    return options
 
-    # Initialize the model
-    net = None
-    if using_model == "characterbert":
-        from supervised_product_matching.model_architectures.characterbert_classifier import SiameseNetwork, forward_prop
-        net = SiameseNetwork().to(Common.device)
-
-    elif using_model == "bert":
-        from supervised_product_matching.model_architectures.bert_classifier import SiameseNetwork, forward_prop
-        net = SiameseNetwork().to(Common.device)
+def train(rank, world_size, options):
+    '''
+    Trains a model as one of world_size data-parallel ranks (rank 0 alone for a normal run).
+    Every rank trains on its own shard of the training data and the gradients are all-reduced,
+    while rank 0 also saves the models and checkpoints, validates and reports to NLP Dashboard.
+    Returns the metrics of the last evaluation by suite name on rank 0 (None on the other ranks,
+    or if there was no epoch left to train).
+    '''
 
-    elif using_model == "scaled-characterbert-concat":
-        from supervised_product_matching.model_architectures.characterbert_transformer_concat import SiameseNetwork, forward_prop
-        net = SiameseNetwork().to(Common.device)
+    using_model = options['using_model']
+    using_dashboard = options['using_dashboard']
+    seed = options['seed']
+    epochs = options['epochs']
+    learning_rate = options['learning_rate']
+    l2_mode = options['l2_mode']
+    batch_size = options['batch_size']
+    micro_batch_size = options['micro_batch_size']
+    checkpoint_every = options['checkpoint_every']
+    folder = options['folder']
+    model_name = options['model_name']
+    is_main = rank == 0
+
+    distributed.init_distributed(rank, world_size)
+
+    # Each rank accumulates its part of the batch and the all-reduce averages them
+    rank_batch_size = max(1, batch_size // world_size)
+
+    # Sends the batches to NLP Dashboard in the background, or writes them to a local store (only from rank 0)
+    reporter = None
+    if is_main:
+        if options['store'] is not None:
+            reporter = MetricsStore(options['store'], model_name)
+        elif using_dashboard:
+            reporter = DashboardReporter(model_name)
+
+        if reporter is not None:
+            if options['delete_table']:
+                reporter.delete_db()
+            reporter.create_db(['Training',
+                                'Validation',
+                                'Test Laptop (General)',
+                                'Test Laptop (Same Title) (Space)',
+                                'Test Laptop (Same Title) (No Space)',
+                                'Test Laptop (Different Title) (Space)',
+                                'Test Laptop (Different Title) (No Space)'])
+
+        print('\nOutputing models to {} with base name {}\n'.format(folder, model_name))
+
+        # Create the folder for the model if it doesn't already exist
+        os.makedirs('models/{}'.format(folder), exist_ok=True)
+
+        # Create the data if it doesn't exist
+        if not os.path.exists('data/train/total_data.csv') or not os.path.exists('data/test/final_laptop_test_data.csv'):
+            create_data()
+
+    # The other ranks wait for the data to be created
+    distributed.barrier(world_size)
+
+    # Make the shuffling and the model initialization reproducible (DDP copies the model of rank 0 to the others,
+    # so the ranks only differ in their dropout masks)
+    seed_everything(seed + rank)
+
+    # Load the data once and split it into training and validation data
+    train_dataset, val_dataset = TitlePairDataset.from_csv('data/train/total_data.csv').split(options['train_size'])
+    val_data, val_labels = val_dataset.data, val_dataset.labels
+
+    if is_main:
+        # The validation data and every test set are evaluated together after each epoch
+        evaluator = EvaluationEngine([('Validation', val_data, val_labels)] +
+                                     [(name, *split_test_data(pd.read_csv(path))) for name, path in options['test_suites']],
+                                     batch_size=options['eval_batch_size'])
+        print('Loaded all test files')
 
-    elif using_model == "scaled-characterbert-add":
-        from supervised_product_matching.model_architectures.characterbert_transformer_add import SiameseNetwork, forward_prop
-        net = SiameseNetwork().to(Common.device)
-    else:
-        print('Model {} not found.').format(using_model)
+    # Initialize the model
+    architecture = load_architecture(using_model)
+    if architecture is None:
+        print('Model {} not found.'.format(using_model))
         sys.exit(1)
 
+    SiameseNetwork, forward_prop = architecture
+    model = SiameseNetwork(l2_lambdas=options['l2_lambdas'], freezing=options['freezing'], encoder=options['encoder']).to(Common.device)
+
     # Using cross-entropy because we are making a classifier
     criterion = nn.CrossEntropyLoss()
 
     # Using Adam optimizer
+    # Frozen parameters never get a gradient, so Adam does not create state for them until they are unfrozen
     #opt = AdamW(net.parameters(), lr=1e-5, weight_decay=0.001)
-    opt = optim.Adam(net.parameters(), lr=1e-5)
-
-    print("************* TRAINING *************")
+    if l2_mode == 'decay':
+        # The L2 lambdas become weight decay, so forward_prop does not compute the penalty
+        opt = optim.Adam(model.regularizer.param_groups(model), lr=learning_rate)
+    else:
+        opt = optim.Adam(model.parameters(), lr=learning_rate)
+
+    # Full checkpoints to resume training from (only rank 0 writes them, every rank reads them).
+    # The checkpoint is read before the micro-batch size is chosen, as a resumed run has to keep its batches.
+    checkpoints = CheckpointManager('models/{}/checkpoints'.format(folder), model_name, keep=options['keep_checkpoints'])
+    checkpoint_path = checkpoints.latest() if options['resume'] else None
+    checkpoint = checkpoints.read(checkpoint_path) if checkpoint_path is not None else None
+
+    # A new run starts without the checkpoints of an earlier run with the same folder and name
+    if not options['resume'] and is_main:
+        checkpoints.clear()
+
+    if checkpoint is not None:
+        if micro_batch_size not in ('auto', checkpoint['state']['micro_batch_size']) and is_main:
+            print('Using the micro-batch size of the checkpoint ({}) instead of {}'.format(checkpoint['state']['micro_batch_size'], micro_batch_size))
+        micro_batch_size = checkpoint['state']['micro_batch_size']
+
+    # Find the largest micro-batch that fits in memory, and accumulate gradients over micro-batches to get to the batch size
+    micro_batch_probed = micro_batch_size == 'auto'
+    if micro_batch_probed:
+        model.train()
+        micro_batch_size = probe_micro_batch_size(model, forward_prop, criterion, train_dataset.data, train_dataset.labels, rank_batch_size)
+
+    # The ranks have to step together, so they all use the smallest micro-batch
+    micro_batch_size = distributed.min_across_ranks(min(micro_batch_size, rank_batch_size), world_size)
+    accumulation_steps = math.ceil(rank_batch_size / micro_batch_size)
+    if is_main:
+        print('Ranks: {}, Micro-batch size: {}, Accumulation steps: {}'.format(world_size, micro_batch_size, accumulation_steps))
+
+    # Every rank shuffles the training data the same way and takes its own shard of it.
+    # Bucketing puts pairs of similar length in the same micro-batch so less of it is padding.
+    if options['bucket_batches']:
+        train_sampler = BucketBatchSampler(pair_lengths(train_dataset.data), micro_batch_size, bucket_batches=options['bucket_batches'],
+                                           seed=seed, num_replicas=world_size, rank=rank)
+    else:
+        train_sampler = EpochShuffleSampler(len(train_dataset), seed=seed, num_replicas=world_size, rank=rank)
+    train_loader = make_loader(train_dataset, train_sampler, micro_batch_size, num_workers=options['num_workers'], seed=seed + rank)
+
+    # All-reduce the gradients between the ranks (net is the model itself for a single rank)
+    net = distributed.wrap(model, world_size)
+
+    # forward_prop adds the L2 penalty through net.regularizer
+    net.regularizer = model.regularizer
+
+    if is_main:
+        save_run_metadata(folder, model_name, {'model': using_model,
+                                               'device': str(Common.device),
+                                               'train_size': len(train_dataset),
+                                               'val_size': len(val_dataset),
+                                               'seed': seed,
+                                               'epochs': epochs,
+                                               'learning_rate': learning_rate,
+                                               'l2_mode': l2_mode,
+                                               'l2_lambdas': model.regularizer.lambdas,
+                                               'freezing': model.freezing.describe(),
+                                               'encoder': (options['encoder'] or EncoderConfig()).describe(),
+                                               'hidden_size': model.h_size,
+                                               'trainable_params': count_parameters(model)[0],
+                                               'batch_size': batch_size,
+                                               'ranks': world_size,
+                                               'micro_batch_size': micro_batch_size,
+                                               'micro_batch_probed': micro_batch_probed,
+                                               'bucket_batches': options['bucket_batches'],
+                                               'accumulation_steps': accumulation_steps,
+                                               'checkpoint_every': checkpoint_every,
+                                               'mine_every': options['mine_every'],
+                                               'mine_pool': options['mine_pool'],
+                                               'mine_keep': options['mine_keep'],
+                                               'resumed': options['resume']})
+
+    start_epoch = 0
+    step = 0
+    state = {}
+    if options['resume']:
+        if checkpoint is None:
+            if is_main:
+                print('No checkpoint found in models/{}/checkpoints. Starting from the beginning.'.format(folder))
+        else:
+            # Restored last because it restores the RNG states
+            step, state = checkpoints.restore(checkpoint, model, opt)
+            checkpoint = None
+            start_epoch = state['epoch']
+            train_sampler.set_extra(state.get('mined', []))
+
+            # The checkpoint has the RNG states of rank 0, the other ranks need their own
+            if not is_main:
+                seed_everything(seed + step * world_size + rank)
+
+            if is_main:
+                print('Resuming from {} (epoch {}, micro-batch {})'.format(checkpoint_path, start_epoch + 1, state['batch']))
+
+    # Time every part of a step and write the throughput and memory to a file (only on rank 0)
+    timer = StepTimer()
+    telemetry = None
+    if is_main:
+        telemetry_path = options['telemetry'] or 'models/{}/{}_telemetry.jsonl'.format(folder, model_name)
+        telemetry = TelemetryWriter(telemetry_path, window=PERIOD)
+        validation_telemetry = TelemetryWriter(os.path.splitext(telemetry_path)[0] + '_validation' + os.path.splitext(telemetry_path)[1], window=PERIOD)
+    console = RateLimiter(options['print_every'])
+
+    # Profile a window of the training steps (and of the first validation) on rank 0
+    profiler = None
+    if is_main and options['profile']:
+        profile_dir = 'models/{}/{}_profile'.format(folder, model_name)
+        profiler = StepProfiler(os.path.join(profile_dir, 'training'), net=model).start()
+
+    # Retries micro-batches that run out of memory as smaller chunks
+    oom_runner = AdaptiveBatchRunner()
+
+    def propagate(chunk_data, chunk_labels, sync):
+        '''
+        Forward and backward propagation of a chunk of a micro-batch.
+        Returns the loss summed over the chunk and the (detached) outputs of the net.
+        '''
+
+        # The gradients are only all-reduced on the last chunk of the last micro-batch of a step
+        with distributed.no_sync(net, sync):
+            # Forward propagation
+            loss, forward = forward_prop(chunk_data, chunk_labels, net, criterion, regularize=l2_mode == 'penalty', timer=timer)
+
+            # Backprop (scaled so the accumulated gradient is the mean over the whole batch)
+            with timed(timer, 'backward'):
+                (loss * len(chunk_labels) / rank_batch_size).backward()
+
+        return loss.item() * len(chunk_labels), forward.detach()
+
+    # Scoring keeps no activations for backward, so it can use bigger batches than training
+    miner = HardExampleMiner(options['mine_pool'], options['mine_keep'], micro_batch_size * 4, seed=seed)
+
+    if is_main:
+        print("************* TRAINING *************")
+
+    results = None
+    for epoch in range(start_epoch, epochs):
+        # Unfreeze the layers scheduled for this epoch
+        if model.freezing.apply(model, epoch):
+            # DDP only all-reduces the parameters that were trainable when it wrapped the model
+            net = distributed.wrap(model, world_size)
+            net.regularizer = model.regularizer
+
+        if is_main:
+            trainable, total = count_parameters(model)
+            print('Epoch {}: training {} of {} parameters'.format(epoch + 1, trainable, total))
+
+        # Skip the micro-batches of this epoch that were already trained on (only when resuming)
+        batch_offset = state.get('batch', 0)
+
+        # Replace the mined examples with the ones the model currently gets most wrong
+        # (rank 0 mines so every rank shuffles the same examples in)
+        if options['mine_every'] and epoch > 0 and epoch % options['mine_every'] == 0 and batch_offset == 0:
+            mined = None
+            if is_main:
+                mine_start = time.perf_counter()
+                mined, mine_stats = miner.mine(model, forward_prop, criterion, train_dataset, epoch)
+                print('Mined {} hard negatives and {} missed positives from {} examples (accuracy {:.3f}) in {:.1f}s'.format(
+                      mine_stats['hard_negatives'], mine_stats['missed_positives'], mine_stats['pool'], mine_stats['pool_accuracy'], time.perf_counter() - mine_start))
+            train_sampler.set_extra(distributed.broadcast_object(mined, world_size))
+        train_sampler.set_epoch(epoch, start_batch=batch_offset, batch_size=micro_batch_size)
+        examples_seen = state.get('examples', 0)
+        last_batch = batch_offset + len(train_loader)
 
-    # 10 epochs
-    for epoch in range(10):
         # Iterate through each training batch
         net.train()
-        current_batch = 0
-        running_loss = 0.0
-        running_accuracy = 0.0
-        for i, position in enumerate(range(0, TRAIN_SIZE, BATCH_SIZE)):
+        current_batch = state.get('current_batch', 0)
+        running_loss = state.get('running_loss', 0.0)
+        running_accuracy = state.get('running_accuracy', 0.0)
+        l2_penalty = state.get('l2_penalty', 0.0)
+        state = {}
+        opt.zero_grad()
+
+        # Do not count the time between epochs
+        timer.end_step()
+        data_start = time.perf_counter()
+        for i, (batch_data, batch_labels) in enumerate(train_loader, start=batch_offset):
+            # The time spent waiting for the DataLoader
+            timer.add_time('data', time.perf_counter() - data_start)
+            timer.count('examples', len(batch_labels))
             current_batch += 1
-            batch_data = next(train_data)
-            del batch_data['index']
-            batch_data = batch_data.to_numpy()
-            batch_labels = batch_data[:, 2].astype('float32')
-            batch_data = batch_data[:, 0:2]
-            
-            try:
-                # Zero the parameter gradients
-                opt.zero_grad()
-                
-                # Forward propagation
-                loss, forward = forward_prop(batch_data, batch_labels, net, criterion)
+            examples_seen += len(batch_labels)
+            stepped = False
 
-                # Calculate accuracy
-                accuracy = np.sum(torch.argmax(forward, dim=1).cpu().detach().numpy() == batch_labels) / float(forward.size()[0])
+            # Only step once the gradients of a whole batch are accumulated
+            step_now = (i + 1) % accumulation_steps == 0 or i + 1 == last_batch
+            
+            # Forward and backward propagation, split into smaller chunks if the micro-batch runs out of memory
+            # (the gradients of the trainable parameters are restored if a chunk fails during backward)
+            chunks = oom_runner.run(lambda chunk_data, chunk_labels, last: propagate(chunk_data, chunk_labels, step_now and last),
+                                    batch_data, batch_labels, timer=timer, params=trainable_parameters(model))
+            forward = torch.cat([chunk_forward for chunk_loss, chunk_forward in chunks])
+            loss = sum(chunk_loss for chunk_loss, chunk_forward in chunks) / len(batch_labels)
 
-                # Add to both the running accuracy and running loss (every 10 batches)
-                running_accuracy += accuracy
-                running_loss += loss.item()
+            # Calculate accuracy
+            accuracy = np.sum(torch.argmax(forward, dim=1).cpu().numpy() == batch_labels) / float(forward.size()[0])
 
-                # Backprop
-                loss.backward()
+            if step_now:
+                # Add the gradient of the L2 penalty without building a graph for it
+                if l2_mode == 'gradient':
+                    with timed(timer, 'l2'):
+                        l2_penalty = model.regularizer.apply_gradients()
 
                 # Clip the gradient to minimize chance of exploding gradients
-                torch.nn.utils.clip_grad_norm_(net.parameters(), 0.01)
+                with timed(timer, 'clip'):
+                    torch.nn.utils.clip_grad_norm_(net.parameters(), 0.01)
 
                 # Apply the gradients
-                opt.step()
-                
+                with timed(timer, 'optimizer'):
+                    opt.step()
+                    opt.zero_grad()
+                step += 1
+                stepped = True
+
+            # The L2 penalty of the last step (it is only computed once per step)
+            loss += l2_penalty
+
+            # Add to both the running accuracy and running loss (every 10 batches)
+            running_accuracy += accuracy
+            running_loss += loss
+            
+            if is_main:
                 # Send the data to the NLPDashboardServer
-                if using_dashboard:
-                    send_batch_data(epoch + 1,
-                                    i + 1,
-                                    batch_data,
-                                    BATCH_SIZE,
-                                    forward,
-                                    batch_labels,
-                                    accuracy,
-                                    loss,
-                                    running_accuracy / current_batch,
-                                    running_loss / current_batch,
-                                    'Training')
-
-                # Print statistics every batch
+                if reporter is not None:
+                    with timed(timer, 'dashboard'):
+                        reporter.report('Training', *batch_records(epoch + 1,
+                                                                   i + 1,
+                                                                   batch_data,
+                                                                   forward,
+                                                                   batch_labels,
+                                                                   accuracy,
+                                                                   loss,
+                                                                   running_accuracy / current_batch,
+                                                                   running_loss / current_batch))
+
+                # Print statistics every batch (or as often as the console allows)
                 #print("Torch memory allocator: {} bytes".format(torch.cuda.memory_reserved()))
-                print('Training Epoch: %d, Batch %5d, Loss: %.6f, Accuracy: %.6f, Running Loss: %.6f, Running Accuracy %.6f' %
-                        (epoch + 1, i + 1, loss, accuracy, running_loss / current_batch, running_accuracy / current_batch))
-                
-                # Clear our running variables every 10 batches
-                if (current_batch == PERIOD):
-                    current_batch = 0
-                    running_loss = 0
-                    running_accuracy = 0
-
-
-            except RuntimeError as e:
-                if "out of memory" in str(e):
-                    print("WARNING: Ran out of memory. Skipping Batch.")
-                    gc.collect()
-                    torch.cuda.empty_cache()
-
-        train_data = pd.read_csv('data/train/total_data.csv', nrows=TRAIN_SIZE, chunksize=BATCH_SIZE)
-        torch.save(net.state_dict(), 'models/{}/{}.pt'.format(folder, model_name + '_epoch' + str(epoch + 1)))
-
-        # Test the model
-        net.eval()
-        validation(net, epoch + 1, val_data, val_labels, using_dashboard, 'Validation')
-        validation(net, epoch + 1, test_laptop_data, test_laptop_labels, using_dashboard, 'Test Laptop (General)')
-        validation(net, epoch + 1, test_gb_space_data, test_gb_space_labels, using_dashboard, 'Test Laptop (Same Title) (Space)')
-        validation(net, epoch + 1, test_gb_no_space_data, test_gb_no_space_labels, using_dashboard, 'Test Laptop (Same Title) (No Space)')
-        validation(net, epoch + 1, test_retailer_gb_space_data, test_retailer_gb_space_labels, using_dashboard, 'Test Laptop (Different Title) (Space)')
-        validation(net, epoch + 1, test_retailer_gb_no_space_data, test_retailer_gb_no_space_labels, using_dashboard, 'Test Laptop (Different Title) (No Space)')
\ No newline at end of file
+                if console.ready():
+                    print('Training Epoch: %d, Batch %5d, Loss: %.6f, Accuracy: %.6f, Running Loss: %.6f, Running Accuracy %.6f' %
+                            (epoch + 1, i + 1, loss, accuracy, running_loss / current_batch, running_accuracy / current_batch))
+            
+            # Clear our running variables every 10 batches
+            if (current_batch == PERIOD):
+                current_batch = 0
+                running_loss = 0
+                running_accuracy = 0
+
+            # Save a full checkpoint (only right after a step, so no gradients are half accumulated)
+            if is_main and stepped and step % checkpoint_every == 0:
+                checkpoints.save(step, model, opt, {'epoch': epoch,
+                                                    'batch': i + 1,
+                                                    'examples': examples_seen,
+                                                    'micro_batch_size': micro_batch_size,
+                                                    'current_batch': current_batch,
+                                                    'running_loss': running_loss,
+                                                    'running_accuracy': running_accuracy,
+                                                    'l2_penalty': l2_penalty,
+                                                    'mined': train_sampler.extra})
+
+            if stepped and profiler is not None:
+                profiler.step()
+
+            # A step ends with the optimizer step, so its micro-batches are timed together
+            if stepped and telemetry is not None:
+                summary = telemetry.record(timer.end_step(), epoch=epoch + 1, step=step, ranks=world_size)
+                if summary is not None:
+                    print(TelemetryWriter.format_summary(summary))
+
+            data_start = time.perf_counter()
+
+        if is_main:
+            if oom_runner.splits:
+                print('Ran out of memory {} times this run (every time the micro-batch was split and retried). Chunk sizes by length bucket: {}'.format(
+                      oom_runner.splits, oom_runner.safe_sizes))
+            telemetry.flush(epoch=epoch + 1, step=step, ranks=world_size)
+            torch.save(model.state_dict(), 'models/{}/{}.pt'.format(folder, model_name + '_epoch' + str(epoch + 1)))
+
+            # Checkpoint the end of the epoch, so a resumed run starts at the next one
+            checkpoints.save(step, model, opt, {'epoch': epoch + 1, 'batch': 0, 'examples': 0,
+                                                'micro_batch_size': micro_batch_size, 'mined': train_sampler.extra})
+
+            # Test the model (without the DDP wrapper, the other ranks are not running forward passes)
+            model.eval()
+            validation_profiler = None
+            if options['profile'] and epoch == start_epoch:
+                # Only one profiler can record at a time, and the window fits in an epoch of most runs
+                profiler.stop()
+                profiler = None
+                validation_profiler = StepProfiler(os.path.join(profile_dir, 'validation'), net=model).start()
+            results = evaluate(model, forward_prop, criterion, evaluator, epoch + 1, reporter, micro_batch_size, validation_telemetry, validation_profiler)
+            if validation_profiler is not None:
+                validation_profiler.stop()
+
+        # The other ranks wait for rank 0 to finish validating
+        distributed.barrier(world_size)
+
+    if profiler is not None:
+        profiler.stop()
+
+    # Send (or write) what is still queued
+    if reporter is not None:
+        reporter.close()
+
+    distributed.cleanup(world_size)
+    return results
+
+if __name__ == '__main__':
+    options = parse_options(sys.argv[1:])
+
+    launched = distributed.launched_ranks()
+    if launched is not None:
+        # Started by torchrun (possibly on several machines), which runs one process per rank
+        train(launched[0], launched[1], options)
+    elif options['ranks'] > 1:
+        distributed.spawn(train, options['ranks'], options)
+    else:
+        train(0, 1, options)